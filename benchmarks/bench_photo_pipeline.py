@@ -0,0 +1,117 @@
+"""
+Бенчмарк конвеєра фото -> тіло запиту до Gemini.
+
+    python benchmarks/bench_photo_pipeline.py [ітерацій]
+
+"legacy" — старий шлях: read() -> BytesIO -> повне декодування -> LANCZOS ->
+getvalue() -> base64-рядок -> json.dumps. "draft" — utils/image_processing:
+BytesIO без копії, JPEG draft, base64 одразу в байти тіла.
+Кожен варіант запускається в окремому процесі, пам'ять — пік RSS процесу (VmHWM)
+понад процес, який лише отримав фото ("idle").
+"""
+import base64
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import time
+from io import BytesIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from PIL import Image, ImageDraw, ImageEnhance
+
+from utils.image_processing import INLINE_DATA_PLACEHOLDER, build_inline_body, compress_image_sync
+
+PROMPT = "Ти експерт з розпізнавання таблиць."
+
+
+def make_photo(width=4000, height=3000) -> bytes:
+    """Синтетичне 12 Мп "фото таблиці" у JPEG"""
+    img = Image.effect_noise((width, height), 24).convert("RGB")
+    draw = ImageDraw.Draw(img)
+    for y in range(0, height, 60):
+        draw.line([(0, y), (width, y)], fill=(20, 20, 20), width=4)
+    for x in range(0, width, 400):
+        draw.line([(x, 0), (x, height)], fill=(20, 20, 20), width=4)
+    buffer = BytesIO()
+    img.save(buffer, format="JPEG", quality=90)
+    return buffer.getvalue()
+
+
+def payload(data):
+    return {
+        "contents": [{"parts": [{"text": PROMPT}, {"inline_data": {"mime_type": "image/jpeg", "data": data}}]}],
+        "generationConfig": {"temperature": 0.1, "maxOutputTokens": 4096},
+    }
+
+
+def legacy_pipeline(downloaded: BytesIO) -> bytes:
+    image_bytes = downloaded.read()
+    img = Image.open(BytesIO(image_bytes))
+    if img.mode in ('RGBA', 'P'):
+        img = img.convert('RGB')
+    ratio = 800 / max(img.width, img.height)
+    if ratio < 1:
+        img = img.resize((int(img.width * ratio), int(img.height * ratio)), Image.Resampling.LANCZOS)
+    img = ImageEnhance.Contrast(img).enhance(1.3)
+    buffer = BytesIO()
+    img.save(buffer, format='JPEG', quality=60, optimize=True)
+    compressed = buffer.getvalue()
+    image_base64 = base64.b64encode(compressed).decode('utf-8')
+    return json.dumps(payload(image_base64)).encode("utf-8")
+
+
+def draft_pipeline(downloaded: BytesIO) -> bytes:
+    compressed = compress_image_sync(downloaded, 800, 60)
+    return build_inline_body(payload(INLINE_DATA_PLACEHOLDER), compressed)
+
+
+def peak_rss_kb() -> int:
+    """Пік RSS поточного процесу. VmHWM на відміну від ru_maxrss не успадковується від батька"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def run(name, photo, iterations, queue):
+    pipeline = {"legacy": legacy_pipeline, "draft": draft_pipeline, "idle": None}[name]
+    start = time.perf_counter()
+    for _ in range(iterations if pipeline else 0):
+        downloaded = BytesIO(photo)  # як bot.download_file
+        pipeline(downloaded)
+    elapsed = time.perf_counter() - start
+    queue.put((name, elapsed / max(1, iterations), peak_rss_kb()))
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    photo = make_photo()
+    print(f"Фото: {len(photo) / 1024 / 1024:.1f} МБ, 4000x3000, ітерацій: {iterations}")
+
+    ctx = multiprocessing.get_context("spawn")
+    results = {}
+    for name in ("idle", "legacy", "draft"):
+        queue = ctx.Queue()
+        proc = ctx.Process(target=run, args=(name, photo, iterations, queue))
+        proc.start()
+        results[name] = queue.get()
+        proc.join()
+
+    idle_rss = results["idle"][2]
+    for name in ("legacy", "draft"):
+        _, per_photo, rss = results[name]
+        print(f"{name:>7}: {per_photo * 1000:7.1f} мс/фото, пік пам'яті +{(rss - idle_rss) / 1024:6.1f} МБ")
+    legacy, draft = results["legacy"], results["draft"]
+    print(f"Прискорення: x{legacy[1] / draft[1]:.1f}, "
+          f"пам'ять: x{(legacy[2] - idle_rss) / max(1, draft[2] - idle_rss):.1f} менше")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
 import os
+import pytz
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -7,10 +8,37 @@ load_dotenv()
 TOKEN = os.getenv("BOT_TOKEN")
 DATABASE_URL = os.getenv("DATABASE_URL")
 PORT = int(os.getenv("PORT", 10000))
+KYIV_TZ = pytz.timezone("Europe/Kyiv")
+
+# Webhook: якщо WEBHOOK_URL задано (публічна адреса сервісу, напр. https://bot.onrender.com),
+# оновлення приходять на той самий aiohttp-сервер; інакше — long polling
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").rstrip("/")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")  # обов'язковий для webhook, однаковий на всіх екземплярах
+# Токен для /stats/* (заголовок X-Stats-Token або ?token=); якщо не задано — WEBHOOK_SECRET
+STATS_TOKEN = os.getenv("STATS_TOKEN")
+
+# Пул з'єднань з БД (спільний для всіх обробників і планувальника)
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", 1))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", 5))
 
 # API ключі
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-GEMINI_MODEL = "gemini-2.0-flash"  # Можна змінити на gemini-2.5-flash коли вийде
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")  # одна модель для всіх запитів до ШІ
+
+# Стійкість запитів до Gemini (utils/gemini_client.py)
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", 4))  # одночасних запитів
+GEMINI_MAX_RETRIES = int(os.getenv("GEMINI_MAX_RETRIES", 3))  # повторів на 429/5xx
+GEMINI_DEADLINE = float(os.getenv("GEMINI_DEADLINE", 60))  # секунд на виклик разом з повторами
+GEMINI_BREAKER_THRESHOLD = int(os.getenv("GEMINI_BREAKER_THRESHOLD", 5))  # збоїв поспіль до розмикання
+GEMINI_BREAKER_RESET = float(os.getenv("GEMINI_BREAKER_RESET", 30))  # секунд до пробного запиту
+
+# Ціни Gemini за 1M токенів, USD — для оцінки витрат у /ai_stats
+GEMINI_PRICE_INPUT = float(os.getenv("GEMINI_PRICE_INPUT", 0.30))
+GEMINI_PRICE_OUTPUT = float(os.getenv("GEMINI_PRICE_OUTPUT", 2.50))
+
+# Telegram ID адміністраторів через кому (службові команди на кшталт /ai_stats)
+ADMIN_IDS = {int(x) for x in os.getenv("ADMIN_IDS", "").replace(" ", "").split(",") if x}
 
 # SMS Fly налаштування
 SMS_FLY_API_KEY = os.getenv("SMS_FLY_API_KEY")
@@ -19,6 +47,31 @@ SMS_FLY_SENDER = os.getenv("SMS_FLY_SENDER", "YourBot")  # Ім'я відпра
 # Проксі (якщо потрібно)
 PROXY_URL = os.getenv("PROXY_URL")
 
+# Спільний HTTP-клієнт (Gemini, SMS Fly, файли Telegram)
+HTTP_LIMIT_PER_HOST = int(os.getenv("HTTP_LIMIT_PER_HOST", 10))
+HTTP_TIMEOUTS = {
+    "default": 30,
+    "gemini": 120,
+    "gemini_quick": 20,
+    "sms": 30,
+    "telegram_file": 60,
+}
+
+# Обробка зображень поза event loop: "thread" (Pillow відпускає GIL) або "process"
+IMAGE_EXECUTOR = os.getenv("IMAGE_EXECUTOR", "thread")
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", 2))
+IMAGE_BACKLOG = int(os.getenv("IMAGE_BACKLOG", 8))  # скільки фото може чекати в черзі
+
+# Кеш розпізнаних таблиць (за file_unique_id та вмістом фото)
+ANALYSIS_CACHE_TTL = int(os.getenv("ANALYSIS_CACHE_TTL", 7 * 24 * 3600))
+ANALYSIS_CACHE_SIZE = int(os.getenv("ANALYSIS_CACHE_SIZE", 128))
+
+# Дуже високі фото таблиць (висота / ширина > TABLE_SPLIT_ASPECT) можна різати на смуги,
+# які розпізнаються паралельно. Вимкнено за замовчуванням: кожна смуга — окремий виклик Gemini
+TABLE_MAX_STRIPS = int(os.getenv("TABLE_MAX_STRIPS", 1))  # 1 — не різати
+TABLE_SPLIT_ASPECT = float(os.getenv("TABLE_SPLIT_ASPECT", 2.0))
+TABLE_STRIP_WIDTH = int(os.getenv("TABLE_STRIP_WIDTH", 1024))
+
 # Список керівників
 MANAGERS_NAMES = [
     "Костюк Леся", "Склярук Анатолій", "Квартюк Іван", 
@@ -36,9 +89,46 @@ REMINDER_TIMES = {
     "night_counters": "02:45",
     "day_counters": "16:40",
     "day_staff": "07:43",
-    "night_staff": "16:43"
+    "night_staff": "16:43",
+    "birthdays": "09:00"
 }
 
+# Скільки секунд після запланованого часу нагадування ще можна надіслати,
+# якщо планувальник запізнився (сон хоста, рестарт тощо)
+REMINDER_MISFIRE_GRACE = int(os.getenv("REMINDER_MISFIRE_GRACE", 600))
+
+# Розсилки в Telegram (ліміт Bot API ~30 повідомлень/с)
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", 25))
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", 10))
+
+# SMS-розсилки: одночасних запитів до SMS Fly і запитів за секунду
+SMS_CONCURRENCY = int(os.getenv("SMS_CONCURRENCY", 5))
+SMS_RATE = float(os.getenv("SMS_RATE", 5))
+SMS_MAX_ATTEMPTS = int(os.getenv("SMS_MAX_ATTEMPTS", 4))  # спроб на одне повідомлення
+SMS_RETRY_BASE = float(os.getenv("SMS_RETRY_BASE", 30))  # секунд до першого повтору, далі ×2
+SMS_LEASE = int(os.getenv("SMS_LEASE", 120))  # через скільки секунд "завислий" запис бере інший воркер
+# Запасне опитування черги (с), коли роботи немає: лише для записів від інших екземплярів,
+# довше за автопризупинення Neon (5 хв), щоб простій не будив БД
+SMS_POLL_INTERVAL = float(os.getenv("SMS_POLL_INTERVAL", 900))
+SMS_SCHEDULE_RATE = float(os.getenv("SMS_SCHEDULE_RATE", 0.5))  # SMS/с для запланованих кампаній за замовчуванням
+SUNDAY_SMS_TIME = os.getenv("SUNDAY_SMS_TIME", "18:00")  # коли в суботу нагадувати про неділю (Київ)
+# Звіти про доставку: запитів статусу за секунду, записів за один прохід,
+# перша перевірка через SMS_STATUS_FIRST_CHECK с (далі ×2), після SMS_STATUS_MAX_AGE год — "невідомо"
+SMS_STATUS_RATE = float(os.getenv("SMS_STATUS_RATE", 2))
+SMS_STATUS_BATCH = int(os.getenv("SMS_STATUS_BATCH", 50))
+SMS_STATUS_FIRST_CHECK = int(os.getenv("SMS_STATUS_FIRST_CHECK", 60))
+SMS_STATUS_MAX_AGE = int(os.getenv("SMS_STATUS_MAX_AGE", 24))
+# Баланс SMS Fly: кеш на SMS_BALANCE_TTL с; ціна однієї SMS-частини (грн) для оцінки кампанії
+# і мінімальний залишок, нижче якого розсилку не запускаємо
+SMS_BALANCE_TTL = int(os.getenv("SMS_BALANCE_TTL", 300))
+SMS_SEGMENT_PRICE = float(os.getenv("SMS_SEGMENT_PRICE", 1.0))
+SMS_BALANCE_RESERVE = float(os.getenv("SMS_BALANCE_RESERVE", 0))
+
+# Порада дня: кеш на користувача на київську добу + нічний перерахунок
+ADVICE_PRECOMPUTE_TIME = os.getenv("ADVICE_PRECOMPUTE_TIME", "05:00")
+ADVICE_PRECOMPUTE_CONCURRENCY = int(os.getenv("ADVICE_PRECOMPUTE_CONCURRENCY", 3))
+ADVICE_ACTIVE_DAYS = int(os.getenv("ADVICE_ACTIVE_DAYS", 7))  # кому рахувати наперед
+
 # Чек-лист початку зміни
 SHIFT_CHECKLIST = [
     "Подати персонал до 16:50",
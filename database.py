@@ -1,86 +1,62 @@
-import psycopg2
-import os
+from datetime import date as date_type, datetime
 
-# Отримуємо посилання на базу Neon із налаштувань Render
-DB_URL = os.getenv("DATABASE_URL")
+from psycopg2.extras import execute_values
 
-def get_connection():
-    return psycopg2.connect(DB_URL, sslmode='require')
+from utils.repository import repo
 
-def init_db():
-    """Створює всі необхідні таблиці в Neon при запуску бота."""
-    conn = get_connection()
-    cur = conn.cursor()
+# Усі запити йдуть через спільний пул з'єднань (utils/repository.py),
+# а схема створюється міграціями при старті (utils/migrations.py)
+
+def _parse_birth_date(value):
+    """Дата з рядка 'ДД.ММ.РРРР' або 'ДД.ММ' (рік не важливий для нагадувань)"""
+    if isinstance(value, date_type):
+        return value
+    value = value.strip()
     try:
-        # 1. Таблиця днів народження
-        cur.execute('''CREATE TABLE IF NOT EXISTS birthdays
-                       (id SERIAL PRIMARY KEY, user_id BIGINT, full_name TEXT, birth_date TEXT)''')
-        
-        # 2. Таблиця для ШІ (астро-дані)
-        cur.execute('''CREATE TABLE IF NOT EXISTS astro_users
-                       (user_id BIGINT PRIMARY KEY, info TEXT)''')
-        
-        # 3. Таблиця завдань
-        cur.execute('''CREATE TABLE IF NOT EXISTS shift_tasks
-                       (id SERIAL PRIMARY KEY, user_id BIGINT, task_text TEXT, is_done INTEGER DEFAULT 0)''')
-        
-        conn.commit()
-        print("✅ Всі таблиці в базі даних успішно перевірені/створені")
-    except Exception as e:
-        print(f"❌ Помилка ініціалізації бази: {e}")
-    finally:
-        cur.close()
-        conn.close()
+        return datetime.strptime(value, "%d.%m.%Y").date()
+    except ValueError:
+        return datetime.strptime(f"{value}.2000", "%d.%m.%Y").date()
 
 # --- ФУНКЦІЇ ДЛЯ ДНІВ НАРОДЖЕННЯ ---
 
-def add_birthday(user_id, name, date):
-    conn = get_connection()
-    cur = conn.cursor()
-    try:
-        cur.execute(
-            "INSERT INTO birthdays (user_id, full_name, birth_date) VALUES (%s, %s, %s)",
-            (user_id, name, date)
-        )
-        conn.commit()
-    finally:
-        cur.close()
-        conn.close()
+async def add_birthday(user_id, name, date):
+    await repo.execute(
+        "INSERT INTO employees (full_name, birth_date, added_by) VALUES (%s, %s, %s)",
+        (name, _parse_birth_date(date), user_id)
+    )
 
-def get_birthdays_by_name(user_id, search_name):
-    conn = get_connection()
-    cur = conn.cursor()
-    try:
-        cur.execute(
-            "SELECT id, full_name, birth_date FROM birthdays WHERE user_id = %s AND full_name ILIKE %s",
-            (user_id, f"%{search_name}%")
-        )
-        return cur.fetchall()
-    finally:
-        cur.close()
-        conn.close()
+async def get_birthdays_by_name(user_id, search_name):
+    return await repo.fetch(
+        "SELECT id, full_name, birth_date FROM employees WHERE added_by = %s AND full_name ILIKE %s",
+        (user_id, f"%{search_name}%")
+    )
+
+# --- ФУНКЦІЇ ДЛЯ ЗАВДАНЬ ---
+
+async def get_tasks(user_id):
+    return await repo.fetch(
+        "SELECT id, title, is_done FROM tasks WHERE user_id = %s AND is_done = FALSE ORDER BY id ASC",
+        (user_id,)
+    )
+
+async def add_task(user_id, task_text):
+    await repo.execute("INSERT INTO tasks (title, user_id) VALUES (%s, %s)", (task_text, user_id))
+
+async def add_tasks(user_id, task_texts):
+    """Кілька завдань одним INSERT (напр. розпізнаних з голосового)"""
+    if not task_texts:
+        return
+
+    def op(cur):
+        execute_values(cur, "INSERT INTO tasks (title, user_id) VALUES %s", [(text, user_id) for text in task_texts])
+    await repo.run(op, retry=False)
 
 # --- ФУНКЦІЇ ДЛЯ ШІ (ASTRO DATA) ---
 
-def save_astro_data(user_id, birth_data):
-    conn = get_connection()
-    cur = conn.cursor()
-    try:
-        cur.execute('''INSERT INTO astro_users (user_id, info) VALUES (%s, %s)
-                       ON CONFLICT (user_id) DO UPDATE SET info = EXCLUDED.info''', 
-                    (user_id, birth_data))
-        conn.commit()
-    finally:
-        cur.close()
-        conn.close()
+async def save_astro_data(user_id, birth_data):
+    await repo.execute('''INSERT INTO astro_users (user_id, info) VALUES (%s, %s)
+                          ON CONFLICT (user_id) DO UPDATE SET info = EXCLUDED.info''',
+                       (user_id, birth_data), retry=True)
 
-def get_astro_data(user_id):
-    conn = get_connection()
-    cur = conn.cursor()
-    try:
-        cur.execute("SELECT info FROM astro_users WHERE user_id = %s", (user_id,))
-        res = cur.fetchone()
-        return res[0] if res else None
-    finally:
-        cur.close()
-        conn.close()
+async def get_astro_data(user_id):
+    return await repo.fetchval("SELECT info FROM astro_users WHERE user_id = %s", (user_id,))
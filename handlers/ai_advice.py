@@ -1,34 +1,83 @@
-import os
-import aiohttp
+import asyncio
+import logging
+from datetime import datetime
+
 from aiogram import Router, F, types
 import database as db
+from config import KYIV_TZ, ADVICE_PRECOMPUTE_CONCURRENCY, ADVICE_ACTIVE_DAYS
+from utils.gemini_client import gemini, GeminiError, CircuitOpenError
+from utils.repository import repo
+from utils.result_cache import ResultCache, content_key
 
 router = Router()
+logger = logging.getLogger(__name__)
+
+# Порада — інтерактивний запит: краще швидко відмовити, ніж змушувати чекати
+ADVICE_DEADLINE = 20
+
+# Порада живе одну київську добу; TTL з запасом, ключ все одно містить дату
+advice_cache = ResultCache("advice", ttl=36 * 3600, max_items=512)
+
+
+def advice_key(user_id, user_info, day=None) -> str:
+    day = day or datetime.now(KYIV_TZ).date()
+    # Зміна даних народження — інша порада
+    return f"{user_id}:{day.isoformat()}:{content_key(user_info)[:16]}"
+
+
+async def generate_advice(user_info, **kwargs) -> str:
+    return await gemini.generate(f"Ти астролог. Дані: {user_info}. Дай коротку пораду на сьогодні.", **kwargs)
+
+
+async def precompute_daily_advice(concurrency: int = ADVICE_PRECOMPUTE_CONCURRENCY, days: int = ADVICE_ACTIVE_DAYS):
+    """Нічний перерахунок порад для активних користувачів, щоб кнопка відповідала з кешу"""
+    users = await repo.get_active_astro_users(days)
+    slots = asyncio.Semaphore(concurrency)
+    day = datetime.now(KYIV_TZ).date()
+
+    async def one(user_id, user_info):
+        key = advice_key(user_id, user_info, day)
+        async with slots:
+            if await advice_cache.get(key) is not None:
+                return False
+            try:
+                answer = await generate_advice(user_info, feature="advice_precompute")
+            except GeminiError as e:
+                logger.warning(f"Порада для {user_id} не згенерована: {e}")
+                return False
+            await advice_cache.set([key], answer)
+            return True
+
+    done = await asyncio.gather(*(one(user_id, info) for user_id, info in users))
+    logger.info(f"✨ Поради на {day}: згенеровано {sum(done)} з {len(users)} активних користувачів")
 
-API_KEY = os.getenv("API_KEY")
-MODEL_ID = "gemini-1.5-flash"
-GEMINI_URL = f"https://generativelanguage.googleapis.com/v1/models/{MODEL_ID}:generateContent?key={API_KEY}"
 
 @router.message(F.text == "✨ Порада дня")
 async def get_ai_advice(message: types.Message):
-    user_info = db.get_astro_data(message.from_user.id)
-    
+    user_id = message.from_user.id
+    user_info = await db.get_astro_data(user_id)
+
     if not user_info:
         await message.answer("🔮 Спочатку введіть дату народження у налаштуваннях.")
         return
 
+    key = advice_key(user_id, user_info)
+    answer = await advice_cache.get(key)
+    if answer is not None:
+        await message.answer(f"✨ <b>Прогноз:</b>\n\n{answer}", parse_mode="HTML")
+        await repo.mark_advice_requested(user_id)
+        return
+
     wait_msg = await message.answer("📡 <i>З'єднуюсь із Gemini...</i>", parse_mode="HTML")
-    
-    payload = {
-        "contents": [{"parts": [{"text": f"Ти астролог. Дані: {user_info}. Дай коротку пораду на сьогодні."}]}]
-    }
-
-    async with aiohttp.ClientSession() as session:
-        # Прямий запит без проксі
-        async with session.post(GEMINI_URL, json=payload, timeout=20) as resp:
-            if resp.status == 200:
-                data = await resp.json()
-                answer = data['candidates'][0]['content']['parts'][0]['text']
-                await wait_msg.edit_text(f"✨ <b>Прогноз:</b>\n\n{answer}", parse_mode="HTML")
-            else:
-                await wait_msg.edit_text(f"❌ Помилка API (Статус: {resp.status})")
+
+    try:
+        answer = await generate_advice(user_info, endpoint="gemini_quick", deadline=ADVICE_DEADLINE, feature="advice")
+    except CircuitOpenError:
+        await wait_msg.edit_text("⏳ ШІ тимчасово недоступний, спробуйте за хвилину.")
+        return
+    except GeminiError as e:
+        await wait_msg.edit_text(f"❌ Помилка API (Статус: {e.status or 'немає відповіді'})")
+        return
+    await wait_msg.edit_text(f"✨ <b>Прогноз:</b>\n\n{answer}", parse_mode="HTML")
+    await advice_cache.set([key], answer)
+    await repo.mark_advice_requested(user_id)
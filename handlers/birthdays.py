@@ -29,6 +29,6 @@ async def process_name(message: types.Message, state: FSMContext):
 @router.message(BirthdayStates.waiting_for_date)
 async def process_date(message: types.Message, state: FSMContext):
     data = await state.get_data()
-    db.add_birthday(message.from_user.id, data['name'], message.text)
+    await db.add_birthday(message.from_user.id, data['name'], message.text)
     await message.answer(f"✅ Збережено: {data['name']} - {message.text}")
     await state.clear()
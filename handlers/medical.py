@@ -69,13 +69,13 @@ async def process_medical_table(message: types.Message, state: FSMContext, bot:
         
         for emp in employees_data:
             needs = []
-            if emp.get('medical') == 'так':
+            if emp.get('medical'):
                 needs.append("М")
-            if emp.get('fluorography') == 'так':
+            if emp.get('fluorography'):
                 needs.append("Ф")
-            if emp.get('gynecology') == 'так':
+            if emp.get('gynecology'):
                 needs.append("Г")
-            if emp.get('vaccination') == 'так':
+            if emp.get('vaccination'):
                 needs.append("В")
             
             if needs:
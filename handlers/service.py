@@ -1,16 +1,9 @@
-import os
-import aiohttp
 from aiogram import Router, F, types
 from aiogram.filters import CommandStart
 
-router = Router()
-
-# Отримуємо ключ
-API_KEY = os.getenv("API_KEY", "").strip()
+from utils.gemini_client import gemini, GeminiError
 
-# ВИПРАВЛЕННЯ: Використовуємо модель зі списку доступних (Gemini 2.0 Flash)
-# Це найшвидша модель, яка доступна у вашому проекті
-GEMINI_URL = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent?key={API_KEY}"
+router = Router()
 
 @router.message(CommandStart())
 async def cmd_start(message: types.Message):
@@ -27,26 +20,16 @@ async def cmd_start(message: types.Message):
 
 @router.message(F.text == "🛠 Діагностика ШІ")
 async def check_ai_status(message: types.Message):
-    if not API_KEY:
-        await message.answer("❌ Помилка: API_KEY не знайдено.")
+    if not gemini.api_key:
+        await message.answer("❌ Помилка: GEMINI_API_KEY не знайдено.")
         return
 
-    wait_msg = await message.answer("🔍 Запит до <b>Gemini 2.0 Flash</b>...")
-    
-    headers = {'Content-Type': 'application/json'}
-    # Структура запиту для моделей 2.0 залишається такою ж
-    payload = {"contents": [{"parts": [{"text": "Напиши 'Готово!'"}]}]}
+    wait_msg = await message.answer(f"🔍 Запит до <b>{gemini.model}</b>...")
     
-    async with aiohttp.ClientSession() as session:
-        try:
-            async with session.post(GEMINI_URL, json=payload, headers=headers) as resp:
-                data = await resp.json()
-                
-                if resp.status == 200:
-                    text_reply = data['candidates'][0]['content']['parts'][0]['text']
-                    await wait_msg.edit_text(f"✅ <b>200 OK!</b>\nВідповідь ШІ: {text_reply}")
-                else:
-                    err_message = data.get("error", {}).get("message", "Невідома помилка")
-                    await wait_msg.edit_text(f"❌ <b>Помилка {resp.status}</b>\n{err_message}")
-        except Exception as e:
-            await wait_msg.edit_text(f"⚠️ Помилка з'єднання: {str(e)[:50]}")
+    try:
+        text_reply = await gemini.generate("Напиши 'Готово!'", endpoint="gemini_quick", deadline=20,
+                                           feature="diagnostics")
+        await wait_msg.edit_text(f"✅ <b>200 OK!</b>\nВідповідь ШІ: {text_reply}")
+    except GeminiError as e:
+        status = f"Помилка {e.status}" if e.status else "Помилка з'єднання"
+        await wait_msg.edit_text(f"❌ <b>{status}</b>\n{str(e)[:200]}\nCircuit breaker: {gemini.breaker.state}")
@@ -59,7 +59,7 @@ async def process_sunday_table(message: types.Message, state: FSMContext, bot: B
             return
         
         # Фільтруємо тих, хто працює
-        workers = [emp for emp in employees_data if emp.get('need_to_work') == 'так']
+        workers = [emp for emp in employees_data if emp.get('need_to_work')]
         
         if not workers:
             await wait_msg.edit_text(
@@ -1,24 +1,45 @@
 import os
 import asyncio
 import logging
-import psycopg2
-import pytz
-import json
-import base64
-import aiohttp
-import re
 import signal
+import secrets
 import sys
 from datetime import datetime, timedelta
+from typing import List, Optional
 from aiogram import Bot, Dispatcher, types, F
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.filters import Command
 from aiogram.utils.keyboard import ReplyKeyboardBuilder, InlineKeyboardBuilder
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler
 from aiohttp import web
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from PIL import Image, ImageEnhance
-from io import BytesIO
+from apscheduler.triggers.cron import CronTrigger
+
+from utils.repository import repo
+from utils.migrations import run_migrations
+from utils.task_reminders import TaskReminderEngine
+from utils.broadcaster import Broadcaster
+from utils.http_client import http_client
+from utils.gemini_client import GeminiClient, GeminiError, gemini
+from utils.json_stream import JsonArrayStream
+from utils.table_schema import TABLE_PROMPTS, generation_config, validate_row, medical_needs, merge_rows, name_key, TableRows
+from utils.progress import ProgressMessage
+from utils.media_group import MediaGroupMiddleware
+from utils.sms_fly_client import SMSFlyClient
+from utils.sms_outbox import SmsOutbox, NO_PHONE
+from utils.sms_balance import SmsBalance
+from utils.image_processing import image_processor, ImageQueueFull
+from utils.result_cache import ResultCache, content_key, purge_expired
+from utils.single_flight import SingleFlight
+from utils.ai_metrics import ai_metrics
+from handlers.ai_advice import precompute_daily_advice
+from config import (
+    PORT, KYIV_TZ, ADMIN_IDS, REMINDER_TIMES, REMINDER_MISFIRE_GRACE, BROADCAST_RATE, BROADCAST_CONCURRENCY,
+    WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET, ANALYSIS_CACHE_TTL, ANALYSIS_CACHE_SIZE, ADVICE_PRECOMPUTE_TIME,
+    SMS_SCHEDULE_RATE, SUNDAY_SMS_TIME, STATS_TOKEN,
+)
 
 # --- НАЛАШТУВАННЯ ---
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
@@ -26,11 +47,9 @@ logger = logging.getLogger(__name__)
 
 # 🔐 ВСІ КЛЮЧІ БЕРУТЬСЯ З ЗМІННИХ СЕРЕДОВИЩА 🔐
 TOKEN = os.getenv("BOT_TOKEN")
-DATABASE_URL = os.getenv("DATABASE_URL")
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 SMS_FLY_API_KEY = os.getenv("SMS_FLY_API_KEY", "t1G7njJlTFjmCJRs7HV96ZLG2gmND9O5")
 SMS_FLY_SENDER = os.getenv("SMS_FLY_SENDER", "YourBot")
-KYIV_TZ = pytz.timezone("Europe/Kyiv")
 
 # Перевірка наявності ключів
 if not GEMINI_API_KEY:
@@ -40,11 +59,15 @@ if not TOKEN:
 
 bot = Bot(token=TOKEN)
 dp = Dispatcher()
+# Альбом фото таблиць приходить одним викликом обробника (data["album"])
+dp.message.middleware(MediaGroupMiddleware())
 scheduler = AsyncIOScheduler(timezone=KYIV_TZ)
+broadcaster = Broadcaster(bot, global_rate=BROADCAST_RATE, concurrency=BROADCAST_CONCURRENCY)
 
 # Глобальні змінні
 shutdown_event = asyncio.Event()
 web_runner = None
+http_task = None
 
 MANAGERS_NAMES = [
     "Костюк Леся", "Склярук Анатолій", "Квартюк Іван", "Коваль Мирослава", "Селіверстов Олег",
@@ -60,224 +83,368 @@ class BotStates(StatesGroup):
     waiting_for_route_data = State()
     waiting_for_medical_photo = State()
     waiting_for_sunday_photo = State()
+    waiting_for_sms_schedule = State()
 
 # --- SMS FLY КЛІЄНТ ---
-class SMSFlyClient:
-    def __init__(self, api_key: str, sender: str = "YourBot"):
-        self.api_key = api_key
-        self.sender = sender
-        self.base_url = "https://sms-fly.ua/api/v2/api.php"
-
-    async def send_sms(self, phone: str, message: str, ttl: int = 60, flash: int = 0):
-        phone = ''.join(filter(str.isdigit, phone))
-        if phone.startswith('0'):
-            phone = '380' + phone[1:]
-        elif phone.startswith('8'):
-            phone = '380' + phone[1:]
-        elif not phone.startswith('380'):
-            phone = '380' + phone
-            
-        payload = {
-            "auth": {"key": self.api_key},
-            "action": "SENDMESSAGE",
-            "data": {
-                "recipient": phone,
-                "channels": ["sms"],
-                "sms": {
-                    "source": self.sender,
-                    "ttl": ttl,
-                    "flash": flash,
-                    "text": message
-                }
-            }
-        }
-        
-        async with aiohttp.ClientSession() as session:
-            try:
-                async with session.post(self.base_url, json=payload, timeout=30) as resp:
-                    if resp.status == 200:
-                        data = await resp.json()
-                        if data.get('success') == 1:
-                            return {"success": True, "message_id": data.get('data', {}).get('messageID')}
-                        else:
-                            error = data.get('error', {})
-                            return {"success": False, "error": error.get('description')}
-                    return {"success": False, "error": f"HTTP {resp.status}"}
-            except Exception as e:
-                return {"success": False, "error": str(e)}
-
-    async def get_extended_balance(self):
-        payload = {
-            "auth": {"key": self.api_key},
-            "action": "GETBALANCEEXT",
-            "data": {}
-        }
-        async with aiohttp.ClientSession() as session:
-            try:
-                async with session.post(self.base_url, json=payload, timeout=30) as resp:
-                    if resp.status == 200:
-                        data = await resp.json()
-                        if data.get('success') == 1:
-                            balance_data = data.get('data', {}).get('balance', {})
-                            return {"success": True, "sms_balance": balance_data.get('sms', '0'), "viber_balance": balance_data.get('viber', '0')}
-                        return {"success": False, "error": "API error"}
-                    return {"success": False, "error": f"HTTP {resp.status}"}
-            except Exception as e:
-                return {"success": False, "error": str(e)}
-
 sms_client = SMSFlyClient(SMS_FLY_API_KEY, SMS_FLY_SENDER)
+sms_balance = SmsBalance(sms_client)
+
+DELIVERY_ICONS = {"delivered": "✅", "undelivered": "🚫", "expired": "⌛", "unknown": "❔"}
+
+def campaign_keyboard(campaign_id, paused=False):
+    kb = InlineKeyboardBuilder()
+    if paused:
+        kb.button(text="▶️ Продовжити", callback_data=f"smsctl_resume_{campaign_id}")
+    else:
+        kb.button(text="⏸ Пауза", callback_data=f"smsctl_pause_{campaign_id}")
+    kb.button(text="🛑 Скасувати розсилку", callback_data=f"smsctl_cancel_{campaign_id}")
+    kb.adjust(2)
+    return kb.as_markup()
 
-# --- БАЗА ДАНИХ ---
-def init_db():
+def campaign_pace(status):
+    """Опис розкладу кампанії: коли стартує і з яким темпом"""
+    text = ""
+    scheduled_at = status["scheduled_at"]
+    if scheduled_at and scheduled_at > datetime.now(KYIV_TZ):
+        text += f"🕒 Старт: {scheduled_at.astimezone(KYIV_TZ):%d.%m о %H:%M}\n"
+    if status["rate"]:
+        text += f"🐢 Темп: {status['rate']:g} SMS/с\n"
+    return text
+
+async def report_sms_campaign(campaign_id, status):
+    """Прогрес і підсумковий звіт кампанії в повідомленні, з якого її запустили"""
+    if not status["chat_id"]:
+        return
+    counts = status["counts"]
+    total = sum(counts.values())
+    reply_markup = None
+    if not status["done"]:
+        paused = status["state"] == "paused"
+        header = "⏸ Розсилку призупинено" if paused else "📤 Відправляю SMS..."
+        text = (f"{header} {counts['sent'] + counts['failed']}/{total}\n{campaign_pace(status)}"
+                f"✅ {counts['sent']}  ❌ {counts['failed']}  ⏳ {counts['pending'] + counts['sending']}")
+        parse_mode = None
+        reply_markup = campaign_keyboard(campaign_id, paused)
+    else:
+        no_phone_count = sum(1 for r in status["recipients"] if r["error"] == NO_PHONE)
+        delivery = status["delivery"]
+        text = "📊 **Звіт про відправку SMS:**\n\n"
+        text += f"📨 Прийнято оператором: {counts['sent']}\n"
+        text += f"   ✅ доставлено: {delivery['delivered']}\n"
+        text += f"   🚫 не доставлено: {delivery['undelivered']}\n"
+        text += f"   ⌛ термін минув: {delivery['expired']}\n"
+        if delivery["unknown"]:
+            text += f"   ❔ без звіту: {delivery['unknown']}\n"
+        if delivery["awaiting"]:
+            text += f"   ⏳ чекаю звіт: {delivery['awaiting']}\n"
+        text += f"📭 Немає телефону: {no_phone_count}\n"
+        text += f"❌ Помилок: {counts['failed'] - no_phone_count}\n"
+        if counts["cancelled"]:
+            text += f"🛑 Скасовано: {counts['cancelled']}\n"
+        text += "\n**Деталі:**\n"
+        for r in status["recipients"]:
+            if r["status"] == "sent":
+                text += f"{DELIVERY_ICONS.get(r['delivery'], '⏳')} {r['name']}\n"
+            elif r["status"] == "cancelled":
+                text += f"🛑 {r['name']} - скасовано\n"
+            elif r["error"] == NO_PHONE:
+                text += f"📭 {r['name']} - немає номера\n"
+            else:
+                text += f"❌ {r['name']} - помилка\n"
+        parse_mode = "Markdown"
+        # Кампанія списала кошти — кешований баланс застарів
+        sms_balance.refresh_soon()
     try:
-        conn = psycopg2.connect(DATABASE_URL)
-        cur = conn.cursor()
-        cur.execute("CREATE TABLE IF NOT EXISTS users (user_id BIGINT PRIMARY KEY, username TEXT, shift_type TEXT DEFAULT 'day');")
-        cur.execute("CREATE TABLE IF NOT EXISTS employees (id SERIAL PRIMARY KEY, full_name TEXT, birth_date DATE);")
-        cur.execute("CREATE TABLE IF NOT EXISTS tasks (id SERIAL PRIMARY KEY, title TEXT, is_done BOOLEAN DEFAULT FALSE);")
-        cur.execute("CREATE TABLE IF NOT EXISTS routes (id SERIAL PRIMARY KEY, info TEXT);")
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS employee_phones (
-                id SERIAL PRIMARY KEY,
-                full_name TEXT NOT NULL,
-                phone TEXT NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        cur.execute("CREATE INDEX IF NOT EXISTS idx_employee_phones_name ON employee_phones(full_name);")
-        try:
-            cur.execute("ALTER TABLE tasks ADD COLUMN IF NOT EXISTS remind_at TIMESTAMP;")
-        except:
-            conn.rollback()
-        conn.commit()
-        cur.close()
-        conn.close()
-        logger.info("✅ База даних ініціалізована")
-    except Exception as e:
-        logger.error(f"❌ Помилка ініціалізації БД: {e}")
+        await bot.edit_message_text(text, chat_id=status["chat_id"], message_id=status["message_id"],
+                                    parse_mode=parse_mode, reply_markup=reply_markup)
+    except TelegramBadRequest:
+        pass
+
+sms_outbox = SmsOutbox(sms_client, on_update=report_sms_campaign)
 
-def get_employee_phone(full_name):
+def campaign_messages(kind, data):
+    """[(ім'я, текст SMS)] з результатів аналізу таблиці, збережених у FSM"""
+    if kind == "sunday":
+        msg = "Вітаю! В неділю очікуємо на зміні."
+        return [(worker['name'], msg) for worker in data.get('sunday_workers', [])]
+    
+    messages = []
+    for emp in data.get('medical_employees', []):
+        needs_short = []
+        if emp.get('medical'):
+            needs_short.append("М")
+        if emp.get('fluorography'):
+            needs_short.append("Ф")
+        if emp.get('gynecology'):
+            needs_short.append("Г")
+        if emp.get('vaccination'):
+            needs_short.append("Щ")
+        if needs_short:
+            messages.append((emp['name'], f"Потрібне медобстеження: {', '.join(needs_short)}"))
+    return messages
+
+async def enqueue_sms_campaign(state, kind, user_id, target, scheduled_at=None, rate=None):
+    """
+    Поставити розсилку в чергу; відправляє фоновий воркер. Кампанія прив'язана до
+    повідомлення з результатами аналізу (повторне натискання нічого не додає),
+    а прогрес і звіт пишуться в target. Повертає (id кампанії або None, текст для відповіді).
+    """
+    data = await state.get_data()
+    messages = campaign_messages(kind, data)
+    if not messages:
+        await state.clear()
+        return None, "Немає даних для відправки"
+    
     try:
-        conn = psycopg2.connect(DATABASE_URL)
-        cur = conn.cursor()
-        short_name = full_name.split()[0] if ' ' in full_name else full_name
-        cur.execute("SELECT phone FROM employee_phones WHERE full_name ILIKE %s LIMIT 1", (f"%{short_name}%",))
-        result = cur.fetchone()
-        cur.close()
-        conn.close()
-        return result[0] if result else None
+        phones = await repo.get_employee_phones([name for name, _ in messages])
     except Exception as e:
-        logger.error(f"Помилка отримання телефону: {e}")
-        return None
+        logger.error(f"SMS phones lookup error: {e}")
+        return None, "❌ Не вдалося перевірити номери, спробуйте ще раз"
+    if not any(phones.get(name) for name, _ in messages):
+        return None, "📵 Жодного номера в довіднику для цих працівників. Додайте номери командою /phone"
+    try:
+        estimate = await sms_balance.estimate(messages, phones)
+    except Exception as e:
+        logger.error(f"SMS estimate error: {e}")
+        estimate = {"enough": None}
+    if estimate["enough"] is False:
+        return None, (f"❌ Недостатньо коштів: {estimate['segments']} SMS ≈ {estimate['cost']:g} грн, "
+                      f"на балансі {estimate['balance']:g} грн")
+    
+    origin = data.get("sms_origin") or [target.chat.id, target.message_id]
+    try:
+        campaign_id = await sms_outbox.enqueue(
+            kind, f"{kind}:{origin[0]}:{origin[1]}", messages, created_by=user_id,
+            chat_id=target.chat.id, message_id=target.message_id, scheduled_at=scheduled_at, rate=rate,
+            phones=phones
+        )
+    except Exception as e:
+        logger.error(f"SMS enqueue error: {e}")
+        return None, "❌ Не вдалося поставити SMS у чергу, спробуйте ще раз"
+    await state.clear()
+    if campaign_id is None:
+        return None, "Ця розсилка вже в черзі"
+    status = {"scheduled_at": scheduled_at, "rate": rate}
+    if estimate["enough"] is None:
+        cost = "⚠️ Баланс не перевірено — SMS можуть не дійти\n"
+    else:
+        cost = f"💰 ≈ {estimate['cost']:g} грн ({estimate['segments']} SMS), на балансі {estimate['balance']:g} грн\n"
+        if estimate["no_phone"]:
+            cost += f"📵 Без номера: {estimate['no_phone']}\n"
+    await target.edit_text(
+        f"📥 **{len(messages)} SMS у черзі на відправку...**\n{campaign_pace(status)}{cost}Звіт з'явиться тут.",
+        reply_markup=campaign_keyboard(campaign_id), parse_mode="Markdown"
+    )
+    return campaign_id, "📥 SMS поставлено в чергу"
+
+def parse_sms_schedule(text, now):
+    """
+    'ДД.ММ ГГ:ХХ [SMS/с]' (найближча така дата) або 'ГГ:ХХ [SMS/с]' (найближчі такі години) за Києвом.
+    Повертає (час старту, темп). ValueError — якщо формат невірний або час минув.
+    """
+    parts = text.split()
+    if not parts or len(parts) > 3:
+        raise ValueError("невірний формат")
+    rate = SMS_SCHEDULE_RATE
+    if len(parts) == 3 or (len(parts) == 2 and ":" not in parts[1]):
+        try:
+            rate = float(parts.pop().replace(",", "."))
+        except ValueError:
+            raise ValueError("невірний темп")
+        if rate <= 0:
+            raise ValueError("темп має бути більшим за нуль")
+    try:
+        if len(parts) == 2:
+            # Рік не вказується: дата, що вже минула цього року, — наступного (02.01 у грудні).
+            # 2000 — високосний, тож 29.02 проходить розбір і потрапляє на найближчий високосний рік
+            day_time = datetime.strptime(f"{parts[0]}.2000 {parts[1]}", "%d.%m.%Y %H:%M")
+            for year in range(now.year, now.year + 5):
+                try:
+                    candidate = day_time.replace(year=year)
+                except ValueError:
+                    continue
+                if candidate.date() >= now.date():
+                    break
+            when = KYIV_TZ.localize(candidate)
+        else:
+            clock = datetime.strptime(parts[0], "%H:%M").time()
+            when = KYIV_TZ.localize(datetime.combine(now.date(), clock))
+            if when <= now:
+                when = KYIV_TZ.localize(datetime.combine(now.date() + timedelta(days=1), clock))
+    except ValueError:
+        raise ValueError("невірний формат")
+    if when <= now:
+        raise ValueError("цей час уже минув")
+    return when, rate
+
+def next_saturday_evening(now):
+    """Найближча субота о SUNDAY_SMS_TIME; якщо вже субота після цього часу — None (відправити зараз)"""
+    hour, minute = map(int, SUNDAY_SMS_TIME.split(":"))
+    day = now.date() + timedelta(days=(5 - now.weekday()) % 7)
+    when = KYIV_TZ.localize(datetime(day.year, day.month, day.day, hour, minute))
+    return when if when > now else None
 
 # --- ФУНКЦІЯ СТИСНЕННЯ ЗОБРАЖЕННЯ ---
-async def compress_image(image_bytes, max_size=800, quality=60):
+async def compress_image(image_data, max_size=800, quality=60):
+    """Стиснення у пулі воркерів (utils/image_processing.py), щоб не блокувати event loop"""
     try:
-        img = Image.open(BytesIO(image_bytes))
-        
-        if img.mode in ('RGBA', 'P'):
-            img = img.convert('RGB')
-        
-        ratio = max_size / max(img.width, img.height)
-        if ratio < 1:
-            new_size = (int(img.width * ratio), int(img.height * ratio))
-            img = img.resize(new_size, Image.Resampling.LANCZOS)
-        
-        enhancer = ImageEnhance.Contrast(img)
-        img = enhancer.enhance(1.3)
-        
-        buffer = BytesIO()
-        img.save(buffer, format='JPEG', quality=quality, optimize=True)
-        
-        compressed = buffer.getvalue()
-        original_size = len(image_bytes) / 1024
-        compressed_size = len(compressed) / 1024
-        
-        logger.info(f"Стиснення: {original_size:.1f}KB -> {compressed_size:.1f}KB (економія {original_size - compressed_size:.1f}KB)")
-        
-        return compressed
+        return await image_processor.compress(image_data, max_size=max_size, quality=quality)
+    except ImageQueueFull:
+        raise
     except Exception as e:
         logger.error(f"Помилка стиснення: {e}")
-        return image_bytes
+        return image_data.getvalue() if hasattr(image_data, "getvalue") else image_data
 
 # --- ФУНКЦІЯ АНАЛІЗУ ТАБЛИЦЬ ЧЕРЕЗ GEMINI 2.5 FLASH ---
-async def analyze_table_with_gemini(image_bytes, table_type="medical"):
+# Збільшувати при зміні промптів, щоб не віддавати з кешу результати старих версій
+TABLE_PROMPT_VERSION = 2
+analysis_cache = ResultCache("table_analysis", ANALYSIS_CACHE_TTL, ANALYSIS_CACHE_SIZE)
+table_flights = SingleFlight()
+
+async def analyze_table_photo(bot, photo, table_type="medical", on_row=None):
+    """Розпізнати таблицю з фото. Повторно надіслане фото береться з кешу без завантаження"""
+    file_key = f"file:{table_type}:v{TABLE_PROMPT_VERSION}:{photo.file_unique_id}"
+    cached = await analysis_cache.get(file_key)
+    if cached is not None:
+        logger.info(f"Таблиця {photo.file_unique_id} вже розпізнана — беру з кешу")
+        return TableRows(cached)
+    file = await bot.get_file(photo.file_id)
+    # BytesIO віддаємо як є — без .read() і повної копії фото
+    file_bytes = await bot.download_file(file.file_path)
+    return await analyze_table_with_gemini(file_bytes, table_type, cache_keys=[file_key], on_row=on_row)
+
+async def analyze_table_with_gemini(image_data, table_type="medical", cache_keys=(), on_row=None):
     if not GEMINI_API_KEY:
         logger.error("GEMINI_API_KEY не налаштовано!")
         return None
     
-    compressed_image = await compress_image(image_bytes, max_size=800, quality=60)
-    image_base64 = base64.b64encode(compressed_image).decode('utf-8')
+    # Високе фото ріжеться на смуги з шапкою; невисоке — одне стиснене зображення
+    try:
+        strips = await image_processor.table_strips(image_data)
+    except ImageQueueFull:
+        raise
+    except Exception as e:
+        logger.error(f"Помилка нарізки таблиці: {e}")
+        strips = [await compress_image(image_data, max_size=800, quality=60)]
     
-    if table_type == "medical":
-        prompt = """Ти експерт з розпізнавання таблиць. На фото таблиця медоглядів.
-Колонки: Прізвище, Медогляд, Флюорографія, Гінеколог, Вакцинація.
-Позначки "потрібно" = "так", "ні" = "ні".
-Відповідай ТІЛЬКИ JSON. Приклад: [{"name": "Акенттій", "medical": "ні", "fluorography": "так", "gynecology": "ні", "vaccination": "ні"}]"""
-    else:
-        prompt = """Ти експерт з розпізнавання таблиць. На фото таблиця роботи в неділю.
-Відповідай ТІЛЬКИ JSON: [{"name": "Прізвище", "need_to_work": "так/ні"}]"""
+    # Те саме фото, надіслане заново (інший file_unique_id), впізнаємо за вмістом
+    image_key = "img:" + content_key(*strips, table_type, str(TABLE_PROMPT_VERSION))
+    cached = await analysis_cache.get(image_key)
+    if cached is not None:
+        logger.info("Таблиця з таким самим вмістом вже розпізнана — беру з кешу")
+        await analysis_cache.set(cache_keys, cached)
+        return TableRows(cached)
     
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash:generateContent?key={GEMINI_API_KEY}"
+    async def recognise():
+        if len(strips) == 1:
+            result = await request_table_analysis(strips[0], table_type, on_row)
+        else:
+            result = await request_table_strips(strips, table_type, on_row)
+        # Неповний результат не кешуємо: повторне фото має розпізнатися заново
+        if result and result.complete:
+            await analysis_cache.set([image_key], result)
+        return result
     
-    payload = {
-        "contents": [{
-            "parts": [
-                {"text": prompt},
-                {"inline_data": {"mime_type": "image/jpeg", "data": image_base64}}
-            ]
-        }],
-        "generationConfig": {
-            "temperature": 0.1,
-            "maxOutputTokens": 4096
-        }
-    }
+    # Те саме фото, надіслане кількома людьми одночасно, розпізнається один раз
+    result = await table_flights.do(image_key, recognise)
+    if result and result.complete and cache_keys:
+        await analysis_cache.set(cache_keys, result)
+    return result
+
+async def request_table_analysis(compressed_image, table_type, on_row=None):
+    payload = GeminiClient.text_payload(TABLE_PROMPTS[table_type], "image/jpeg", generation_config(table_type))
     
+    # Рядки таблиці розбираються в міру надходження відповіді:
+    # обірваний потік все одно дає всі повністю отримані рядки
+    rows = JsonArrayStream()
+    result = []
+    failed = False
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, json=payload, timeout=120) as resp:
-                if resp.status == 200:
-                    data = await resp.json()
-                    if 'candidates' in data and len(data['candidates']) > 0:
-                        result_text = data['candidates'][0]['content']['parts'][0]['text']
-                        logger.info(f"Gemini відповів: {result_text[:300]}")
-                        
-                        result_text = result_text.strip()
-                        if result_text.startswith('```json'):
-                            result_text = result_text[7:]
-                        if result_text.startswith('```'):
-                            result_text = result_text[3:]
-                        if result_text.endswith('```'):
-                            result_text = result_text[:-3]
-                        
-                        json_match = re.search(r'\[\s*\{.*\}\s*\]', result_text, re.DOTALL)
-                        if json_match:
-                            result_text = json_match.group()
-                        
-                        try:
-                            result = json.loads(result_text)
-                            logger.info(f"Розпізнано {len(result)} працівників")
-                            return result
-                        except json.JSONDecodeError:
-                            if result_text.endswith(','):
-                                result_text = result_text[:-1] + "}]"
-                            elif not result_text.endswith(']'):
-                                result_text = result_text + "}]"
-                            result = json.loads(result_text)
-                            return result
-                    else:
-                        return None
-                elif resp.status == 403:
-                    logger.error("❌ API ключ заблоковано! Отримайте новий ключ в Google AI Studio")
-                    return None
-                else:
-                    error_text = await resp.text()
-                    logger.error(f"Gemini API error {resp.status}: {error_text[:200]}")
-                    return None
-    except Exception as e:
+        async for chunk in gemini.stream_text(payload, blob=compressed_image, feature=table_type):
+            for item in rows.feed(chunk):
+                row = validate_row(table_type, item)
+                if row is None:
+                    continue
+                result.append(row)
+                if on_row is not None:
+                    await on_row(row, len(result))
+    except GeminiError as e:
         logger.error(f"Analysis error: {e}")
+        if not result:
+            return None
+        failed = True
+    
+    if not rows.finished:
+        logger.warning(f"Відповідь Gemini неповна — взято {len(result)} повних рядків")
+    logger.info(f"Розпізнано {len(result)} працівників")
+    return TableRows(result, complete=rows.finished and not failed) if result else None
+
+def unique_rows(on_row):
+    """on_row для кількох частин таблиці: кожного працівника показуємо один раз"""
+    seen = set()
+    
+    async def part_row(row, _count):
+        key = name_key(row["name"])
+        if key not in seen:
+            seen.add(key)
+            if on_row is not None:
+                await on_row(row, len(seen))
+    
+    return part_row
+
+async def gather_table_parts(table_type, jobs, what):
+    """Паралельно розпізнати частини таблиці та злити рядки за іменем"""
+    parts = await asyncio.gather(*jobs, return_exceptions=True)
+    for part in parts:
+        if isinstance(part, ImageQueueFull):
+            raise part
+        if isinstance(part, Exception):
+            logger.error(f"Analysis error: {part}")
+    parts = [None if isinstance(part, Exception) else part for part in parts]
+    failed = sum(1 for part in parts if not part)
+    if failed == len(parts):
         return None
+    if failed:
+        logger.warning(f"Не розпізнано {failed} з {len(parts)} {what}")
+    complete = not failed and all(part.complete for part in parts)
+    result = TableRows(merge_rows(table_type, parts), complete=complete)
+    logger.info(f"Таблиця з {len(parts)} {what}: {len(result)} працівників")
+    return result
+
+async def request_table_strips(strips, table_type, on_row=None):
+    """Смуги розпізнаються паралельно (одночасність обмежує GeminiClient), рядки з перекриттів зливаються"""
+    part_row = unique_rows(on_row)
+    return await gather_table_parts(
+        table_type, [request_table_analysis(strip, table_type, part_row) for strip in strips], "смуг"
+    )
+
+async def analyze_table_photos(bot, photos, table_type="medical", on_row=None):
+    """Кілька фото (сторінки альбому) завантажуються й розпізнаються паралельно в один список"""
+    if len(photos) == 1:
+        return await analyze_table_photo(bot, photos[0], table_type, on_row)
+    part_row = unique_rows(on_row)
+    return await gather_table_parts(
+        table_type, [analyze_table_photo(bot, photo, table_type, part_row) for photo in photos], "фото"
+    )
+
+def album_photos(message, album=None):
+    """Найбільші розміри всіх фото повідомлення або альбому"""
+    return [m.photo[-1] for m in (album or [message]) if m.photo]
+
+def partial_notice(employees):
+    """Попередження для неповного результату розпізнавання"""
+    if employees.complete:
+        return ""
+    return "⚠️ *Таблицю розпізнано не повністю — список може бути неповним. Надішліть фото ще раз.*\n\n"
+
+def table_progress(wait_msg):
+    """on_row для analyze_table_photo: показує розпізнані рядки з обмеженою частотою редагувань"""
+    progress = ProgressMessage(wait_msg)
+    
+    async def on_row(row, count):
+        await progress.update(f"🔍 Аналізую таблицю... розпізнано {count}\n✔️ {row.get('name', '?')}")
+    
+    return on_row
 
 # --- ГОЛОВНЕ МЕНЮ ---
 def main_menu():
@@ -296,24 +463,12 @@ def main_menu():
 @dp.message(Command("start"))
 async def cmd_start(m: types.Message, state: FSMContext):
     await state.clear()
-    init_db()
-    conn = psycopg2.connect(DATABASE_URL)
-    cur = conn.cursor()
-    cur.execute("INSERT INTO users (user_id, username) VALUES (%s, %s) ON CONFLICT (user_id) DO NOTHING", 
-                (m.from_user.id, m.from_user.username))
-    conn.commit()
-    cur.close()
-    conn.close()
+    await repo.upsert_user(m.from_user.id, m.from_user.username)
     await m.answer("👋 Вітаю! Я оновився і готовий до роботи.", reply_markup=main_menu())
 
 # --- 2. ЗАВДАННЯ ---
 async def get_tasks_kb():
-    conn = psycopg2.connect(DATABASE_URL)
-    cur = conn.cursor()
-    cur.execute("SELECT id, title, is_done, remind_at FROM tasks ORDER BY id ASC")
-    rows = cur.fetchall()
-    cur.close()
-    conn.close()
+    rows = await repo.get_tasks()
     kb = InlineKeyboardBuilder()
     for tid, title, done, remind_at in rows:
         icon = "✅" if done else "⬜"
@@ -332,14 +487,8 @@ async def show_tasks(m: types.Message, state: FSMContext):
 @dp.callback_query(F.data.startswith("tgl_"))
 async def toggle_task(c: types.CallbackQuery):
     tid = int(c.data.split("_")[1])
-    conn = psycopg2.connect(DATABASE_URL)
-    cur = conn.cursor()
-    cur.execute("UPDATE tasks SET is_done = NOT is_done, remind_at = NULL WHERE id = %s", (tid,))
-    conn.commit()
-    cur.execute("SELECT count(*) FROM tasks WHERE is_done = FALSE")
-    remaining = cur.fetchone()[0]
-    cur.close()
-    conn.close()
+    remaining = await repo.toggle_task(tid)
+    task_reminders.cancel(tid)
     await c.message.edit_reply_markup(reply_markup=await get_tasks_kb())
     if remaining == 0:
         await c.message.answer("🎉 Усі завдання виконано!")
@@ -352,13 +501,7 @@ async def t_add_start(c: types.CallbackQuery, state: FSMContext):
 
 @dp.message(BotStates.waiting_for_task_name)
 async def t_add_save(m: types.Message, state: FSMContext):
-    conn = psycopg2.connect(DATABASE_URL)
-    cur = conn.cursor()
-    cur.execute("INSERT INTO tasks (title) VALUES (%s) RETURNING id", (m.text,))
-    new_id = cur.fetchone()[0]
-    conn.commit()
-    cur.close()
-    conn.close()
+    new_id = await repo.add_task(m.text)
     kb = InlineKeyboardBuilder()
     kb.button(text="⏰ Через 1 год", callback_data=f"rem_{new_id}_60")
     kb.button(text="⏰ Через 2 год", callback_data=f"rem_{new_id}_120")
@@ -376,24 +519,16 @@ async def set_reminder(c: types.CallbackQuery):
     tid = int(parts[1])
     minutes = int(parts[2])
     remind_time = datetime.now(KYIV_TZ) + timedelta(minutes=minutes)
-    conn = psycopg2.connect(DATABASE_URL)
-    cur = conn.cursor()
-    cur.execute("UPDATE tasks SET remind_at = %s WHERE id = %s", (remind_time, tid))
-    conn.commit()
-    cur.close()
-    conn.close()
+    title = await repo.set_task_reminder(tid, remind_time)
+    if title is not None:
+        task_reminders.schedule(tid, title, remind_time)
     await c.message.edit_text(f"✅ Нагадування встановлено на {remind_time.strftime('%H:%M')}!", reply_markup=await get_tasks_kb())
 
 @dp.callback_query(F.data == "t_del_menu")
 async def t_del_menu(c: types.CallbackQuery):
-    conn = psycopg2.connect(DATABASE_URL)
-    cur = conn.cursor()
-    cur.execute("SELECT id, title FROM tasks")
-    rows = cur.fetchall()
-    cur.close()
-    conn.close()
+    rows = await repo.get_tasks()
     kb = InlineKeyboardBuilder()
-    for tid, title in rows:
+    for tid, title, _, _ in rows:
         kb.button(text=f"❌ {title}", callback_data=f"tdel_{tid}")
     kb.adjust(1)
     kb.row(types.InlineKeyboardButton(text="🔙 Назад", callback_data="t_back"))
@@ -402,12 +537,8 @@ async def t_del_menu(c: types.CallbackQuery):
 @dp.callback_query(F.data.startswith("tdel_"))
 async def t_del_exec(c: types.CallbackQuery):
     tid = int(c.data.split("_")[1])
-    conn = psycopg2.connect(DATABASE_URL)
-    cur = conn.cursor()
-    cur.execute("DELETE FROM tasks WHERE id = %s", (tid,))
-    conn.commit()
-    cur.close()
-    conn.close()
+    await repo.delete_task(tid)
+    task_reminders.cancel(tid)
     await c.answer("Видалено")
     await c.message.edit_text("📝 Список завдань:", reply_markup=await get_tasks_kb())
 
@@ -419,12 +550,7 @@ async def t_back(c: types.CallbackQuery):
 @dp.message(F.text == "🚍 Маршрути")
 async def show_routes(m: types.Message, state: FSMContext):
     await state.clear()
-    conn = psycopg2.connect(DATABASE_URL)
-    cur = conn.cursor()
-    cur.execute("SELECT id, info FROM routes ORDER BY id ASC")
-    rows = cur.fetchall()
-    cur.close()
-    conn.close()
+    rows = await repo.get_routes()
     txt = "🚍 **Маршрути розвозки:**\n\n" + ("-" if not rows else "\n".join([f"📍 {r[1]}" for r in rows]))
     kb = InlineKeyboardBuilder().button(text="➕ Додати", callback_data="r_add").button(text="🗑 Видалити", callback_data="r_del_list").adjust(2)
     await m.answer(txt, reply_markup=kb.as_markup(), parse_mode="Markdown")
@@ -436,23 +562,13 @@ async def r_add_start(c: types.CallbackQuery, state: FSMContext):
 
 @dp.message(BotStates.waiting_for_route_data)
 async def r_add_save(m: types.Message, state: FSMContext):
-    conn = psycopg2.connect(DATABASE_URL)
-    cur = conn.cursor()
-    cur.execute("INSERT INTO routes (info) VALUES (%s)", (m.text,))
-    conn.commit()
-    cur.close()
-    conn.close()
+    await repo.add_route(m.text)
     await m.answer("✅ Зупинку додано!")
     await state.clear()
 
 @dp.callback_query(F.data == "r_del_list")
 async def r_del_list(c: types.CallbackQuery):
-    conn = psycopg2.connect(DATABASE_URL)
-    cur = conn.cursor()
-    cur.execute("SELECT id, info FROM routes")
-    rows = cur.fetchall()
-    cur.close()
-    conn.close()
+    rows = await repo.get_routes()
     kb = InlineKeyboardBuilder()
     for rid, info in rows:
         kb.button(text=f"❌ {info[:20]}", callback_data=f"rdel_{rid}")
@@ -462,12 +578,7 @@ async def r_del_list(c: types.CallbackQuery):
 @dp.callback_query(F.data.startswith("rdel_"))
 async def r_del_exec(c: types.CallbackQuery):
     rid = int(c.data.split("_")[1])
-    conn = psycopg2.connect(DATABASE_URL)
-    cur = conn.cursor()
-    cur.execute("DELETE FROM routes WHERE id = %s", (rid,))
-    conn.commit()
-    cur.close()
-    conn.close()
+    await repo.delete_route(rid)
     await c.answer("Видалено")
     await r_del_list(c)
 
@@ -485,15 +596,10 @@ async def bday_menu(m: types.Message, state: FSMContext):
 
 @dp.callback_query(F.data == "e_list")
 async def e_list(c: types.CallbackQuery):
-    conn = psycopg2.connect(DATABASE_URL)
-    cur = conn.cursor()
-    cur.execute("SELECT full_name, birth_date FROM employees ORDER BY EXTRACT(MONTH FROM birth_date), EXTRACT(DAY FROM birth_date)")
-    rows = cur.fetchall()
-    cur.close()
-    conn.close()
+    rows = await repo.get_employees_by_birthday()
     res = {"Керівники": [], "Працівники": []}
-    for name, date in rows:
-        line = f"{date.strftime('%d.%m')} — {name}"
+    for _, name, date in rows:
+        line = f"{date.strftime('%d.%m') if date else '??.??'} — {name}"
         if any(m_name in name for m_name in MANAGERS_NAMES):
             res["Керівники"].append(line)
         else:
@@ -513,12 +619,7 @@ async def e_add_save(m: types.Message, state: FSMContext):
     try:
         p = m.text.split(" - ")
         d = datetime.strptime(p[1].strip(), "%d.%m.%Y").date()
-        conn = psycopg2.connect(DATABASE_URL)
-        cur = conn.cursor()
-        cur.execute("INSERT INTO employees (full_name, birth_date) VALUES (%s, %s)", (p[0].strip(), d))
-        conn.commit()
-        cur.close()
-        conn.close()
+        await repo.add_employee(p[0].strip(), d)
         await m.answer("✅ Успішно додано!")
         await state.clear()
     except:
@@ -526,14 +627,9 @@ async def e_add_save(m: types.Message, state: FSMContext):
 
 @dp.callback_query(F.data == "e_del_l")
 async def e_del_l(c: types.CallbackQuery):
-    conn = psycopg2.connect(DATABASE_URL)
-    cur = conn.cursor()
-    cur.execute("SELECT id, full_name FROM employees ORDER BY full_name")
-    rows = cur.fetchall()
-    cur.close()
-    conn.close()
+    rows = await repo.get_employees_by_name()
     kb = InlineKeyboardBuilder()
-    for eid, name in rows:
+    for eid, name, _ in rows:
         kb.button(text=f"🗑 {name[:25]}", callback_data=f"ed_{eid}")
     kb.adjust(1)
     await c.message.edit_text("🗑 Кого видалити?", reply_markup=kb.as_markup())
@@ -541,12 +637,7 @@ async def e_del_l(c: types.CallbackQuery):
 @dp.callback_query(F.data.startswith("ed_"))
 async def e_del_do(c: types.CallbackQuery):
     eid = int(c.data.split("_")[1])
-    conn = psycopg2.connect(DATABASE_URL)
-    cur = conn.cursor()
-    cur.execute("DELETE FROM employees WHERE id = %s", (eid,))
-    conn.commit()
-    cur.close()
-    conn.close()
+    await repo.delete_employee(eid)
     await c.answer("Видалено!")
     await e_list(c)
 
@@ -560,12 +651,7 @@ async def change_shift(m: types.Message, state: FSMContext):
 @dp.callback_query(F.data.startswith("s_"))
 async def set_shift(c: types.CallbackQuery):
     s = "day" if "day" in c.data else "night"
-    conn = psycopg2.connect(DATABASE_URL)
-    cur = conn.cursor()
-    cur.execute("UPDATE users SET shift_type = %s WHERE user_id = %s", (s, c.from_user.id))
-    conn.commit()
-    cur.close()
-    conn.close()
+    await repo.set_shift(c.from_user.id, s)
     await c.message.answer(f"✅ Встановлено графік: {s.upper()}")
     await c.answer()
 
@@ -573,9 +659,10 @@ async def set_shift(c: types.CallbackQuery):
 @dp.message(F.text == "💰 Баланс SMS")
 async def check_sms_balance(message: types.Message):
     wait_msg = await message.answer("🔄 Перевіряю баланс...")
-    balance = await sms_client.get_extended_balance()
+    balance = await sms_balance.get()
     if balance.get('success'):
-        await wait_msg.edit_text(f"💰 **Баланс SMS Fly:**\n\n📱 SMS: {balance.get('sms_balance', '0')} грн\n💬 Viber: {balance.get('viber_balance', '0')} грн", parse_mode="Markdown")
+        age = f"\n\n🕒 Оновлено {int(sms_balance.age // 60)} хв тому" if sms_balance.age >= 60 else ""
+        await wait_msg.edit_text(f"💰 **Баланс SMS Fly:**\n\n📱 SMS: {balance.get('sms_balance', '0')} грн\n💬 Viber: {balance.get('viber_balance', '0')} грн{age}", parse_mode="Markdown")
     else:
         await wait_msg.edit_text(f"❌ **Помилка:** {balance.get('error', 'Невідома помилка')}", parse_mode="Markdown")
 
@@ -584,7 +671,7 @@ async def check_sms_balance(message: types.Message):
 async def medical_start(message: types.Message, state: FSMContext):
     await message.answer(
         "🏥 **Медичний огляд працівників**\n\n"
-        "📸 **Сфотографуйте таблицю** з графіком медоглядів.\n\n"
+        "📸 **Сфотографуйте таблицю** з графіком медоглядів.\nБагатосторінковий графік — надішліть одним альбомом.\n\n"
         "⚡ *Використовується Gemini 2.5 Flash*\n"
         "💡 *Фотографуйте чітко, при хорошому освітленні*",
         parse_mode="Markdown"
@@ -592,15 +679,15 @@ async def medical_start(message: types.Message, state: FSMContext):
     await state.set_state(BotStates.waiting_for_medical_photo)
 
 @dp.message(BotStates.waiting_for_medical_photo, F.photo)
-async def process_medical_photo(message: types.Message, state: FSMContext, bot: Bot):
-    wait_msg = await message.answer("🔍 **Аналізую таблицю...**\n(це займе 5-10 секунд)", parse_mode="Markdown")
+async def process_medical_photo(message: types.Message, state: FSMContext, bot: Bot, album: Optional[List[types.Message]] = None):
+    photos = album_photos(message, album)
+    wait_msg = await message.answer(
+        "🔍 **Аналізую таблицю...**" if len(photos) == 1 else f"🔍 **Аналізую таблицю ({len(photos)} фото)...**",
+        parse_mode="Markdown"
+    )
     
     try:
-        photo = message.photo[-1]
-        file = await bot.get_file(photo.file_id)
-        file_bytes = await bot.download_file(file.file_path)
-        
-        employees = await analyze_table_with_gemini(file_bytes.read(), "medical")
+        employees = await analyze_table_photos(bot, photos, "medical", on_row=table_progress(wait_msg))
         
         if not employees:
             await wait_msg.edit_text(
@@ -611,19 +698,11 @@ async def process_medical_photo(message: types.Message, state: FSMContext, bot:
             await state.clear()
             return
         
-        result = "📋 **Результат аналізу:**\n\n"
+        result = "📋 **Результат аналізу:**\n\n" + partial_notice(employees)
         employees_with_needs = []
         
         for emp in employees:
-            needs = []
-            if emp.get('medical') == 'так':
-                needs.append("М")
-            if emp.get('fluorography') == 'так':
-                needs.append("Ф")
-            if emp.get('gynecology') == 'так':
-                needs.append("Г")
-            if emp.get('vaccination') == 'так':
-                needs.append("В")
+            needs = medical_needs(emp)
             
             if needs:
                 result += f"• **{emp['name']}**: {', '.join(needs)}\n"
@@ -640,6 +719,7 @@ async def process_medical_photo(message: types.Message, state: FSMContext, bot:
         
         kb = InlineKeyboardBuilder()
         kb.button(text="✉️ Відправити SMS", callback_data="send_medical_sms")
+        kb.button(text="🕒 Запланувати SMS", callback_data="schedule_sms_medical")
         kb.button(text="❌ Скасувати", callback_data="cancel_medical")
         kb.adjust(1)
         
@@ -656,61 +736,8 @@ async def process_medical_photo(message: types.Message, state: FSMContext, bot:
 
 @dp.callback_query(F.data == "send_medical_sms")
 async def send_medical_sms(callback: types.CallbackQuery, state: FSMContext):
-    data = await state.get_data()
-    employees = data.get('medical_employees', [])
-    
-    if not employees:
-        await callback.answer("Немає даних для відправки")
-        await state.clear()
-        return
-    
-    await callback.message.edit_text(f"📤 **Відправляю SMS {len(employees)} працівникам...**\nБудь ласка, зачекайте.", parse_mode="Markdown")
-    
-    results = []
-    for emp in employees:
-        phone = get_employee_phone(emp['name'])
-        
-        if phone:
-            needs_short = []
-            if emp.get('medical') == 'так':
-                needs_short.append("М")
-            if emp.get('fluorography') == 'так':
-                needs_short.append("Ф")
-            if emp.get('gynecology') == 'так':
-                needs_short.append("Г")
-            if emp.get('vaccination') == 'так':
-                needs_short.append("Щ")
-            
-            if needs_short:
-                msg = f"Потрібне медобстеження: {', '.join(needs_short)}"
-                result = await sms_client.send_sms(phone, msg)
-                results.append({"name": emp['name'], "success": result['success'], "phone": phone, "needs": needs_short})
-            else:
-                results.append({"name": emp['name'], "success": None, "phone": None})
-        else:
-            results.append({"name": emp['name'], "success": False, "error": "немає телефону"})
-    
-    success_count = sum(1 for r in results if r.get('success') is True)
-    no_phone_count = sum(1 for r in results if r.get('error') == "немає телефону")
-    
-    report = f"📊 **Звіт про відправку SMS:**\n\n"
-    report += f"✅ Успішно: {success_count}\n"
-    report += f"📭 Немає телефону: {no_phone_count}\n"
-    report += f"❌ Помилок: {len(employees) - success_count - no_phone_count}\n\n"
-    
-    if results:
-        report += "**Деталі:**\n"
-        for r in results:
-            if r.get('success') is True:
-                report += f"✅ {r['name']}: {', '.join(r.get('needs', []))}\n"
-            elif r.get('error') == "немає телефону":
-                report += f"📭 {r['name']} - немає номера\n"
-            else:
-                report += f"❌ {r['name']} - помилка\n"
-    
-    await callback.message.edit_text(report, parse_mode="Markdown")
-    await state.clear()
-    await callback.answer()
+    campaign_id, notice = await enqueue_sms_campaign(state, "medical", callback.from_user.id, callback.message)
+    await callback.answer(notice, show_alert=campaign_id is None)
 
 @dp.callback_query(F.data == "cancel_medical")
 async def cancel_medical(callback: types.CallbackQuery, state: FSMContext):
@@ -723,7 +750,7 @@ async def cancel_medical(callback: types.CallbackQuery, state: FSMContext):
 async def sunday_start(message: types.Message, state: FSMContext):
     await message.answer(
         "📅 **Графік роботи в неділю**\n\n"
-        "📸 **Сфотографуйте таблицю** з графіком роботи.\n\n"
+        "📸 **Сфотографуйте таблицю** з графіком роботи.\nБагатосторінковий графік — надішліть одним альбомом.\n\n"
         "⚡ *Використовується Gemini 2.5 Flash*\n"
         "💡 *Фотографуйте чітко, при хорошому освітленні*",
         parse_mode="Markdown"
@@ -731,15 +758,15 @@ async def sunday_start(message: types.Message, state: FSMContext):
     await state.set_state(BotStates.waiting_for_sunday_photo)
 
 @dp.message(BotStates.waiting_for_sunday_photo, F.photo)
-async def process_sunday_photo(message: types.Message, state: FSMContext, bot: Bot):
-    wait_msg = await message.answer("🔍 **Аналізую таблицю...**\n(це займе 5-10 секунд)", parse_mode="Markdown")
+async def process_sunday_photo(message: types.Message, state: FSMContext, bot: Bot, album: Optional[List[types.Message]] = None):
+    photos = album_photos(message, album)
+    wait_msg = await message.answer(
+        "🔍 **Аналізую таблицю...**" if len(photos) == 1 else f"🔍 **Аналізую таблицю ({len(photos)} фото)...**",
+        parse_mode="Markdown"
+    )
     
     try:
-        photo = message.photo[-1]
-        file = await bot.get_file(photo.file_id)
-        file_bytes = await bot.download_file(file.file_path)
-        
-        employees = await analyze_table_with_gemini(file_bytes.read(), "sunday")
+        employees = await analyze_table_photos(bot, photos, "sunday", on_row=table_progress(wait_msg))
         
         if not employees:
             await wait_msg.edit_text(
@@ -750,14 +777,14 @@ async def process_sunday_photo(message: types.Message, state: FSMContext, bot: B
             await state.clear()
             return
         
-        workers = [emp for emp in employees if emp.get('need_to_work') == 'так']
+        workers = [emp for emp in employees if emp.get('need_to_work')]
         
         if not workers:
             await wait_msg.edit_text("📭 **За графіком ніхто не працює в неділю.**", parse_mode="Markdown")
             await state.clear()
             return
         
-        result = "📋 **Працівники, які працюють в неділю:**\n\n"
+        result = "📋 **Працівники, які працюють в неділю:**\n\n" + partial_notice(employees)
         for w in workers:
             result += f"• **{w['name']}**\n"
         
@@ -765,6 +792,8 @@ async def process_sunday_photo(message: types.Message, state: FSMContext, bot: B
         
         kb = InlineKeyboardBuilder()
         kb.button(text="✉️ Відправити SMS", callback_data="send_sunday_sms")
+        kb.button(text=f"🕕 SMS у суботу о {SUNDAY_SMS_TIME}", callback_data="saturday_sunday_sms")
+        kb.button(text="🕒 Запланувати SMS", callback_data="schedule_sms_sunday")
         kb.button(text="❌ Скасувати", callback_data="cancel_sunday")
         kb.adjust(1)
         
@@ -781,48 +810,8 @@ async def process_sunday_photo(message: types.Message, state: FSMContext, bot: B
 
 @dp.callback_query(F.data == "send_sunday_sms")
 async def send_sunday_sms(callback: types.CallbackQuery, state: FSMContext):
-    data = await state.get_data()
-    workers = data.get('sunday_workers', [])
-    
-    if not workers:
-        await callback.answer("Немає даних для відправки")
-        await state.clear()
-        return
-    
-    await callback.message.edit_text(f"📤 **Відправляю SMS {len(workers)} працівникам...**\nБудь ласка, зачекайте.", parse_mode="Markdown")
-    
-    results = []
-    for worker in workers:
-        phone = get_employee_phone(worker['name'])
-        
-        if phone:
-            msg = f"Вітаю! В неділю очікуємо на зміні."
-            result = await sms_client.send_sms(phone, msg)
-            results.append({"name": worker['name'], "success": result['success'], "phone": phone})
-        else:
-            results.append({"name": worker['name'], "success": False, "error": "немає телефону"})
-    
-    success_count = sum(1 for r in results if r.get('success') is True)
-    no_phone_count = sum(1 for r in results if r.get('error') == "немає телефону")
-    
-    report = f"📊 **Звіт про відправку SMS:**\n\n"
-    report += f"✅ Успішно: {success_count}\n"
-    report += f"📭 Немає телефону: {no_phone_count}\n"
-    report += f"❌ Помилок: {len(workers) - success_count - no_phone_count}\n\n"
-    
-    if results:
-        report += "**Деталі:**\n"
-        for r in results:
-            if r.get('success') is True:
-                report += f"✅ {r['name']}\n"
-            elif r.get('error') == "немає телефону":
-                report += f"📭 {r['name']} - немає номера\n"
-            else:
-                report += f"❌ {r['name']} - помилка\n"
-    
-    await callback.message.edit_text(report, parse_mode="Markdown")
-    await state.clear()
-    await callback.answer()
+    campaign_id, notice = await enqueue_sms_campaign(state, "sunday", callback.from_user.id, callback.message)
+    await callback.answer(notice, show_alert=campaign_id is None)
 
 @dp.callback_query(F.data == "cancel_sunday")
 async def cancel_sunday(callback: types.CallbackQuery, state: FSMContext):
@@ -830,57 +819,230 @@ async def cancel_sunday(callback: types.CallbackQuery, state: FSMContext):
     await state.clear()
     await callback.answer()
 
+@dp.callback_query(F.data == "saturday_sunday_sms")
+async def saturday_sunday_sms(callback: types.CallbackQuery, state: FSMContext):
+    when = next_saturday_evening(datetime.now(KYIV_TZ))
+    campaign_id, notice = await enqueue_sms_campaign(state, "sunday", callback.from_user.id, callback.message, scheduled_at=when)
+    await callback.answer(notice, show_alert=campaign_id is None)
+
+# --- ЗАПЛАНОВАНІ SMS-РОЗСИЛКИ ---
+@dp.callback_query(F.data.startswith("schedule_sms_"))
+async def schedule_sms(callback: types.CallbackQuery, state: FSMContext):
+    kind = callback.data.split("_")[2]
+    if not campaign_messages(kind, await state.get_data()):
+        await callback.answer("Немає даних для відправки")
+        await state.clear()
+        return
+    await state.update_data(sms_kind=kind, sms_origin=[callback.message.chat.id, callback.message.message_id])
+    await state.set_state(BotStates.waiting_for_sms_schedule)
+    await callback.answer()
+    await callback.message.answer(
+        "🕒 **Коли відправити SMS?** (час київський)\n\n"
+        "`25.10 18:00` — дата й час\n"
+        "`18:00` — найближчі такі години\n"
+        f"Третім числом можна задати темп, SMS/с (за замовчуванням {SMS_SCHEDULE_RATE:g}): `25.10 18:00 0.2`",
+        parse_mode="Markdown"
+    )
+
+@dp.message(BotStates.waiting_for_sms_schedule)
+async def process_sms_schedule(message: types.Message, state: FSMContext):
+    try:
+        when, rate = parse_sms_schedule(message.text or "", datetime.now(KYIV_TZ))
+    except ValueError as e:
+        await message.answer(f"❌ Не зрозумів час ({e}). Приклад: `25.10 18:00` або `18:00 0.5`", parse_mode="Markdown")
+        return
+    kind = (await state.get_data()).get("sms_kind")
+    confirm = await message.answer("⏳ Планую розсилку...")
+    campaign_id, notice = await enqueue_sms_campaign(state, kind, message.from_user.id, confirm, scheduled_at=when, rate=rate)
+    if campaign_id is None:
+        await confirm.edit_text(notice)
+
+@dp.callback_query(F.data.startswith("smsctl_"))
+async def control_sms_campaign(callback: types.CallbackQuery):
+    # callback_data приходить від клієнта — лише відомі дії й числовий id
+    actions = {
+        "pause": (sms_outbox.pause, "⏸ Розсилку призупинено"),
+        "resume": (sms_outbox.resume, "▶️ Розсилку продовжено"),
+        "cancel": (sms_outbox.cancel, "🛑 Розсилку скасовано"),
+    }
+    parts = callback.data.split("_")
+    if len(parts) != 3 or parts[1] not in actions or not parts[2].isdigit():
+        await callback.answer()
+        return
+    control, notice = actions[parts[1]]
+    campaign_id = int(parts[2])
+    status = await sms_outbox.campaign_status(campaign_id)
+    if callback.from_user.id != status["created_by"] and callback.from_user.id not in ADMIN_IDS:
+        await callback.answer("⛔ Керувати розсилкою може лише той, хто її запустив.", show_alert=True)
+        return
+    changed = await control(campaign_id)
+    await callback.answer(notice if changed else "Розсилку вже завершено або змінено")
+
 # --- 9. НАГАДУВАННЯ ---
-async def global_check():
+COUNTERS_MSG = "⚡ **Нагадування:** Зафіксувати лічильники!"
+STAFF_MSG = "🔔 **Нагадування:** Подайте кількість персоналу!"
+
+# Ключ з config.REMINDER_TIMES -> (зміна, текст, дні тижня)
+SHIFT_REMINDERS = {
+    "night_counters": ("night", COUNTERS_MSG, "*"),
+    "day_counters": ("day", COUNTERS_MSG, "*"),
+    "day_staff": ("day", STAFF_MSG, "mon-fri"),
+    "night_staff": ("night", STAFF_MSG, "mon-fri"),
+}
+
+async def send_shift_reminder(shift_type, msg):
+    try:
+        await broadcaster.broadcast(await repo.get_user_ids(shift_type), msg, parse_mode="Markdown")
+    except Exception as e:
+        logger.error(f"Shift reminder error: {e}")
+
+async def send_birthday_greetings():
     try:
         now = datetime.now(KYIV_TZ)
-        t = now.strftime("%H:%M")
-        conn = psycopg2.connect(DATABASE_URL)
-        cur = conn.cursor()
-        cur.execute("SELECT user_id, shift_type FROM users")
-        users = cur.fetchall()
-        
-        if t == "09:00":
-            cur.execute("SELECT full_name FROM employees WHERE EXTRACT(MONTH FROM birth_date) = %s AND EXTRACT(DAY FROM birth_date) = %s", (now.month, now.day))
-            bdays = cur.fetchall()
-            if bdays:
-                names = "\n".join([f"🎉 {b[0]}" for b in bdays])
-                msg = f"🎂 **Сьогодні святкують:**\n\n{names}\n\nНе забудьте привітати!"
-                for uid, _ in users:
-                    try: await bot.send_message(uid, msg, parse_mode="Markdown")
-                    except: pass
-        
-        for uid, s in users:
-            msg = None
-            if s == 'night' and t == "02:45":
-                msg = "⚡ **Нагадування:** Зафіксувати лічильники!"
-            elif s == 'day' and t == "16:40":
-                msg = "⚡ **Нагадування:** Зафіксувати лічильники!"
-            if now.weekday() <= 4:
-                if s == 'day' and t == "07:43":
-                    msg = "🔔 **Нагадування:** Подайте кількість персоналу!"
-                elif s == 'night' and t == "16:43":
-                    msg = "🔔 **Нагадування:** Подайте кількість персоналу!"
-            if msg:
-                try: await bot.send_message(uid, msg, parse_mode="Markdown")
-                except: pass
-        
-        cur.execute("SELECT id, title FROM tasks WHERE is_done = FALSE AND remind_at IS NOT NULL AND remind_at <= %s", (now,))
-        due_tasks = cur.fetchall()
-        for tid, title in due_tasks:
-            for uid, _ in users:
-                try:
-                    kb = InlineKeyboardBuilder()
-                    kb.button(text="✅ Виконано", callback_data=f"tgl_{tid}")
-                    await bot.send_message(uid, f"⏰ **НАГАДУВАННЯ:**\n{title}", reply_markup=kb.as_markup(), parse_mode="Markdown")
-                except: pass
-            next_remind = now + timedelta(hours=1)
-            cur.execute("UPDATE tasks SET remind_at = %s WHERE id = %s", (next_remind, tid))
-            conn.commit()
-        cur.close()
-        conn.close()
+        bdays = await repo.get_birthdays_on(now.month, now.day)
+        if not bdays:
+            return
+        names = "\n".join([f"🎉 {b}" for b in bdays])
+        msg = f"🎂 **Сьогодні святкують:**\n\n{names}\n\nНе забудьте привітати!"
+        await broadcaster.broadcast(await repo.get_user_ids(), msg, parse_mode="Markdown")
+    except Exception as e:
+        logger.error(f"Birthday reminder error: {e}")
+
+async def send_task_reminders(due_tasks):
+    user_ids = await repo.get_user_ids()
+    for tid, title in due_tasks:
+        kb = InlineKeyboardBuilder()
+        kb.button(text="✅ Виконано", callback_data=f"tgl_{tid}")
+        await broadcaster.broadcast(user_ids, f"⏰ **НАГАДУВАННЯ:**\n{title}", reply_markup=kb.as_markup(), parse_mode="Markdown")
+
+task_reminders = TaskReminderEngine(repo, send_task_reminders)
+
+def _cron_job(func, key, day_of_week="*", args=()):
+    hour, minute = map(int, REMINDER_TIMES[key].split(":"))
+    scheduler.add_job(
+        func, CronTrigger(hour=hour, minute=minute, day_of_week=day_of_week, timezone=KYIV_TZ),
+        args=args, id=key, replace_existing=True,
+        misfire_grace_time=REMINDER_MISFIRE_GRACE, coalesce=True, max_instances=1
+    )
+
+def setup_reminder_jobs():
+    """Зареєструвати нагадування як cron-задачі за config.REMINDER_TIMES"""
+    for key, (shift_type, msg, day_of_week) in SHIFT_REMINDERS.items():
+        _cron_job(send_shift_reminder, key, day_of_week, args=(shift_type, msg))
+    _cron_job(send_birthday_greetings, "birthdays")
+    scheduler.add_job(purge_expired, CronTrigger(hour=4, minute=0, timezone=KYIV_TZ), id="purge_ai_cache",
+                      replace_existing=True, misfire_grace_time=REMINDER_MISFIRE_GRACE, coalesce=True)
+    hour, minute = map(int, ADVICE_PRECOMPUTE_TIME.split(":"))
+    scheduler.add_job(precompute_daily_advice, CronTrigger(hour=hour, minute=minute, timezone=KYIV_TZ),
+                      id="precompute_advice", replace_existing=True, misfire_grace_time=3600, coalesce=True,
+                      max_instances=1)
+
+# --- СЛУЖБОВІ КОМАНДИ ---
+def ai_stats():
+    """Метрики викликів ШІ разом зі станом клієнта та кешів"""
+    return {
+        **ai_metrics.snapshot(),
+        "breaker": gemini.breaker.state,
+        "single_flight": {"gemini": gemini.flights.stats(), "tables": table_flights.stats()},
+        "caches": [analysis_cache.stats()],
+    }
+
+@dp.message(Command("ai_stats"))
+async def cmd_ai_stats(message: types.Message):
+    if message.from_user.id not in ADMIN_IDS:
+        await message.answer("⛔ Команда доступна лише адміністраторам.")
+        return
+    flights = gemini.flights.stats()["shared"] + table_flights.stats()["shared"]
+    await message.answer(
+        f"{ai_metrics.report()}\n\n🔁 Об'єднано однакових запитів: {flights}\n⚡ Circuit breaker: {gemini.breaker.state}",
+        parse_mode="HTML"
+    )
+
+def open_campaigns_text(campaigns):
+    if not campaigns:
+        return ""
+    text = "\n\n<b>Незавершені кампанії:</b>\n"
+    for c in campaigns:
+        icon = "⏸" if c["state"] == "paused" else "📤"
+        text += f"{icon} #{c['id']} {c['kind']}: лишилось {c['left']}, старт {c['scheduled_at'].astimezone(KYIV_TZ):%d.%m %H:%M}"
+        text += f", {c['rate']:g} SMS/с\n" if c["rate"] else "\n"
+    return text
+
+def open_campaigns_keyboard(campaigns):
+    if not campaigns:
+        return None
+    kb = InlineKeyboardBuilder()
+    for c in campaigns:
+        if c["state"] == "paused":
+            kb.button(text=f"▶️ #{c['id']}", callback_data=f"smsctl_resume_{c['id']}")
+        else:
+            kb.button(text=f"⏸ #{c['id']}", callback_data=f"smsctl_pause_{c['id']}")
+        kb.button(text=f"🛑 #{c['id']}", callback_data=f"smsctl_cancel_{c['id']}")
+    kb.adjust(2)
+    return kb.as_markup()
+
+@dp.message(Command("sms_status"))
+async def cmd_sms_status(message: types.Message):
+    if message.from_user.id not in ADMIN_IDS:
+        await message.answer("⛔ Команда доступна лише адміністраторам.")
+        return
+    try:
+        summary = await sms_outbox.summary()
+        campaigns = await sms_outbox.open_campaigns()
     except Exception as e:
-        logger.error(f"Global check error: {e}")
+        logger.error(f"SMS status error: {e}")
+        await message.answer("❌ Не вдалося отримати стан черги SMS")
+        return
+    counts = summary["counts"]
+    await message.answer(
+        f"📨 <b>Черга SMS (за {summary['hours']} год)</b>\n\n"
+        f"⏳ Очікують: {counts['pending']} (затримка {summary['oldest_pending_s']} с)\n"
+        f"📤 Відправляються: {counts['sending']}\n"
+        f"✅ Надіслано: {counts['sent']} (доставлено {summary['delivery']['delivered']}, "
+        f"не доставлено {summary['delivery']['undelivered'] + summary['delivery']['expired']}, "
+        f"чекають звіту {summary['delivery']['awaiting']})\n"
+        f"❌ Помилок: {counts['failed']}\n"
+        f"🛑 Скасовано: {counts['cancelled']}\n"
+        f"⚙️ Воркер: {'працює' if summary['worker_running'] else 'зупинений'}"
+        f"{open_campaigns_text(campaigns)}",
+        reply_markup=open_campaigns_keyboard(campaigns),
+        parse_mode="HTML"
+    )
+
+@dp.message(Command("phone"))
+async def cmd_phone(message: types.Message):
+    """/phone Прізвище Ім'я 0671234567 — додати або оновити номер у довіднику"""
+    if message.from_user.id not in ADMIN_IDS:
+        await message.answer("⛔ Команда доступна лише адміністраторам.")
+        return
+    parts = (message.text or "").split(maxsplit=1)
+    name, _, phone = (parts[1] if len(parts) > 1 else "").rpartition(" ")
+    if not name.strip():
+        await message.answer("Формат: `/phone Прізвище Ім'я 0671234567`", parse_mode="Markdown")
+        return
+    try:
+        normalized = await repo.upsert_employee_phone(name, phone)
+    except ValueError as e:
+        await message.answer(f"❌ {e}")
+        return
+    except Exception as e:
+        logger.error(f"Phone upsert error: {e}")
+        await message.answer("❌ Не вдалося зберегти номер")
+        return
+    await message.answer(f"✅ {name.strip()}: {normalized}")
+
+async def sms_stats(request):
+    return web.json_response(await sms_outbox.summary())
+
+def stats_route(handler, token):
+    """Обробник /stats/* лише для запитів з токеном (заголовок X-Stats-Token або ?token=), інакше 403"""
+    async def guarded(request):
+        given = request.headers.get("X-Stats-Token") or request.query.get("token", "")
+        if not secrets.compare_digest(given.encode(), token.encode()):
+            raise web.HTTPForbidden()
+        response = handler(request)
+        return await response if asyncio.iscoroutine(response) else response
+    return guarded
 
 # --- 10. ЗАГАЛЬНИЙ ОБРОБНИК ---
 @dp.message()
@@ -892,18 +1054,54 @@ async def shutdown():
     logger.info("Отримано сигнал завершення...")
     shutdown_event.set()
     scheduler.shutdown(wait=False)
+    await task_reminders.stop()
+    await sms_outbox.stop()
     if web_runner:
         await web_runner.cleanup()
+    await repo.close()
+    if http_task and not http_task.done():
+        http_task.cancel()
+        try:
+            await http_task
+        except asyncio.CancelledError:
+            pass
+    await http_client.close()
+    image_processor.shutdown()
     await bot.session.close()
     logger.info("Бот зупинено")
     sys.exit(0)
 
 def signal_handler():
-    asyncio.create_task(shutdown())
+    shutdown_event.set()
+
+def log_http_warmup(task):
+    if not task.cancelled() and task.exception():
+        logger.error(f"❌ Помилка прогріву HTTP-з'єднань: {task.exception()}")
+
+async def enable_webhook(secret):
+    """
+    Зареєструвати webhook у Telegram. False — якщо не вдалося (тоді працюємо через polling).
+    Секрет спільний для всіх екземплярів за балансувальником, а черга оновлень
+    не скидається — інакше кожен деплой губив би повідомлення.
+    """
+    if not secret:
+        logger.error("❌ WEBHOOK_URL задано без WEBHOOK_SECRET — webhook не вмикаю, працюю через polling")
+        return False
+    try:
+        await bot.set_webhook(
+            f"{WEBHOOK_URL}{WEBHOOK_PATH}",
+            secret_token=secret,
+            allowed_updates=dp.resolve_used_update_types()
+        )
+        logger.info(f"🌐 Webhook встановлено: {WEBHOOK_URL}{WEBHOOK_PATH}")
+        return True
+    except Exception as e:
+        logger.error(f"❌ Не вдалося встановити webhook, переходжу на polling: {e}")
+        return False
 
 # --- ЗАПУСК ---
 async def main():
-    global web_runner
+    global web_runner, http_task
     
     if not GEMINI_API_KEY:
         logger.error("❌ GEMINI_API_KEY не знайдено! Бот не зможе аналізувати фото.")
@@ -911,28 +1109,61 @@ async def main():
         logger.error("❌ BOT_TOKEN не знайдено! Бот не запуститься.")
         return
     
-    init_db()
+    try:
+        await repo.open()
+    except Exception as e:
+        logger.error(f"❌ Не вдалося відкрити пул БД: {e}")
+    try:
+        await run_migrations()
+    except Exception as e:
+        # Зі старою схемою бот працювати не може — зупиняємось, а не падаємо на кожному запиті
+        logger.critical(f"❌ Помилка міграції БД, запуск зупинено: {e}")
+        await repo.close()
+        await bot.session.close()
+        sys.exit(1)
     
+    loop = asyncio.get_running_loop()
     for sig in (signal.SIGTERM, signal.SIGINT):
-        signal.signal(sig, lambda s, f: asyncio.create_task(shutdown()))
+        loop.add_signal_handler(sig, signal_handler)
     
-    await bot.delete_webhook(drop_pending_updates=True)
-    await asyncio.sleep(2)
-    
-    scheduler.add_job(global_check, "interval", minutes=1)
+    http_task = asyncio.create_task(http_client.start())
+    http_task.add_done_callback(log_http_warmup)
+    setup_reminder_jobs()
     scheduler.start()
+    await task_reminders.start()
+    sms_outbox.start()
     
     app = web.Application()
     app.router.add_get("/", lambda r: web.Response(text="OK"))
+    # Без STATS_TOKEN і WEBHOOK_SECRET токен випадковий — статистика фактично вимкнена
+    stats_token = STATS_TOKEN or WEBHOOK_SECRET or secrets.token_urlsafe(32)
+    app.router.add_get("/stats/db", stats_route(lambda r: web.json_response(repo.stats.as_dict()), stats_token))
+    app.router.add_get("/stats/images", stats_route(lambda r: web.json_response(image_processor.stats()), stats_token))
+    app.router.add_get("/stats/ai", stats_route(lambda r: web.json_response(ai_stats()), stats_token))
+    app.router.add_get("/stats/sms", stats_route(sms_stats, stats_token))
+    # Після setup() маршрути заморожені, тож webhook вмикаємо до нього і реєструємо
+    # обробник лише при успіху; оновлення до старту сервера Telegram доставить повторно
+    use_webhook = bool(WEBHOOK_URL) and await enable_webhook(WEBHOOK_SECRET)
+    if use_webhook:
+        SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=WEBHOOK_SECRET).register(app, path=WEBHOOK_PATH)
     web_runner = web.AppRunner(app)
     await web_runner.setup()
-    site = web.TCPSite(web_runner, '0.0.0.0', 10000)
+    site = web.TCPSite(web_runner, '0.0.0.0', PORT)
     await site.start()
     
-    logger.info("🚀 Бот успішно запущено!")
+    polling = None
+    if not use_webhook:
+        await bot.delete_webhook(drop_pending_updates=True)
+        polling = asyncio.create_task(dp.start_polling(bot, handle_signals=False))
+        polling.add_done_callback(lambda _: shutdown_event.set())
+    
+    logger.info(f"🚀 Бот успішно запущено! ({'webhook' if use_webhook else 'polling'})")
     
     try:
-        await dp.start_polling(bot)
+        await shutdown_event.wait()
+        if polling and not polling.done():
+            await dp.stop_polling()
+            await polling
     except asyncio.CancelledError:
         logger.info("Polling cancelled")
     finally:
@@ -0,0 +1,152 @@
+import math
+import time
+from collections import Counter, defaultdict, deque
+from datetime import datetime
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from config import KYIV_TZ, GEMINI_PRICE_INPUT, GEMINI_PRICE_OUTPUT
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Перцентиль методом найближчого рангу (values — відсортовані)"""
+    if not values:
+        return 0.0
+    index = max(0, min(len(values) - 1, math.ceil(q / 100 * len(values)) - 1))
+    return values[index]
+
+
+class AICall:
+    """
+    Облік одного виклику ШІ. Фази: queue — очікування слоту семафора,
+    parse — розбір відповіді (в т.ч. обробка потоку споживачем),
+    network — решта часу (запити, повтори, читання тіла).
+    """
+
+    def __init__(self, store: "AIMetrics", feature: str, model: str):
+        self.store = store
+        self.feature = feature
+        self.model = model
+        self.started = time.perf_counter()
+        self.queue = 0.0
+        self.parse = 0.0
+        self.attempts = 0
+        self.prompt_tokens = 0
+        self.response_tokens = 0
+        self.thought_tokens = 0
+        self.finished = False
+
+    def add_usage(self, usage: Optional[Dict[str, Any]]):
+        """usageMetadata Gemini; у потоці лічильники накопичувальні — беремо останні"""
+        if not usage:
+            return
+        self.prompt_tokens = usage.get("promptTokenCount", self.prompt_tokens)
+        self.response_tokens = usage.get("candidatesTokenCount", self.response_tokens)
+        self.thought_tokens = usage.get("thoughtsTokenCount", self.thought_tokens)
+
+    def finish(self, outcome: str = "ok"):
+        if self.finished:
+            return
+        self.finished = True
+        total = time.perf_counter() - self.started
+        network = max(0.0, total - self.queue - self.parse)
+        self.store.add(self, outcome, total, network)
+
+
+class AIMetrics:
+    """
+    Агреговані метрики викликів ШІ в пам'яті процесу: затримки за фічею
+    (останні window викликів), результати, токени та вартість по київських днях.
+    """
+
+    def __init__(self, window: int = 500, days: int = 14):
+        self.window = window
+        self.days = days
+        self._latency: Dict[str, Deque[Tuple[float, float, float, float]]] = defaultdict(lambda: deque(maxlen=window))
+        self._outcomes: Dict[str, Counter] = defaultdict(Counter)
+        self._models: Dict[str, Counter] = defaultdict(Counter)
+        self._tokens: Dict[str, Dict[str, Counter]] = {}
+
+    def start(self, feature: str, model: str) -> AICall:
+        return AICall(self, feature, model)
+
+    def add(self, call: AICall, outcome: str, total: float, network: float):
+        self._latency[call.feature].append((total, call.queue, network, call.parse))
+        self._outcomes[call.feature][outcome] += 1
+        self._models[call.feature][call.model] += 1
+
+        day = datetime.now(KYIV_TZ).date().isoformat()
+        if day not in self._tokens:
+            self._tokens[day] = defaultdict(Counter)
+            for old in sorted(self._tokens)[:-self.days]:
+                del self._tokens[old]
+        tokens = self._tokens[day][call.feature]
+        tokens["calls"] += 1
+        tokens["prompt"] += call.prompt_tokens
+        tokens["response"] += call.response_tokens
+        tokens["thoughts"] += call.thought_tokens
+
+    @staticmethod
+    def cost(tokens: Counter) -> float:
+        """Оцінка вартості в USD (ціни за 1M токенів з config; думки тарифікуються як вихід)"""
+        return (tokens["prompt"] * GEMINI_PRICE_INPUT
+                + (tokens["response"] + tokens["thoughts"]) * GEMINI_PRICE_OUTPUT) / 1_000_000
+
+    def snapshot(self) -> Dict[str, Any]:
+        features = {}
+        for feature, samples in self._latency.items():
+            phases = {}
+            for i, phase in enumerate(("total", "queue", "network", "parse")):
+                values = sorted(sample[i] for sample in samples)
+                phases[phase] = {
+                    "p50_ms": round(percentile(values, 50) * 1000),
+                    "p95_ms": round(percentile(values, 95) * 1000),
+                }
+            features[feature] = {
+                "calls": sum(self._outcomes[feature].values()),
+                "outcomes": dict(self._outcomes[feature]),
+                "models": dict(self._models[feature]),
+                "latency": phases,
+            }
+        daily = {}
+        for day, by_feature in sorted(self._tokens.items(), reverse=True):
+            total = sum(by_feature.values(), Counter())
+            daily[day] = {
+                "calls": total["calls"],
+                "prompt_tokens": total["prompt"],
+                "response_tokens": total["response"],
+                "thought_tokens": total["thoughts"],
+                "cost_usd": round(self.cost(total), 4),
+                "by_feature": {
+                    feature: {"calls": t["calls"], "tokens": t["prompt"] + t["response"] + t["thoughts"],
+                              "cost_usd": round(self.cost(t), 4)}
+                    for feature, t in by_feature.items()
+                },
+            }
+        return {"features": features, "daily": daily}
+
+    def report(self) -> str:
+        """Текстовий звіт для /ai_stats"""
+        snap = self.snapshot()
+        if not snap["features"]:
+            return "📊 Викликів ШІ ще не було."
+        lines = ["📊 <b>Виклики ШІ</b> (затримка p50 / p95)\n"]
+        for feature, info in sorted(snap["features"].items()):
+            lat = info["latency"]
+            errors = info["calls"] - info["outcomes"].get("ok", 0)
+            lines.append(
+                f"<b>{feature}</b>: {info['calls']} викл., помилок {errors}\n"
+                f"  всього {lat['total']['p50_ms']} / {lat['total']['p95_ms']} мс · "
+                f"черга {lat['queue']['p50_ms']} / {lat['queue']['p95_ms']} · "
+                f"мережа {lat['network']['p50_ms']} / {lat['network']['p95_ms']} · "
+                f"розбір {lat['parse']['p50_ms']} / {lat['parse']['p95_ms']}"
+            )
+        lines.append("\n💰 <b>Токени по днях</b>")
+        for day, info in list(snap["daily"].items())[:7]:
+            lines.append(
+                f"{day}: {info['calls']} викл., вхід {info['prompt_tokens']}, "
+                f"вихід {info['response_tokens'] + info['thought_tokens']} ≈ ${info['cost_usd']}"
+            )
+        return "\n".join(lines)
+
+
+ai_metrics = AIMetrics()
@@ -0,0 +1,122 @@
+import asyncio
+import logging
+import random
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Iterable
+
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramAPIError,
+    TelegramBadRequest,
+    TelegramForbiddenError,
+    TelegramNetworkError,
+    TelegramRetryAfter,
+    TelegramServerError,
+)
+
+from utils.rate_limit import RateLimiter
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class BroadcastStats:
+    """Підсумок розсилки по отримувачах"""
+    total: int = 0
+    sent: int = 0
+    failed: int = 0
+    blocked: int = 0
+    retries: int = 0
+    elapsed: float = 0.0
+    errors: Dict[int, str] = field(default_factory=dict)
+
+    def __str__(self):
+        return (f"{self.sent}/{self.total} доставлено, помилок: {self.failed}, "
+                f"заблокували бота: {self.blocked}, повторів: {self.retries}, {self.elapsed:.1f} с")
+
+
+class Broadcaster:
+    """
+    Паралельна розсилка повідомлень у межах лімітів Bot API:
+    ~30 повідомлень/с на бота і ~1 повідомлення/с в один чат.
+    Враховує TelegramRetryAfter і повторює тимчасові помилки.
+    """
+
+    def __init__(self, bot: Bot, global_rate: float = 25, per_chat_interval: float = 1.0,
+                 concurrency: int = 10, max_retries: int = 3):
+        self.bot = bot
+        self.per_chat_interval = per_chat_interval
+        self.max_retries = max_retries
+        self._limiter = RateLimiter(global_rate, burst=int(global_rate))
+        self._slots = asyncio.Semaphore(concurrency)
+        self._chat_next: Dict[int, float] = {}
+        self._resume_at = 0.0
+
+    async def broadcast(self, chat_ids: Iterable[int], text: str, **kwargs) -> BroadcastStats:
+        """Надіслати text усім chat_ids. kwargs передаються в bot.send_message"""
+        chat_ids = list(dict.fromkeys(chat_ids))
+        stats = BroadcastStats(total=len(chat_ids))
+        start = time.monotonic()
+        await asyncio.gather(*(self._deliver(chat_id, text, kwargs, stats) for chat_id in chat_ids))
+        stats.elapsed = time.monotonic() - start
+        if stats.total:
+            logger.info(f"📣 Розсилка: {stats}")
+        return stats
+
+    async def _wait_turn(self, chat_id: int):
+        # Глобальна пауза після flood wait
+        pause = self._resume_at - time.monotonic()
+        if pause > 0:
+            await asyncio.sleep(pause)
+        # Резервуємо слот для чату до першого await, щоб паралельні розсилки не зіткнулись
+        now = time.monotonic()
+        slot = max(now, self._chat_next.get(chat_id, 0.0))
+        self._chat_next[chat_id] = slot + self.per_chat_interval
+        if len(self._chat_next) > 10_000:
+            self._chat_next = {k: v for k, v in self._chat_next.items() if v > now}
+        if slot > now:
+            await asyncio.sleep(slot - now)
+        await self._limiter.acquire()
+
+    async def _deliver(self, chat_id: int, text: str, kwargs: dict, stats: BroadcastStats):
+        async with self._slots:
+            attempt = 0
+            while True:
+                await self._wait_turn(chat_id)
+                backoff = True
+                try:
+                    await self.bot.send_message(chat_id, text, **kwargs)
+                    stats.sent += 1
+                    return
+                except TelegramRetryAfter as e:
+                    self._resume_at = max(self._resume_at, time.monotonic() + e.retry_after)
+                    error = f"flood wait {e.retry_after} с"
+                    backoff = False
+                except (TelegramNetworkError, TelegramServerError) as e:
+                    error = str(e)
+                except TelegramForbiddenError as e:
+                    stats.blocked += 1
+                    stats.errors[chat_id] = str(e)
+                    return
+                except TelegramBadRequest as e:
+                    stats.failed += 1
+                    stats.errors[chat_id] = str(e)
+                    logger.warning(f"Розсилка: чат {chat_id} відхилив повідомлення: {e}")
+                    return
+                except TelegramAPIError as e:
+                    # NotFound, Unauthorized, Conflict тощо — повтор не допоможе, але й решту розсилки не зриваємо
+                    stats.failed += 1
+                    stats.errors[chat_id] = str(e)
+                    logger.warning(f"Розсилка: чат {chat_id} — помилка Telegram API: {e}")
+                    return
+
+                attempt += 1
+                if attempt > self.max_retries:
+                    stats.failed += 1
+                    stats.errors[chat_id] = error
+                    logger.warning(f"Розсилка: чат {chat_id} не отримав повідомлення: {error}")
+                    return
+                stats.retries += 1
+                if backoff:
+                    await asyncio.sleep(min(30.0, 2 ** attempt) * random.uniform(0.5, 1.0))
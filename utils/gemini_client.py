@@ -0,0 +1,311 @@
+import asyncio
+import base64
+import json
+import logging
+import random
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import aiohttp
+
+from config import (
+    GEMINI_API_KEY, GEMINI_MODEL, GEMINI_MAX_CONCURRENCY, GEMINI_MAX_RETRIES,
+    GEMINI_DEADLINE, GEMINI_BREAKER_THRESHOLD, GEMINI_BREAKER_RESET,
+)
+from utils.http_client import HttpClient, http_client, GEMINI_HOST
+from utils.image_processing import INLINE_DATA_PLACEHOLDER, build_inline_body
+from utils.ai_metrics import AICall, ai_metrics
+from utils.json_stream import loads
+from utils.result_cache import content_key
+from utils.single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+
+class GeminiError(Exception):
+    def __init__(self, message: str, status: Optional[int] = None):
+        super().__init__(message)
+        self.status = status
+
+
+class CircuitOpenError(GeminiError):
+    """API деградувало — запит відхилено одразу, без очікування"""
+
+
+class CircuitBreaker:
+    """
+    Після threshold збоїв поспіль розмикається на reset_timeout секунд:
+    усі виклики одразу отримують CircuitOpenError. Потім пропускає один
+    пробний запит (half-open) і за його результатом замикається або знову розмикається.
+    """
+
+    def __init__(self, threshold: int = GEMINI_BREAKER_THRESHOLD, reset_timeout: float = GEMINI_BREAKER_RESET):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probe: Optional[object] = None  # маркер пробного запиту, що зараз виконується
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def before_call(self) -> Optional[object]:
+        """Пропустити виклик або кинути CircuitOpenError. Для пробного запиту повертає його маркер"""
+        state = self.state
+        if state == "open" or (state == "half_open" and self._probe is not None):
+            retry_in = max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+            raise CircuitOpenError(f"Gemini тимчасово недоступний, повтор через {retry_in:.0f} с", status=503)
+        if state == "half_open":
+            self._probe = object()
+            return self._probe
+        return None
+
+    def release_probe(self, probe: Optional[object]):
+        """Пробний запит завершився без результату (скасування тощо) — наступний виклик знову стане пробою"""
+        if probe is not None and self._probe is probe:
+            self._probe = None
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._probe = None
+
+    def record_failure(self):
+        self.failures += 1
+        self._probe = None
+        if self.opened_at is not None or self.failures >= self.threshold:
+            if self.opened_at is None:
+                logger.error(f"⛔ Gemini: {self.failures} збоїв поспіль — запити призупинено на {self.reset_timeout:.0f} с")
+            self.opened_at = time.monotonic()
+
+
+class GeminiClient:
+    """
+    Єдина точка виклику Gemini: обмеження одночасних запитів,
+    експоненційні повтори з jitter на 429/5xx, дедлайн на весь виклик
+    і circuit breaker. Модель — config.GEMINI_MODEL.
+    """
+
+    def __init__(self, api_key: Optional[str] = GEMINI_API_KEY, model: str = GEMINI_MODEL,
+                 max_concurrency: int = GEMINI_MAX_CONCURRENCY, max_retries: int = GEMINI_MAX_RETRIES,
+                 deadline: float = GEMINI_DEADLINE, http: HttpClient = http_client,
+                 breaker: Optional[CircuitBreaker] = None):
+        self.api_key = api_key
+        self.model = model
+        self.max_retries = max_retries
+        self.deadline = deadline
+        self.http = http
+        self.breaker = breaker or CircuitBreaker()
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self.flights = SingleFlight()
+
+    def url(self, method: str = "generateContent", model: Optional[str] = None) -> str:
+        return f"{GEMINI_HOST}/v1beta/models/{model or self.model}:{method}?key={self.api_key}"
+
+    @staticmethod
+    def text_payload(prompt: str, inline_mime: Optional[str] = None,
+                     generation_config: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Запит з промптом і (опційно) вкладенням, дані якого підставить blob"""
+        parts: List[Dict[str, Any]] = [{"text": prompt}]
+        if inline_mime:
+            parts.append({"inline_data": {"mime_type": inline_mime, "data": INLINE_DATA_PLACEHOLDER}})
+        payload: Dict[str, Any] = {"contents": [{"parts": parts}]}
+        if generation_config:
+            payload["generationConfig"] = generation_config
+        return payload
+
+    @staticmethod
+    def extract_text(data: Dict[str, Any]) -> str:
+        try:
+            return "".join(part.get("text", "") for part in data["candidates"][0]["content"]["parts"])
+        except (KeyError, IndexError, TypeError):
+            reason = (data.get("promptFeedback") or {}).get("blockReason") if isinstance(data, dict) else None
+            raise GeminiError(f"Порожня відповідь Gemini{f' ({reason})' if reason else ''}")
+
+    @staticmethod
+    def _backoff(attempt: int, retry_after: Optional[str]) -> float:
+        if retry_after:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+        # Full jitter: випадкова пауза в межах 0..min(16, 2^attempt) с
+        return random.uniform(0, min(16.0, 2.0 ** attempt))
+
+    @asynccontextmanager
+    async def _response(self, method: str, payload: Dict[str, Any], *, blob=None, deadline: Optional[float] = None,
+                        endpoint: str = "gemini", model: Optional[str] = None, query: str = "",
+                        call: Optional[AICall] = None):
+        """
+        Відповідь 200 від Gemini з повторами, дедлайном і circuit breaker.
+        Слот семафора і дедлайн діють, поки читається тіло відповіді.
+        """
+        if not self.api_key:
+            raise GeminiError("GEMINI_API_KEY не налаштовано")
+        probe = self.breaker.before_call()
+        try:
+            loop = asyncio.get_running_loop()
+            stop_at = loop.time() + (deadline or self.deadline)
+            if blob is not None:
+                body = build_inline_body(payload, blob)
+                request_kwargs = {"data": body, "headers": {"Content-Type": "application/json"}}
+            else:
+                request_kwargs = {"json": payload}
+
+            attempt = 0
+            delivered = False
+            while True:
+                remaining = stop_at - loop.time()
+                if remaining <= 0:
+                    self.breaker.record_failure()
+                    raise GeminiError("Gemini не відповів вчасно", status=504)
+                retry_after = None
+                try:
+                    queued_at = time.perf_counter()
+                    async with self._slots:
+                        if call is not None:
+                            call.queue += time.perf_counter() - queued_at
+                            call.attempts += 1
+                        remaining = stop_at - loop.time()
+                        timeout = aiohttp.ClientTimeout(total=min(remaining, self.http.timeout_for(endpoint).total))
+                        async with self.http.post(self.url(method, model) + query, endpoint=endpoint, timeout=timeout,
+                                                  **request_kwargs) as resp:
+                            if resp.status == 200:
+                                self.breaker.record_success()
+                                delivered = True
+                                yield resp
+                                return
+                            error_text = await resp.text()
+                            retry_after = resp.headers.get("Retry-After")
+                            error = GeminiError(f"Gemini API error {resp.status}: {error_text[:200]}", status=resp.status)
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    if delivered:
+                        # Обрив під час читання — частину відповіді вже віддано, повтор не робимо
+                        raise GeminiError(f"Відповідь Gemini обірвалась: {e or type(e).__name__}") from e
+                    error = GeminiError(f"Помилка з'єднання з Gemini: {e or type(e).__name__}", status=None)
+
+                if error.status is not None and error.status not in RETRYABLE_STATUSES:
+                    # 400/403 тощо — помилка запиту чи ключа, повтор не допоможе
+                    self.breaker.record_success()  # API відповідає, просто відхилило запит
+                    if error.status == 403:
+                        logger.error("❌ API ключ заблоковано! Отримайте новий ключ в Google AI Studio")
+                    raise error
+
+                self.breaker.record_failure()
+                attempt += 1
+                delay = self._backoff(attempt, retry_after)
+                if attempt > self.max_retries or loop.time() + delay >= stop_at or self.breaker.state == "open":
+                    logger.error(str(error))
+                    raise error
+                logger.warning(f"{error}. Повтор {attempt}/{self.max_retries} через {delay:.1f} с")
+                await asyncio.sleep(delay)
+        finally:
+            # CancelledError (BaseException) не проходить через record_*: звільняємо пробу тут
+            self.breaker.release_probe(probe)
+
+    def request_key(self, method: str, payload: Dict[str, Any], blob=None, model: Optional[str] = None) -> str:
+        """Хеш моделі, запиту (промпт, налаштування) і вкладення — ключ для single-flight"""
+        return content_key(method, model or self.model, json.dumps(payload, sort_keys=True), blob or b"")
+
+    @staticmethod
+    def outcome(error: GeminiError) -> str:
+        """Результат виклику для метрик"""
+        if isinstance(error, CircuitOpenError):
+            return "circuit_open"
+        return f"http_{error.status}" if error.status else "network_error"
+
+    async def generate_content(self, payload: Dict[str, Any], *, blob=None, feature: str = "other",
+                               **kwargs) -> Dict[str, Any]:
+        """
+        Сирий виклик generateContent. blob (bytes) підставляється як base64
+        на місце INLINE_DATA_PLACEHOLDER у payload.
+        Однакові одночасні запити виконуються один раз і отримують спільну відповідь.
+        feature — хто викликає (для метрик ai_metrics).
+        """
+        async def call():
+            record = ai_metrics.start(feature, kwargs.get("model") or self.model)
+            outcome = "cancelled"
+            try:
+                async with self._response("generateContent", payload, blob=blob, call=record, **kwargs) as resp:
+                    raw = await resp.read()
+                parse_started = time.perf_counter()
+                try:
+                    data = loads(raw)
+                except ValueError:
+                    raise GeminiError("Некоректна JSON-відповідь Gemini")
+                record.add_usage(data.get("usageMetadata"))
+                record.parse += time.perf_counter() - parse_started
+                outcome = "ok"
+                return data
+            except GeminiError as e:
+                outcome = self.outcome(e)
+                raise
+            except Exception:
+                outcome = "error"
+                raise
+            finally:
+                record.finish(outcome)
+
+        key = self.request_key("generateContent", payload, blob, kwargs.get("model"))
+        return await self.flights.do(key, call)
+
+    async def stream_text(self, payload: Dict[str, Any], *, blob=None, feature: str = "other",
+                          **kwargs) -> AsyncIterator[str]:
+        """
+        streamGenerateContent (SSE): шматки тексту в міру генерації.
+        Повтори можливі лише до першого отриманого байта.
+        Час обробки шматків споживачем зараховується до фази розбору.
+        """
+        record = ai_metrics.start(feature, kwargs.get("model") or self.model)
+        outcome = "cancelled"
+        try:
+            async with self._response("streamGenerateContent", payload, blob=blob, query="&alt=sse",
+                                      call=record, **kwargs) as resp:
+                async for line in resp.content:
+                    if not line.startswith(b"data:"):
+                        continue
+                    parse_started = time.perf_counter()
+                    try:
+                        event = loads(line[5:])
+                    except ValueError:
+                        continue
+                    record.add_usage(event.get("usageMetadata"))
+                    text = "".join(
+                        part.get("text", "")
+                        for candidate in event.get("candidates", [])[:1]
+                        for part in (candidate.get("content") or {}).get("parts", [])
+                    )
+                    record.parse += time.perf_counter() - parse_started
+                    if text:
+                        paused_at = time.perf_counter()
+                        yield text
+                        record.parse += time.perf_counter() - paused_at
+            outcome = "ok"
+        except GeminiError as e:
+            outcome = self.outcome(e)
+            raise
+        except Exception:
+            outcome = "error"
+            raise
+        finally:
+            record.finish(outcome)
+
+    async def generate(self, prompt: str, *, blob=None, mime_type: Optional[str] = None,
+                       generation_config: Optional[Dict[str, Any]] = None, **kwargs) -> str:
+        payload = self.text_payload(prompt, mime_type if blob is not None else None, generation_config)
+        data = await self.generate_content(payload, blob=blob, **kwargs)
+        return self.extract_text(data)
+
+    async def generate_with_image(self, prompt: str, image_base64: str, mime_type: str = "image/jpeg", **kwargs) -> str:
+        return await self.generate(prompt, blob=base64.b64decode(image_base64), mime_type=mime_type, **kwargs)
+
+
+gemini = GeminiClient()
@@ -0,0 +1,77 @@
+import asyncio
+import logging
+from typing import Dict, Iterable, Optional
+
+import aiohttp
+
+from config import PROXY_URL, HTTP_LIMIT_PER_HOST, HTTP_TIMEOUTS
+
+logger = logging.getLogger(__name__)
+
+GEMINI_HOST = "https://generativelanguage.googleapis.com"
+SMS_FLY_HOST = "https://sms-fly.ua"
+
+
+class HttpClient:
+    """
+    Один довгоживучий aiohttp.ClientSession на весь бот:
+    пул з'єднань на кожен хост, keep-alive, кеш DNS,
+    централізований проксі та таймаути для кожного типу запитів.
+    """
+
+    def __init__(self, proxy: Optional[str] = PROXY_URL, timeouts: Optional[Dict[str, float]] = None,
+                 limit_per_host: int = HTTP_LIMIT_PER_HOST):
+        self.proxy = proxy or None
+        self.timeouts = dict(timeouts or HTTP_TIMEOUTS)
+        self.limit_per_host = limit_per_host
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit_per_host * 4,
+                limit_per_host=self.limit_per_host,
+                ttl_dns_cache=300,
+                keepalive_timeout=60,
+                enable_cleanup_closed=True,
+            )
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    async def start(self, warmup_hosts: Iterable[str] = (GEMINI_HOST, SMS_FLY_HOST)):
+        """Створити сесію і заздалегідь відкрити з'єднання до основних хостів"""
+        self.session  # створює сесію та пул з'єднань
+        await asyncio.gather(*(self._warmup(host) for host in warmup_hosts))
+
+    async def _warmup(self, host: str):
+        try:
+            async with self.request("HEAD", host, endpoint="gemini_quick", allow_redirects=False):
+                pass
+            logger.info(f"🔥 З'єднання з {host} прогріто")
+        except Exception as e:
+            logger.warning(f"Не вдалося прогріти з'єднання з {host}: {e}")
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    def timeout_for(self, endpoint: str) -> aiohttp.ClientTimeout:
+        return aiohttp.ClientTimeout(total=self.timeouts.get(endpoint, self.timeouts["default"]))
+
+    def request(self, method: str, url: str, *, endpoint: str = "default", **kwargs):
+        """Використання: async with http_client.request("POST", url, endpoint="sms", json=...) as resp"""
+        kwargs.setdefault("timeout", self.timeout_for(endpoint))
+        if self.proxy:
+            kwargs.setdefault("proxy", self.proxy)
+        return self.session.request(method, url, **kwargs)
+
+    def get(self, url: str, *, endpoint: str = "default", **kwargs):
+        return self.request("GET", url, endpoint=endpoint, **kwargs)
+
+    def post(self, url: str, *, endpoint: str = "default", **kwargs):
+        return self.request("POST", url, endpoint=endpoint, **kwargs)
+
+
+http_client = HttpClient()
@@ -0,0 +1,306 @@
+import asyncio
+import binascii
+import io
+import json
+import logging
+import math
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+from PIL import Image, ImageEnhance, ImageOps
+
+from config import (
+    IMAGE_EXECUTOR, IMAGE_WORKERS, IMAGE_BACKLOG, TABLE_MAX_STRIPS, TABLE_SPLIT_ASPECT, TABLE_STRIP_WIDTH,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class ImageQueueFull(Exception):
+    """Черга обробки фото переповнена"""
+
+    def __init__(self):
+        super().__init__("забагато фото в обробці, спробуйте за хвилину")
+
+
+class BufferReader(io.RawIOBase):
+    """Файловий інтерфейс поверх memoryview без копіювання всього буфера"""
+
+    def __init__(self, data):
+        self._view = memoryview(data).cast("B")
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, b):
+        n = min(len(b), len(self._view) - self._pos)
+        b[:n] = self._view[self._pos:self._pos + n]
+        self._pos += n
+        return n
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += len(self._view)
+        self._pos = max(0, offset)
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+
+def as_stream(data):
+    """bytes / memoryview / BytesIO -> потік для Image.open без зайвих копій"""
+    if hasattr(data, "read"):
+        data.seek(0)
+        return data
+    if isinstance(data, bytes):
+        return io.BytesIO(data)  # BytesIO ділить буфер з bytes, поки його не змінюють
+    return BufferReader(data)
+
+
+def byte_size(data) -> int:
+    if isinstance(data, io.BytesIO):
+        return data.getbuffer().nbytes
+    return memoryview(data).nbytes
+
+
+def compress_image_sync(image_data, max_size: int = 800, quality: int = 60) -> bytes:
+    """Зменшення, підвищення контрасту та JPEG-стиснення. Виконується у воркері"""
+    img = Image.open(as_stream(image_data))
+
+    if img.format == "JPEG" and max(img.size) > max_size:
+        # JPEG draft: декодер одразу масштабує в 1/2, 1/4 або 1/8,
+        # не розпаковуючи всі 12 Мп (результат не менший за цільовий розмір)
+        scale = max_size / max(img.size)
+        img.draft("RGB", (math.ceil(img.width * scale), math.ceil(img.height * scale)))
+
+    if img.mode not in ('RGB', 'L'):
+        img = img.convert('RGB')
+
+    ratio = max_size / max(img.width, img.height)
+    if ratio < 1:
+        new_size = (int(img.width * ratio), int(img.height * ratio))
+        img = img.resize(new_size, Image.Resampling.LANCZOS)
+
+    return _encode_jpeg(img, quality)
+
+
+def _encode_jpeg(img, quality: int) -> bytes:
+    enhancer = ImageEnhance.Contrast(img)
+    img = enhancer.enhance(1.3)
+
+    buffer = io.BytesIO()
+    img.save(buffer, format='JPEG', quality=quality, optimize=True)
+    return buffer.getvalue()
+
+
+# Шапку таблиці шукаємо лише у верхній частині фото (частка висоти)
+TABLE_HEADER_MAX = 0.3
+# Рядок профілю з такою часткою "чорнила" — горизонтальна лінія сітки, з такою малою — проміжок
+RULE_INK = 0.5
+GAP_INK = 0.02
+# Перекриття сусідніх смуг — частка висоти смуги
+TABLE_STRIP_OVERLAP = 0.08
+
+
+def _row_profile(img) -> List[float]:
+    """Горизонтальна проекція: частка темних пікселів у кожному рядку зображення"""
+    gray = ImageOps.autocontrast(img.convert("L"), cutoff=2)
+    ink = gray.point(lambda v: 255 if v < 100 else 0)
+    column = ink.resize((1, ink.height), Image.Resampling.BOX)
+    return [v / 255 for v in column.getdata()]
+
+
+def _snap_cut(profile: List[float], target: int, window: int) -> int:
+    """
+    Найкраща межа поблизу target: порожній проміжок між рядками або лінія сітки
+    (рядок майже без "чорнила" чи майже суцільний), тобто не посеред тексту.
+    """
+    lo, hi = max(1, target - window), min(len(profile) - 1, target + window)
+    if lo >= hi:
+        return target
+    return min(range(lo, hi), key=lambda y: min(profile[y], 1 - profile[y]) + abs(y - target) / (window * 50))
+
+
+def _find_header(profile: List[float], limit: int) -> int:
+    """
+    Низ шапки таблиці за профілем рядків: друга лінія сітки (перша — верхня рамка)
+    або перша лінія під текстом; без сітки — кінець першого блоку тексту.
+    0 — якщо у верхніх limit рядках шапку не знайдено.
+    """
+    rules = []  # [початок, кінець] кожної лінії
+    for y in range(min(limit, len(profile))):
+        if profile[y] >= RULE_INK:
+            if rules and rules[-1][1] == y - 1:
+                rules[-1][1] = y
+            else:
+                rules.append([y, y])
+    text_above = lambda y: any(GAP_INK < v < RULE_INK for v in profile[:y])
+    if len(rules) >= 2:
+        return rules[1][1] + 1
+    if rules and text_above(rules[0][0]):
+        return rules[0][1] + 1
+
+    seen_text = False
+    for y in range(min(limit, len(profile))):
+        if profile[y] > GAP_INK:
+            seen_text = True
+        elif seen_text:
+            return y
+    return 0
+
+
+def table_strips_sync(image_data, max_strips: int, split_aspect: float, width: int,
+                      max_size: int = 800, quality: int = 60) -> List[bytes]:
+    """
+    Розрізати дуже високе фото таблиці (висота / ширина > split_aspect) на смуги
+    з перекриттям по межах рядків. Кожна смуга отримує копію шапки, знайденої
+    за профілем рядків, і ширину width. Звичайне фото — одне стиснене зображення.
+    """
+    img = Image.open(as_stream(image_data))
+    count = 1
+    if max_strips > 1 and img.height > img.width * split_aspect:
+        count = min(max_strips, math.ceil(img.height / (img.width * split_aspect)))
+    if count <= 1:
+        return [compress_image_sync(image_data, max_size, quality)]
+
+    if img.format == "JPEG" and img.width > width:
+        img.draft("RGB", (width, math.ceil(img.height * width / img.width)))
+    if img.mode not in ('RGB', 'L'):
+        img = img.convert('RGB')
+    if img.width > width:
+        img = img.resize((width, round(img.height * width / img.width)), Image.Resampling.LANCZOS)
+
+    w, h = img.size
+    profile = _row_profile(img)
+    window = max(1, round(h * 0.03))
+    header = _find_header(profile, round(h * TABLE_HEADER_MAX))
+    band = (h - header) / count
+    cuts = [header] + [_snap_cut(profile, round(header + band * i), window) for i in range(1, count)] + [h]
+    overlap = round(band * TABLE_STRIP_OVERLAP)
+
+    header_img = img.crop((0, 0, w, header)) if header else None
+    strips = []
+    for top, bottom in zip(cuts, cuts[1:]):
+        top, bottom = max(header, top - overlap), min(h, bottom + overlap)
+        tile = Image.new(img.mode, (w, header + bottom - top), "white")
+        if header_img is not None:
+            tile.paste(header_img, (0, 0))
+        tile.paste(img.crop((0, top, w, bottom)), (0, header))
+        strips.append(_encode_jpeg(tile, quality))
+    return strips
+
+
+INLINE_DATA_PLACEHOLDER = "__INLINE_DATA__"
+
+
+def build_inline_body(payload: dict, blob) -> bytes:
+    """
+    JSON-тіло запиту, де INLINE_DATA_PLACEHOLDER замінено на base64 від blob.
+    base64 пишеться одразу в байти тіла — без проміжних str і json.dumps великого рядка.
+    """
+    head, tail = json.dumps(payload, ensure_ascii=False).encode("utf-8").split(
+        INLINE_DATA_PLACEHOLDER.encode(), 1
+    )
+    return b"".join((head, binascii.b2a_base64(blob, newline=False), tail))
+
+
+def _timed_call(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+class ImageProcessor:
+    """
+    Пул воркерів для обробки фото з обмеженою чергою.
+    Якщо зайняті всі воркери і черга (backlog) — новий запит відхиляється
+    з ImageQueueFull, а не накопичується в пам'яті.
+    """
+
+    def __init__(self, workers: int = IMAGE_WORKERS, backlog: int = IMAGE_BACKLOG, executor: str = IMAGE_EXECUTOR):
+        self.workers = workers
+        self.backlog = backlog
+        self.executor_kind = executor
+        self._executor: Optional[Executor] = None
+        self._admitted = 0
+        self._processed = 0
+        self._rejected = 0
+        self._failed = 0
+        self._work_total = 0.0
+        self._work_max = 0.0
+        self._wait_total = 0.0
+
+    @property
+    def executor(self) -> Executor:
+        if self._executor is None:
+            if self.executor_kind == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="image")
+        return self._executor
+
+    async def _submit(self, func, *args):
+        if self._admitted >= self.workers + self.backlog:
+            self._rejected += 1
+            raise ImageQueueFull()
+        self._admitted += 1
+        queued_at = time.perf_counter()
+        try:
+            result, work = await asyncio.get_running_loop().run_in_executor(self.executor, _timed_call, func, *args)
+        except Exception:
+            self._failed += 1
+            raise
+        finally:
+            self._admitted -= 1
+        self._processed += 1
+        self._wait_total += max(0.0, time.perf_counter() - queued_at - work)
+        self._work_total += work
+        self._work_max = max(self._work_max, work)
+        return result
+
+    async def compress(self, image_data, max_size: int = 800, quality: int = 60) -> bytes:
+        """image_data: bytes, memoryview або BytesIO (напр. результат bot.download_file)"""
+        compressed = await self._submit(compress_image_sync, image_data, max_size, quality)
+        original_size = byte_size(image_data) / 1024
+        compressed_size = len(compressed) / 1024
+        logger.info(f"Стиснення: {original_size:.1f}KB -> {compressed_size:.1f}KB (економія {original_size - compressed_size:.1f}KB)")
+        return compressed
+
+    async def table_strips(self, image_data, max_strips: int = TABLE_MAX_STRIPS, split_aspect: float = TABLE_SPLIT_ASPECT,
+                           width: int = TABLE_STRIP_WIDTH) -> List[bytes]:
+        """Фото таблиці -> список JPEG-смуг (одна, якщо фото невисоке або різання вимкнено)"""
+        strips = await self._submit(table_strips_sync, image_data, max_strips, split_aspect, width)
+        logger.info(f"Таблиця: {byte_size(image_data) / 1024:.1f}KB -> {len(strips)} смуг, "
+                    f"{sum(map(len, strips)) / 1024:.1f}KB")
+        return strips
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "executor": self.executor_kind,
+            "workers": self.workers,
+            "backlog_limit": self.backlog,
+            "in_flight": self._admitted,
+            "queue_depth": max(0, self._admitted - self.workers),
+            "processed": self._processed,
+            "rejected": self._rejected,
+            "failed": self._failed,
+            "wait_avg_ms": round(self._wait_total / self._processed * 1000, 1) if self._processed else 0.0,
+            "work_avg_ms": round(self._work_total / self._processed * 1000, 1) if self._processed else 0.0,
+            "work_max_ms": round(self._work_max * 1000, 1),
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+image_processor = ImageProcessor()
@@ -0,0 +1,92 @@
+import json
+import logging
+from typing import Any, List
+
+try:
+    import orjson
+except ImportError:  # orjson необов'язковий — без нього працює стандартний json
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+
+def loads(data):
+    """Швидкий розбір JSON (orjson, якщо встановлено). Помилки — ValueError"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class JsonArrayStream:
+    """
+    Інкрементальний розбір JSON-масиву об'єктів, що надходить шматками.
+    feed() повертає об'єкти верхнього рівня, щойно кожен з них закрився.
+    Текст до першої "[" (напр. ```json) пропускається, тож обірвана
+    відповідь дає всі повні рядки замість помилки розбору.
+    """
+
+    def __init__(self):
+        self._buffer = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._started = False
+        self._item_start = -1
+        self.finished = False
+        self.items: List[Any] = []
+
+    def feed(self, chunk: str) -> List[Any]:
+        if self.finished:
+            return []
+        self._buffer += chunk
+        ready = []
+        buf = self._buffer
+        i = self._pos
+        while i < len(buf):
+            ch = buf[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif not self._started:
+                if ch == "[":
+                    self._started = True
+                    self._depth = 1
+            elif ch == '"':
+                self._in_string = True
+            elif ch in "{[":
+                if self._depth == 1:
+                    self._item_start = i
+                self._depth += 1
+            elif ch in "}]":
+                self._depth -= 1
+                if self._depth == 1 and self._item_start >= 0:
+                    item = self._decode(buf[self._item_start:i + 1])
+                    if item is not None:
+                        ready.append(item)
+                    self._item_start = -1
+                elif self._depth == 0:
+                    self.finished = True
+                    break
+            i += 1
+
+        # Обрізаємо вже розібране, лишаючи лише незакритий елемент
+        keep_from = self._item_start if self._item_start >= 0 else i
+        self._buffer = buf[keep_from:]
+        self._pos = i - keep_from
+        if self._item_start >= 0:
+            self._item_start = 0
+        self.items.extend(ready)
+        return ready
+
+    @staticmethod
+    def _decode(fragment: str):
+        try:
+            return loads(fragment)
+        except ValueError as e:
+            logger.warning(f"Пропущено некоректний елемент JSON: {e}")
+            return None
@@ -0,0 +1,39 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, List
+
+from aiogram import BaseMiddleware
+from aiogram.types import Message, TelegramObject
+
+
+class MediaGroupMiddleware(BaseMiddleware):
+    """
+    Збирає повідомлення одного альбому (media_group_id) і викликає обробник
+    один раз — на першому повідомленні, з усіма частинами в data["album"].
+    Решта повідомлень альбому поглинаються. Потребує паралельної обробки
+    апдейтів (handle_as_tasks при polling, фонова обробка при webhook).
+    """
+
+    def __init__(self, latency: float = 0.8):
+        self.latency = latency
+        self._albums: Dict[str, List[Message]] = {}
+
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject, data: Dict[str, Any]) -> Any:
+        if not isinstance(event, Message) or not event.media_group_id:
+            return await handler(event, data)
+
+        album = self._albums.get(event.media_group_id)
+        if album is not None:
+            album.append(event)
+            return None
+
+        self._albums[event.media_group_id] = album = [event]
+        # Telegram надсилає частини альбому окремими апдейтами майже одночасно
+        while True:
+            size = len(album)
+            await asyncio.sleep(self.latency)
+            if len(album) == size:
+                break
+        del self._albums[event.media_group_id]
+        data["album"] = sorted(album, key=lambda m: m.message_id)
+        return await handler(event, data)
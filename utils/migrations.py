@@ -0,0 +1,180 @@
+import logging
+from typing import List, Tuple
+
+from utils.repository import Repository, repo, NAME_KEY_SQL
+
+logger = logging.getLogger(__name__)
+
+# Ключ advisory lock, щоб два екземпляри бота не мігрували схему одночасно
+MIGRATION_LOCK_ID = 720_260_001
+
+# Упорядкований список міграцій: (версія, опис, SQL-інструкції).
+# Вже застосовані міграції НЕ змінюємо — лише додаємо нові в кінець.
+MIGRATIONS: List[Tuple[int, str, List[str]]] = [
+    (1, "Базова схема", [
+        "CREATE TABLE IF NOT EXISTS users (user_id BIGINT PRIMARY KEY, username TEXT, shift_type TEXT DEFAULT 'day')",
+        "CREATE TABLE IF NOT EXISTS employees (id SERIAL PRIMARY KEY, full_name TEXT, birth_date DATE)",
+        "CREATE TABLE IF NOT EXISTS tasks (id SERIAL PRIMARY KEY, title TEXT, is_done BOOLEAN DEFAULT FALSE)",
+        "CREATE TABLE IF NOT EXISTS routes (id SERIAL PRIMARY KEY, info TEXT)",
+        """CREATE TABLE IF NOT EXISTS employee_phones (
+               id SERIAL PRIMARY KEY,
+               full_name TEXT NOT NULL,
+               phone TEXT NOT NULL,
+               created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+               updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+           )""",
+        "CREATE INDEX IF NOT EXISTS idx_employee_phones_name ON employee_phones(full_name)",
+        "ALTER TABLE tasks ADD COLUMN IF NOT EXISTS remind_at TIMESTAMP",
+        "CREATE TABLE IF NOT EXISTS astro_users (user_id BIGINT PRIMARY KEY, info TEXT)",
+    ]),
+    (2, "Завдання та іменинники з прив'язкою до користувача", [
+        "ALTER TABLE tasks ADD COLUMN IF NOT EXISTS user_id BIGINT",
+        "CREATE INDEX IF NOT EXISTS idx_tasks_user ON tasks(user_id)",
+        "ALTER TABLE employees ADD COLUMN IF NOT EXISTS added_by BIGINT",
+    ]),
+    (3, "Перенесення даних зі старих таблиць birthdays/shift_tasks", [
+        """DO $$
+           BEGIN
+               IF to_regclass('birthdays') IS NOT NULL THEN
+                   -- Невалідні дати ('31.02', '1.13', довільний текст) переносимо як NULL,
+                   -- а не зриваємо всю транзакцію міграцій помилкою приведення типу
+                   INSERT INTO employees (full_name, birth_date, added_by)
+                   SELECT full_name,
+                          CASE WHEN m BETWEEN 1 AND 12 THEN
+                              CASE WHEN d BETWEEN 1 AND EXTRACT(DAY FROM make_date(2000, m, 1) + interval '1 month - 1 day')
+                                   THEN make_date(2000, m, d) END
+                          END,
+                          user_id
+                   FROM (
+                       SELECT full_name, user_id,
+                              CASE WHEN btrim(birth_date) ~ '^\\d{1,2}\\.\\d{1,2}$'
+                                   THEN split_part(btrim(birth_date), '.', 1)::int END AS d,
+                              CASE WHEN btrim(birth_date) ~ '^\\d{1,2}\\.\\d{1,2}$'
+                                   THEN split_part(btrim(birth_date), '.', 2)::int END AS m
+                       FROM birthdays
+                   ) b;
+               END IF;
+               IF to_regclass('shift_tasks') IS NOT NULL THEN
+                   INSERT INTO tasks (title, is_done, user_id)
+                   SELECT task_text, is_done <> 0, user_id FROM shift_tasks;
+               END IF;
+           END $$""",
+    ]),
+    (4, "Кеш результатів ШІ", [
+        """CREATE TABLE IF NOT EXISTS ai_cache (
+               namespace TEXT NOT NULL,
+               cache_key TEXT NOT NULL,
+               value JSONB NOT NULL,
+               expires_at TIMESTAMPTZ NOT NULL,
+               PRIMARY KEY (namespace, cache_key)
+           )""",
+        "CREATE INDEX IF NOT EXISTS idx_ai_cache_expires ON ai_cache(expires_at)",
+    ]),
+    (5, "Активність користувачів поради дня", [
+        "ALTER TABLE astro_users ADD COLUMN IF NOT EXISTS advice_requested_at TIMESTAMPTZ",
+    ]),
+    (6, "Черга SMS (outbox) і кампанії розсилок", [
+        """CREATE TABLE IF NOT EXISTS sms_campaigns (
+               id SERIAL PRIMARY KEY,
+               kind TEXT NOT NULL,
+               dedupe_key TEXT NOT NULL UNIQUE,
+               created_by BIGINT,
+               chat_id BIGINT,
+               message_id BIGINT,
+               created_at TIMESTAMPTZ DEFAULT now()
+           )""",
+        """CREATE TABLE IF NOT EXISTS sms_outbox (
+               id BIGSERIAL PRIMARY KEY,
+               campaign_id INTEGER REFERENCES sms_campaigns(id) ON DELETE CASCADE,
+               idempotency_key TEXT NOT NULL UNIQUE,
+               recipient TEXT NOT NULL,
+               phone TEXT,
+               body TEXT NOT NULL,
+               status TEXT NOT NULL DEFAULT 'pending',
+               attempts INTEGER NOT NULL DEFAULT 0,
+               next_attempt_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+               locked_until TIMESTAMPTZ,
+               provider_message_id TEXT,
+               last_error TEXT,
+               created_at TIMESTAMPTZ DEFAULT now(),
+               updated_at TIMESTAMPTZ DEFAULT now(),
+               sent_at TIMESTAMPTZ
+           )""",
+        "CREATE INDEX IF NOT EXISTS idx_sms_outbox_due ON sms_outbox(next_attempt_at) WHERE status IN ('pending', 'sending')",
+        "CREATE INDEX IF NOT EXISTS idx_sms_outbox_campaign ON sms_outbox(campaign_id, status)",
+    ]),
+    (7, "Заплановані кампанії SMS з темпом відправки", [
+        "ALTER TABLE sms_campaigns ADD COLUMN IF NOT EXISTS status TEXT NOT NULL DEFAULT 'active'",
+        "ALTER TABLE sms_campaigns ADD COLUMN IF NOT EXISTS scheduled_at TIMESTAMPTZ NOT NULL DEFAULT now()",
+        "ALTER TABLE sms_campaigns ADD COLUMN IF NOT EXISTS rate REAL",
+        "CREATE INDEX IF NOT EXISTS idx_sms_campaigns_status ON sms_campaigns(status) WHERE status <> 'cancelled'",
+    ]),
+    (8, "Статус доставки SMS", [
+        "ALTER TABLE sms_outbox ADD COLUMN IF NOT EXISTS delivery_status TEXT",
+        "ALTER TABLE sms_outbox ADD COLUMN IF NOT EXISTS provider_status TEXT",
+        "ALTER TABLE sms_outbox ADD COLUMN IF NOT EXISTS status_checks INTEGER NOT NULL DEFAULT 0",
+        "ALTER TABLE sms_outbox ADD COLUMN IF NOT EXISTS next_status_check_at TIMESTAMPTZ",
+        "ALTER TABLE sms_outbox ADD COLUMN IF NOT EXISTS delivered_at TIMESTAMPTZ",
+        """CREATE INDEX IF NOT EXISTS idx_sms_outbox_status_check ON sms_outbox(next_status_check_at)
+           WHERE status = 'sent' AND delivery_status IS NULL""",
+    ]),
+    (9, "Довідник телефонів: E.164, унікальний номер, прив'язка до працівника", [
+        f"""ALTER TABLE employee_phones ADD COLUMN IF NOT EXISTS name_key TEXT
+            GENERATED ALWAYS AS ({NAME_KEY_SQL.format(column="full_name")}) STORED""",
+        f"""ALTER TABLE employee_phones ADD COLUMN IF NOT EXISTS surname_key TEXT
+            GENERATED ALWAYS AS (split_part({NAME_KEY_SQL.format(column="full_name")}, ' ', 1)) STORED""",
+        "ALTER TABLE employee_phones ADD COLUMN IF NOT EXISTS employee_id INTEGER REFERENCES employees(id) ON DELETE SET NULL",
+        # Та сама нормалізація, що й utils.phones.normalize_phone
+        """UPDATE employee_phones p SET phone = CASE
+               WHEN n.d ~ '^380[0-9]{9}$' THEN '+' || n.d
+               WHEN n.d ~ '^80[0-9]{9}$' THEN '+3' || n.d
+               WHEN n.d ~ '^0[0-9]{9}$' THEN '+38' || n.d
+               WHEN n.d ~ '^[0-9]{9}$' THEN '+380' || n.d
+               ELSE p.phone END
+           FROM (SELECT id, regexp_replace(phone, '[^0-9]', '', 'g') AS d FROM employee_phones) n
+           WHERE p.id = n.id""",
+        # Один номер — один запис (лишаємо найстаріший)
+        "DELETE FROM employee_phones p USING employee_phones older WHERE p.phone = older.phone AND p.id > older.id",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_employee_phones_phone ON employee_phones(phone)",
+        # NOT VALID: старі записи, які не вдалося нормалізувати, не зривають міграцію; нові — перевіряються
+        "ALTER TABLE employee_phones ADD CONSTRAINT employee_phones_e164 CHECK (phone ~ '^[+]380[0-9]{9}$') NOT VALID",
+        "DROP INDEX IF EXISTS idx_employee_phones_name",
+        "CREATE INDEX IF NOT EXISTS idx_employee_phones_name_key ON employee_phones(name_key)",
+        "CREATE INDEX IF NOT EXISTS idx_employee_phones_surname_key ON employee_phones(surname_key)",
+        f"""UPDATE employee_phones p SET employee_id = (
+                SELECT min(e.id) FROM employees e WHERE {NAME_KEY_SQL.format(column="e.full_name")} = p.name_key
+            )""",
+    ]),
+]
+
+
+async def run_migrations(repository: Repository = repo):
+    """
+    Застосувати нові міграції один раз при старті.
+    Все виконується в одній транзакції під advisory lock, тож повторний
+    запуск (або паралельний екземпляр) просто бачить актуальну версію.
+    """
+    def op(cur):
+        cur.execute("SELECT pg_advisory_xact_lock(%s)", (MIGRATION_LOCK_ID,))
+        cur.execute("""CREATE TABLE IF NOT EXISTS schema_version (
+                           version INTEGER PRIMARY KEY,
+                           description TEXT,
+                           applied_at TIMESTAMPTZ DEFAULT now()
+                       )""")
+        cur.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+        current = cur.fetchone()[0]
+        applied = []
+        for version, description, statements in MIGRATIONS:
+            if version <= current:
+                continue
+            for statement in statements:
+                cur.execute(statement)
+            cur.execute("INSERT INTO schema_version (version, description) VALUES (%s, %s)", (version, description))
+            applied.append(version)
+        return current, applied
+
+    current, applied = await repository.run(op, retry=False)
+    if applied:
+        logger.info(f"✅ Схему БД оновлено з версії {current} до {applied[-1]}")
+    else:
+        logger.info(f"✅ Схема БД актуальна (версія {current})")
@@ -0,0 +1,21 @@
+import re
+from typing import Optional
+
+E164_UA = re.compile(r"^\+380\d{9}$")
+
+
+def normalize_phone(raw: str) -> Optional[str]:
+    """
+    Український номер у форматі E.164 (+380XXXXXXXXX) або None, якщо це не номер.
+    Приймає 0XXXXXXXXX, 80XXXXXXXXX, 380XXXXXXXXX, XXXXXXXXX з будь-якими пробілами, дужками й дефісами.
+    """
+    digits = "".join(ch for ch in raw or "" if ch.isdigit())
+    if len(digits) == 12 and digits.startswith("380"):
+        return "+" + digits
+    if len(digits) == 11 and digits.startswith("80"):
+        return "+3" + digits
+    if len(digits) == 10 and digits.startswith("0"):
+        return "+38" + digits
+    if len(digits) == 9:
+        return "+380" + digits
+    return None
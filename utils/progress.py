@@ -0,0 +1,41 @@
+import logging
+import time
+from typing import Optional
+
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiogram.types import Message
+
+logger = logging.getLogger(__name__)
+
+
+class ProgressMessage:
+    """
+    Редагування повідомлення-індикатора не частіше ніж раз на interval секунд:
+    проміжні оновлення зливаються, остаточний стан пише flush().
+    """
+
+    def __init__(self, message: Message, interval: float = 1.5):
+        self.message = message
+        self.interval = interval
+        self._last_edit = 0.0
+        self._shown: Optional[str] = None
+        self._pending: Optional[str] = None
+
+    async def update(self, text: str, **kwargs):
+        self._pending = text
+        if time.monotonic() - self._last_edit >= self.interval:
+            await self.flush(**kwargs)
+
+    async def flush(self, **kwargs):
+        text, self._pending = self._pending, None
+        if text is None or text == self._shown:
+            return
+        self._last_edit = time.monotonic()
+        try:
+            await self.message.edit_text(text, **kwargs)
+            self._shown = text
+        except TelegramRetryAfter as e:
+            # Ліміт редагувань — пропускаємо проміжний кадр, наступний буде пізніше
+            self._last_edit += e.retry_after
+        except TelegramBadRequest as e:
+            logger.debug(f"Не вдалося оновити прогрес: {e}")
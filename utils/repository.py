@@ -0,0 +1,346 @@
+import asyncio
+import logging
+import time
+from collections import defaultdict
+from datetime import date, datetime
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence
+
+import psycopg2
+from psycopg2.pool import ThreadedConnectionPool
+
+from config import DATABASE_URL, DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE
+from utils.phones import normalize_phone
+from utils.table_schema import name_key
+
+logger = logging.getLogger(__name__)
+
+# Ключ імені як у table_schema.name_key: нижній регістр, єдиний апостроф, крапки як пробіли
+NAME_KEY_SQL = r"btrim(regexp_replace(translate(lower({column}), '’ʼ.', $$'' $$), '\s+', ' ', 'g'))"
+
+
+class TaskRow(NamedTuple):
+    id: int
+    title: str
+    is_done: bool
+    remind_at: Optional[datetime]
+
+
+class RouteRow(NamedTuple):
+    id: int
+    info: str
+
+
+class EmployeeRow(NamedTuple):
+    id: int
+    full_name: str
+    birth_date: Optional[date]
+
+
+class UserRow(NamedTuple):
+    user_id: int
+    shift_type: str
+
+
+class PoolStats:
+    """Лічильники очікування пулу та часу виконання запитів"""
+
+    def __init__(self):
+        self.acquisitions = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.queries = 0
+        self.query_total = 0.0
+        self.query_max = 0.0
+        self.errors = 0
+        self.reconnects = 0
+
+    def record_wait(self, seconds: float):
+        self.acquisitions += 1
+        self.wait_total += seconds
+        self.wait_max = max(self.wait_max, seconds)
+
+    def record_query(self, seconds: float):
+        self.queries += 1
+        self.query_total += seconds
+        self.query_max = max(self.query_max, seconds)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "acquisitions": self.acquisitions,
+            "wait_avg_ms": round(self.wait_total / self.acquisitions * 1000, 2) if self.acquisitions else 0.0,
+            "wait_max_ms": round(self.wait_max * 1000, 2),
+            "queries": self.queries,
+            "query_avg_ms": round(self.query_total / self.queries * 1000, 2) if self.queries else 0.0,
+            "query_max_ms": round(self.query_max * 1000, 2),
+            "errors": self.errors,
+            "reconnects": self.reconnects,
+        }
+
+
+class Repository:
+    """
+    Асинхронний доступ до БД через обмежений "теплий" пул з'єднань.
+    psycopg2 блокуючий, тому кожен запит виконується в окремому потоці,
+    а кількість одночасних запитів обмежена розміром пулу.
+    """
+
+    def __init__(self, dsn: str, min_size: int = 1, max_size: int = 5):
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.stats = PoolStats()
+        self._pool: Optional[ThreadedConnectionPool] = None
+        self._slots = asyncio.Semaphore(max_size)
+        self._open_lock = asyncio.Lock()
+
+    async def open(self):
+        """Відкрити пул і заздалегідь встановити min_size з'єднань"""
+        async with self._open_lock:
+            if self._pool is not None:
+                return
+            self._pool = await asyncio.to_thread(
+                ThreadedConnectionPool, self.min_size, self.max_size, self.dsn,
+                keepalives=1, keepalives_idle=30, keepalives_interval=10, keepalives_count=3
+            )
+        logger.info(f"✅ Пул БД відкрито ({self.min_size}-{self.max_size} з'єднань)")
+
+    async def close(self):
+        if self._pool is None:
+            return
+        pool, self._pool = self._pool, None
+        await asyncio.to_thread(pool.closeall)
+        logger.info(f"Пул БД закрито. Статистика: {self.stats.as_dict()}")
+
+    # --- БАЗОВІ ОПЕРАЦІЇ ---
+
+    def _execute(self, fn: Callable, retry: bool):
+        attempts = 2 if retry else 1
+        for attempt in range(1, attempts + 1):
+            conn = self._pool.getconn()
+            broken = bool(conn.closed)
+            try:
+                if broken:
+                    raise psycopg2.InterfaceError("connection already closed")
+                start = time.perf_counter()
+                with conn.cursor() as cur:
+                    result = fn(cur)
+                conn.commit()
+                self.stats.record_query(time.perf_counter() - start)
+                return result
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                # Neon закриває неактивні з'єднання — відкидаємо зламане і пробуємо ще раз
+                broken = True
+                self.stats.reconnects += 1
+                if attempt == attempts:
+                    self.stats.errors += 1
+                    raise
+                logger.warning("З'єднання з БД втрачено, перепідключаюсь...")
+            except Exception:
+                self.stats.errors += 1
+                conn.rollback()
+                raise
+            finally:
+                self._pool.putconn(conn, close=broken)
+
+    async def run(self, fn: Callable, retry: bool = True):
+        """Виконати fn(cursor) в одній транзакції на з'єднанні з пулу"""
+        if self._pool is None:
+            await self.open()
+        wait_start = time.perf_counter()
+        async with self._slots:
+            self.stats.record_wait(time.perf_counter() - wait_start)
+            return await asyncio.to_thread(self._execute, fn, retry)
+
+    async def fetch(self, sql: str, params: Sequence = (), retry: bool = True) -> List[tuple]:
+        def op(cur):
+            cur.execute(sql, params)
+            return cur.fetchall()
+        return await self.run(op, retry=retry)
+
+    async def fetchrow(self, sql: str, params: Sequence = (), retry: bool = True) -> Optional[tuple]:
+        def op(cur):
+            cur.execute(sql, params)
+            return cur.fetchone()
+        return await self.run(op, retry=retry)
+
+    async def fetchval(self, sql: str, params: Sequence = (), retry: bool = True):
+        row = await self.fetchrow(sql, params, retry=retry)
+        return row[0] if row else None
+
+    async def execute(self, sql: str, params: Sequence = (), retry: bool = False) -> int:
+        def op(cur):
+            cur.execute(sql, params)
+            return cur.rowcount
+        return await self.run(op, retry=retry)
+
+    # --- КОРИСТУВАЧІ ---
+
+    async def upsert_user(self, user_id: int, username: Optional[str]):
+        await self.execute(
+            "INSERT INTO users (user_id, username) VALUES (%s, %s) ON CONFLICT (user_id) DO NOTHING",
+            (user_id, username), retry=True
+        )
+
+    async def set_shift(self, user_id: int, shift_type: str):
+        await self.execute("UPDATE users SET shift_type = %s WHERE user_id = %s", (shift_type, user_id), retry=True)
+
+    async def get_users(self) -> List[UserRow]:
+        rows = await self.fetch("SELECT user_id, shift_type FROM users")
+        return [UserRow(*r) for r in rows]
+
+    async def get_user_ids(self, shift_type: Optional[str] = None) -> List[int]:
+        if shift_type is None:
+            rows = await self.fetch("SELECT user_id FROM users")
+        else:
+            rows = await self.fetch("SELECT user_id FROM users WHERE shift_type = %s", (shift_type,))
+        return [r[0] for r in rows]
+
+    # --- ЗАВДАННЯ ---
+
+    async def get_tasks(self) -> List[TaskRow]:
+        rows = await self.fetch("SELECT id, title, is_done, remind_at FROM tasks ORDER BY id ASC")
+        return [TaskRow(*r) for r in rows]
+
+    async def add_task(self, title: str) -> int:
+        return await self.fetchval("INSERT INTO tasks (title) VALUES (%s) RETURNING id", (title,), retry=False)
+
+    async def toggle_task(self, task_id: int) -> int:
+        """Перемкнути статус завдання. Повертає кількість невиконаних завдань"""
+        def op(cur):
+            cur.execute("UPDATE tasks SET is_done = NOT is_done, remind_at = NULL WHERE id = %s", (task_id,))
+            cur.execute("SELECT count(*) FROM tasks WHERE is_done = FALSE")
+            return cur.fetchone()[0]
+        return await self.run(op, retry=False)
+
+    async def set_task_reminder(self, task_id: int, remind_at: Optional[datetime]) -> Optional[str]:
+        """Встановити час нагадування. Повертає назву завдання (None, якщо його вже немає)"""
+        return await self.fetchval(
+            "UPDATE tasks SET remind_at = %s WHERE id = %s RETURNING title", (remind_at, task_id)
+        )
+
+    async def snooze_tasks(self, task_ids: List[int], remind_at: datetime):
+        await self.execute(
+            "UPDATE tasks SET remind_at = %s WHERE id = ANY(%s) AND is_done = FALSE",
+            (remind_at, list(task_ids)), retry=True
+        )
+
+    async def get_pending_reminders(self) -> List[tuple]:
+        """(id, title, remind_at як unix-час) для всіх невиконаних завдань з нагадуванням"""
+        return await self.fetch(
+            "SELECT id, title, EXTRACT(EPOCH FROM remind_at::timestamptz)::float8 FROM tasks "
+            "WHERE is_done = FALSE AND remind_at IS NOT NULL"
+        )
+
+    async def delete_task(self, task_id: int):
+        await self.execute("DELETE FROM tasks WHERE id = %s", (task_id,), retry=True)
+
+    # --- МАРШРУТИ ---
+
+    async def get_routes(self) -> List[RouteRow]:
+        rows = await self.fetch("SELECT id, info FROM routes ORDER BY id ASC")
+        return [RouteRow(*r) for r in rows]
+
+    async def add_route(self, info: str):
+        await self.execute("INSERT INTO routes (info) VALUES (%s)", (info,))
+
+    async def delete_route(self, route_id: int):
+        await self.execute("DELETE FROM routes WHERE id = %s", (route_id,), retry=True)
+
+    # --- ПРАЦІВНИКИ ---
+
+    async def get_employees_by_birthday(self) -> List[EmployeeRow]:
+        rows = await self.fetch(
+            "SELECT id, full_name, birth_date FROM employees "
+            "ORDER BY EXTRACT(MONTH FROM birth_date), EXTRACT(DAY FROM birth_date)"
+        )
+        return [EmployeeRow(*r) for r in rows]
+
+    async def get_employees_by_name(self) -> List[EmployeeRow]:
+        rows = await self.fetch("SELECT id, full_name, birth_date FROM employees ORDER BY full_name")
+        return [EmployeeRow(*r) for r in rows]
+
+    async def add_employee(self, full_name: str, birth_date: date):
+        await self.execute("INSERT INTO employees (full_name, birth_date) VALUES (%s, %s)", (full_name, birth_date))
+
+    async def delete_employee(self, employee_id: int):
+        await self.execute("DELETE FROM employees WHERE id = %s", (employee_id,), retry=True)
+
+    async def get_birthdays_on(self, month: int, day: int) -> List[str]:
+        rows = await self.fetch(
+            "SELECT full_name FROM employees WHERE EXTRACT(MONTH FROM birth_date) = %s AND EXTRACT(DAY FROM birth_date) = %s",
+            (month, day)
+        )
+        return [r[0] for r in rows]
+
+    # --- АСТРО-ПОРАДИ ---
+
+    async def mark_advice_requested(self, user_id: int):
+        await self.execute("UPDATE astro_users SET advice_requested_at = now() WHERE user_id = %s", (user_id,), retry=True)
+
+    async def get_active_astro_users(self, days: int) -> List[tuple]:
+        """(user_id, info) тих, хто просив пораду за останні days днів"""
+        return await self.fetch(
+            "SELECT user_id, info FROM astro_users "
+            "WHERE advice_requested_at > now() - %s * interval '1 day' AND info IS NOT NULL",
+            (days,)
+        )
+
+    # --- ТЕЛЕФОНИ ---
+
+    async def upsert_employee_phone(self, full_name: str, phone: str) -> str:
+        """
+        Записати номер у довідник у форматі E.164 і прив'язати до працівника з тим самим іменем.
+        Номер унікальний: повторний запис оновлює власника. ValueError — якщо це не номер.
+        """
+        normalized = normalize_phone(phone)
+        if normalized is None:
+            raise ValueError(f"невірний номер телефону: {phone}")
+        await self.execute(
+            "INSERT INTO employee_phones (full_name, phone, employee_id) "
+            f"VALUES (%s, %s, (SELECT min(id) FROM employees WHERE {NAME_KEY_SQL.format(column='full_name')} = %s)) "
+            "ON CONFLICT (phone) DO UPDATE SET full_name = EXCLUDED.full_name, "
+            "employee_id = EXCLUDED.employee_id, updated_at = now()",
+            (full_name.strip(), normalized, name_key(full_name)), retry=True
+        )
+        return normalized
+
+    async def get_employee_phones(self, full_names: List[str]) -> Dict[str, str]:
+        """
+        Телефони для списку імен одним запитом за індексами name_key / surname_key.
+        Повний збіг імені має перевагу; інакше — єдиний запис, сумісний з іменем
+        ("Коваль М." -> "Коваль Мирослава"). Однофамільців і тезок не вгадуємо:
+        якщо підходить кілька записів або жоден, номер не повертається.
+        """
+        keys = {name: name_key(name) for name in full_names if name_key(name)}
+        if not keys:
+            return {}
+        rows = await self.fetch(
+            "SELECT name_key, surname_key, phone FROM employee_phones "
+            "WHERE name_key = ANY(%s) OR surname_key = ANY(%s) ORDER BY id",
+            (list(set(keys.values())), list({key.split()[0] for key in keys.values()}))
+        )
+        exact = defaultdict(set)
+        by_surname = defaultdict(list)
+        for key, surname, phone in rows:
+            exact[key].add(phone)
+            by_surname[surname].append((key, phone))
+
+        phones = {}
+        for name, key in keys.items():
+            matches = exact.get(key) or {
+                phone for full, phone in by_surname.get(key.split()[0], []) if _name_matches(key, full)
+            }
+            if len(matches) == 1:
+                phones[name] = next(iter(matches))
+            elif len(matches) > 1:
+                logger.warning(f"'{name}': кілька відповідних записів у довіднику телефонів — номер не обрано")
+        return phones
+
+
+def _name_matches(short: str, full: str) -> bool:
+    """Кожне слово короткого імені — початок відповідного слова повного (ініціали теж)"""
+    short_words, full_words = short.split(), full.split()
+    return len(short_words) <= len(full_words) and all(f.startswith(s) for s, f in zip(short_words, full_words))
+
+
+repo = Repository(DATABASE_URL, DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE)
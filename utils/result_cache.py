@@ -0,0 +1,112 @@
+import hashlib
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from utils.repository import Repository, repo
+
+logger = logging.getLogger(__name__)
+
+
+def content_key(*parts) -> str:
+    """sha256 від байтів/рядків — ключ для кешування за вмістом"""
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode("utf-8")
+        digest.update(part)
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """
+    Дворівневий кеш результатів: LRU у пам'яті + таблиця ai_cache у Postgres.
+    Записи мають TTL; прострочені ігноруються при читанні та видаляються purge().
+    Значення мають бути JSON-серіалізовними.
+    """
+
+    def __init__(self, namespace: str, ttl: float, max_items: int = 128, repository: Repository = repo):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.max_items = max_items
+        self.repo = repository
+        self._memory: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _remember(self, key: str, value: Any, expires_at: float):
+        self._memory[key] = (expires_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_items:
+            self._memory.popitem(last=False)
+
+    def _from_memory(self, key: str) -> Optional[Any]:
+        entry = self._memory.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.time():
+            del self._memory[key]
+            return None
+        self._memory.move_to_end(key)
+        return value
+
+    async def get(self, *keys: str) -> Optional[Any]:
+        """Значення за першим знайденим ключем (None — промах)"""
+        keys = [k for k in keys if k]
+        for key in keys:
+            value = self._from_memory(key)
+            if value is not None:
+                self.hits += 1
+                return value
+        if keys:
+            try:
+                row = await self.repo.fetchrow(
+                    "SELECT value, EXTRACT(EPOCH FROM expires_at)::float8 FROM ai_cache "
+                    "WHERE namespace = %s AND cache_key = ANY(%s) AND expires_at > now() LIMIT 1",
+                    (self.namespace, keys)
+                )
+            except Exception as e:
+                logger.warning(f"Кеш {self.namespace}: БД недоступна ({e})")
+                row = None
+            if row:
+                value, expires_at = row
+                for key in keys:
+                    self._remember(key, value, expires_at)
+                self.hits += 1
+                return value
+        self.misses += 1
+        return None
+
+    async def set(self, keys: Iterable[str], value: Any, ttl: Optional[float] = None):
+        keys = [k for k in keys if k]
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.time() + ttl
+        for key in keys:
+            self._remember(key, value, expires_at)
+        payload = json.dumps(value, ensure_ascii=False)
+
+        def op(cur):
+            for key in keys:
+                cur.execute(
+                    "INSERT INTO ai_cache (namespace, cache_key, value, expires_at) "
+                    "VALUES (%s, %s, %s::jsonb, now() + %s * interval '1 second') "
+                    "ON CONFLICT (namespace, cache_key) DO UPDATE "
+                    "SET value = EXCLUDED.value, expires_at = EXCLUDED.expires_at",
+                    (self.namespace, key, payload, ttl)
+                )
+        try:
+            await self.repo.run(op)
+        except Exception as e:
+            logger.warning(f"Кеш {self.namespace}: не вдалося зберегти в БД ({e})")
+
+    def stats(self) -> Dict[str, Any]:
+        return {"namespace": self.namespace, "memory_items": len(self._memory), "hits": self.hits, "misses": self.misses}
+
+
+async def purge_expired(repository: Repository = repo) -> int:
+    """Видалити прострочені записи всіх кешів"""
+    return await repository.execute("DELETE FROM ai_cache WHERE expires_at <= now()", retry=True)
@@ -0,0 +1,104 @@
+import asyncio
+import logging
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import SMS_BALANCE_TTL, SMS_SEGMENT_PRICE, SMS_BALANCE_RESERVE
+from utils.single_flight import SingleFlight
+from utils.sms_fly_client import SMSFlyClient
+
+logger = logging.getLogger(__name__)
+
+# GSM-7 (латиниця без розширених символів): 160 знаків в одному SMS, 153 у частині довгого.
+# Будь-яка кирилиця — UCS-2: 70 і 67 відповідно.
+GSM7_CHARS = set(
+    "@£$¥èéùìòÇ\nØø\rÅåΔ_ΦΓΛΩΠΨΣΘΞÆæßÉ !\"#¤%&'()*+,-./0123456789:;<=>?"
+    "¡ABCDEFGHIJKLMNOPQRSTUVWXYZÄÖÑÜ§¿abcdefghijklmnopqrstuvwxyzäöñüà"
+)
+GSM7_EXTENDED = set("^{}\\[~]|€")
+
+
+def sms_segments(text: str) -> int:
+    """Кількість SMS-частин, якими оператор рахує повідомлення"""
+    if all(ch in GSM7_CHARS or ch in GSM7_EXTENDED for ch in text):
+        length = sum(2 if ch in GSM7_EXTENDED else 1 for ch in text)
+        single, part = 160, 153
+    else:
+        length = len(text.encode("utf-16-le")) // 2
+        single, part = 70, 67
+    if length <= single:
+        return 1
+    return -(-length // part)
+
+
+class SmsBalance:
+    """
+    Баланс SMS Fly з кешем на ttl секунд. Одночасні запити об'єднуються,
+    після кампанії баланс оновлюється у фоні (refresh_soon), а estimate()
+    порівнює вартість розсилки з кешованим балансом без мережевих запитів,
+    якщо кеш свіжий.
+    """
+
+    def __init__(self, client: SMSFlyClient, ttl: float = SMS_BALANCE_TTL,
+                 segment_price: float = SMS_SEGMENT_PRICE, reserve: float = SMS_BALANCE_RESERVE):
+        self.client = client
+        self.ttl = ttl
+        self.segment_price = segment_price
+        self.reserve = reserve
+        self._value: Optional[Dict[str, Any]] = None
+        self._fetched_at = 0.0
+        self._flights = SingleFlight()
+        self._refresh: Optional[asyncio.Task] = None
+
+    @property
+    def age(self) -> Optional[float]:
+        return time.monotonic() - self._fetched_at if self._value else None
+
+    async def _fetch(self) -> Dict[str, Any]:
+        balance = await self.client.get_extended_balance()
+        if balance.get("success"):
+            self._value = balance
+            self._fetched_at = time.monotonic()
+        else:
+            logger.warning(f"Баланс SMS не отримано: {balance.get('error')}")
+        return balance
+
+    async def get(self, force: bool = False) -> Dict[str, Any]:
+        """Баланс з кешу або з API. При помилці API повертає останнє відоме значення, якщо воно є"""
+        if not force and self._value and time.monotonic() - self._fetched_at < self.ttl:
+            return self._value
+        balance = await self._flights.do("balance", self._fetch)
+        if not balance.get("success") and self._value:
+            return self._value
+        return balance
+
+    def refresh_soon(self, min_age: float = 30):
+        """Оновити баланс у фоні (після кампанії); повторні виклики поспіль нічого не додають"""
+        if self._refresh is not None and not self._refresh.done():
+            return
+        if self.age is not None and self.age < min_age:
+            return
+        self._refresh = asyncio.create_task(self.get(force=True))
+
+    async def estimate(self, messages: List[Tuple[str, str]], phones: Dict[str, str]) -> Dict[str, Any]:
+        """
+        Передпольотна оцінка розсилки: частини, вартість і чи вистачить балансу.
+        Рахуються лише одержувачі з номером у phones — решта не відправляється.
+        enough — None, якщо баланс невідомий (тоді лише попереджаємо).
+        """
+        sendable = [text for name, text in messages if phones.get(name)]
+        segments = sum(sms_segments(text) for text in sendable)
+        cost = round(segments * self.segment_price, 2)
+        balance = await self.get()
+        available = None
+        if balance.get("success"):
+            try:
+                available = float(balance.get("sms_balance") or 0)
+            except (TypeError, ValueError):
+                available = None
+        return {
+            "recipients": len(sendable), "no_phone": len(messages) - len(sendable),
+            "segments": segments, "cost": cost,
+            "balance": available,
+            "enough": None if available is None else available - cost >= self.reserve,
+        }
@@ -0,0 +1,77 @@
+import logging
+
+from utils.http_client import http_client, SMS_FLY_HOST
+
+logger = logging.getLogger(__name__)
+
+# Кінцеві статуси SMS Fly -> delivered / undelivered / expired; решта (ACCEPTD, PENDING, SENT...) — ще в дорозі
+DELIVERY_STATUSES = {
+    "DELIVRD": "delivered",
+    "UNDELIV": "undelivered",
+    "REJECTD": "undelivered",
+    "ERROR": "undelivered",
+    "EXPIRED": "expired",
+}
+
+
+class SMSFlyClient:
+    def __init__(self, api_key: str, sender: str = "YourBot"):
+        self.api_key = api_key
+        self.sender = sender
+        self.base_url = f"{SMS_FLY_HOST}/api/v2/api.php"
+
+    async def _call(self, action: str, data: dict) -> dict:
+        payload = {
+            "auth": {"key": self.api_key},
+            "action": action,
+            "data": data
+        }
+        async with http_client.post(self.base_url, endpoint="sms", json=payload) as resp:
+            if resp.status != 200:
+                return {"success": 0, "http_status": resp.status, "error": {"description": f"HTTP {resp.status}"}}
+            return await resp.json(content_type=None)
+
+    async def send_sms(self, phone: str, message: str, ttl: int = 60, flash: int = 0):
+        """phone — у форматі E.164 (+380...), як він зберігається в довіднику"""
+        try:
+            data = await self._call("SENDMESSAGE", {
+                "recipient": phone.lstrip('+'),
+                "channels": ["sms"],
+                "sms": {
+                    "source": self.sender,
+                    "ttl": ttl,
+                    "flash": flash,
+                    "text": message
+                }
+            })
+            if data.get('success') == 1:
+                return {"success": True, "message_id": data.get('data', {}).get('messageID')}
+            error = data.get('error', {})
+            # HTTP-збій можна повторити; відмову API (невірний номер тощо) — ні
+            return {"success": False, "error": error.get('description'), "retryable": "http_status" in data}
+        except Exception as e:
+            return {"success": False, "error": str(e) or type(e).__name__, "retryable": True}
+
+    async def get_message_status(self, message_id: str):
+        """Статус повідомлення за messageID: raw — код SMS Fly, delivery — кінцевий стан або None"""
+        try:
+            data = await self._call("GETMESSAGESTATUS", {"messageID": message_id})
+            if data.get('success') == 1:
+                info = data.get('data', {})
+                raw = (info.get('sms') or {}).get('status') or info.get('status')
+                return {"success": True, "raw": raw, "delivery": DELIVERY_STATUSES.get(raw)}
+            error = data.get('error', {})
+            return {"success": False, "error": error.get('description') or "API error"}
+        except Exception as e:
+            return {"success": False, "error": str(e) or type(e).__name__}
+
+    async def get_extended_balance(self):
+        try:
+            data = await self._call("GETBALANCEEXT", {})
+            if data.get('success') == 1:
+                balance_data = data.get('data', {}).get('balance', {})
+                return {"success": True, "sms_balance": balance_data.get('sms', '0'), "viber_balance": balance_data.get('viber', '0')}
+            error = data.get('error', {})
+            return {"success": False, "error": error.get('description') or "API error"}
+        except Exception as e:
+            return {"success": False, "error": str(e)}
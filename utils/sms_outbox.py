@@ -0,0 +1,502 @@
+import asyncio
+import logging
+import random
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, NamedTuple, Optional, Set, Tuple
+
+from psycopg2.extras import execute_values
+
+from config import (
+    SMS_CONCURRENCY, SMS_RATE, SMS_MAX_ATTEMPTS, SMS_RETRY_BASE, SMS_LEASE, SMS_POLL_INTERVAL,
+    SMS_STATUS_RATE, SMS_STATUS_BATCH, SMS_STATUS_FIRST_CHECK, SMS_STATUS_MAX_AGE,
+)
+from utils.rate_limit import RateLimiter
+from utils.repository import Repository, repo
+from utils.sms_fly_client import SMSFlyClient
+
+logger = logging.getLogger(__name__)
+
+NO_PHONE = "немає телефону"
+
+# Стани доставки в звіті: кінцеві від SMS Fly + "unknown", якщо звіту так і не було
+DELIVERY_STATES = ("delivered", "undelivered", "expired", "unknown")
+
+
+class OutboxRow(NamedTuple):
+    id: int
+    campaign_id: int
+    phone: str
+    body: str
+    attempts: int
+
+
+class StatusCheck(NamedTuple):
+    id: int
+    campaign_id: int
+    message_id: str
+    stale: bool
+
+
+class SmsOutbox:
+    """
+    Надійна черга SMS у таблиці sms_outbox.
+    Обробник лише ставить кампанію в чергу (enqueue) і одразу відповідає;
+    фоновий воркер забирає записи через FOR UPDATE SKIP LOCKED (кілька
+    екземплярів бота не візьмуть один запис), надсилає з обмеженням
+    одночасності й частоти та повторює тимчасові збої з експоненційною паузою.
+
+    Запис "sending" з простроченою орендою (SMS_LEASE) після падіння процесу
+    забирається знову, тож доставка — "щонайменше один раз" для вузького
+    вікна між відправкою і записом результату.
+
+    Кампанію можна запланувати (scheduled_at) і задати темп rate SMS/с:
+    кожен запис отримує свій next_attempt_at, тож розклад переживає
+    перезапуск. Призупинені й скасовані кампанії воркер не бере.
+
+    Другий фоновий цикл збирає звіти про доставку: пачками забирає надіслані
+    записи, яким настав час перевірки, і питає статус з окремим лімітом
+    частоти; наступна перевірка — з подвоєною паузою.
+
+    Обидва цикли сплять до найближчого відомого терміну, а без роботи —
+    poll_interval (хвилини): чергу будять enqueue()/resume(), трекер — відправлена
+    пачка, тож простій не тримає БД активною.
+    """
+
+    def __init__(self, client: SMSFlyClient, repository: Repository = repo,
+                 on_update: Optional[Callable[[int, Dict[str, Any]], Awaitable[None]]] = None,
+                 concurrency: int = SMS_CONCURRENCY, rate: float = SMS_RATE,
+                 max_attempts: int = SMS_MAX_ATTEMPTS, retry_base: float = SMS_RETRY_BASE,
+                 lease: int = SMS_LEASE, poll_interval: float = SMS_POLL_INTERVAL,
+                 status_rate: float = SMS_STATUS_RATE, status_batch: int = SMS_STATUS_BATCH,
+                 status_first_check: int = SMS_STATUS_FIRST_CHECK, status_max_age: int = SMS_STATUS_MAX_AGE):
+        self.client = client
+        self.repo = repository
+        self.on_update = on_update
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.batch_size = concurrency * 4
+        self.limiter = RateLimiter(rate, burst=concurrency)
+        self._slots = asyncio.Semaphore(concurrency)
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._runner: Optional[asyncio.Task] = None
+        self.status_batch = status_batch
+        self.status_first_check = status_first_check
+        self.status_max_age = status_max_age
+        # GETMESSAGESTATUS у SMS Fly приймає лише один messageID, тож пачку
+        # опитуємо окремими запитами: не частіше status_rate і не більше двох одночасно
+        self.status_limiter = RateLimiter(status_rate, burst=2)
+        self._status_slots = asyncio.Semaphore(2)
+        self._tracker: Optional[asyncio.Task] = None
+        # Будить трекер статусів: після відправки пачки і при зупинці
+        self._status_wakeup = asyncio.Event()
+
+    # --- ПОСТАНОВКА В ЧЕРГУ ---
+
+    async def enqueue(self, kind: str, dedupe_key: str, messages: List[Tuple[str, str]],
+                      created_by: Optional[int] = None, chat_id: Optional[int] = None,
+                      message_id: Optional[int] = None, scheduled_at: Optional[datetime] = None,
+                      rate: Optional[float] = None, phones: Optional[Dict[str, str]] = None) -> Optional[int]:
+        """
+        Поставити кампанію в чергу. messages: [(ім'я, текст)].
+        dedupe_key ідентифікує кампанію (напр. повідомлення з кнопкою): повторне
+        натискання повертає None і нічого не додає. Ключ ідемпотентності
+        запису — кампанія + одержувач.
+        scheduled_at — не раніше цього часу (None — одразу); rate — SMS/с,
+        з якими записи розкладаються від scheduled_at (None — без розкладу).
+        phones — вже знайдені номери {ім'я: телефон} (None — шукаємо в довіднику).
+        """
+        if phones is None:
+            phones = await self.repo.get_employee_phones([name for name, _ in messages])
+
+        def op(cur):
+            cur.execute(
+                "INSERT INTO sms_campaigns (kind, dedupe_key, created_by, chat_id, message_id, scheduled_at, rate) "
+                "VALUES (%s, %s, %s, %s, %s, COALESCE(%s, now()), %s) "
+                "ON CONFLICT (dedupe_key) DO NOTHING RETURNING id, scheduled_at",
+                (kind, dedupe_key, created_by, chat_id, message_id, scheduled_at, rate)
+            )
+            row = cur.fetchone()
+            if row is None:
+                return None, 0
+            campaign_id, start = row
+            rows = []
+            slot = 0
+            for name, text in messages:
+                phone = phones.get(name)
+                due = start + timedelta(seconds=slot / rate) if rate else start
+                if phone:
+                    slot += 1
+                rows.append((campaign_id, f"{dedupe_key}:{name}", name, phone, text,
+                             "pending" if phone else "failed", None if phone else NO_PHONE, due))
+            execute_values(
+                cur,
+                "INSERT INTO sms_outbox (campaign_id, idempotency_key, recipient, phone, body, status, last_error, "
+                "next_attempt_at) VALUES %s ON CONFLICT (idempotency_key) DO NOTHING",
+                rows
+            )
+            return campaign_id, slot
+
+        campaign_id, pending = await self.repo.run(op, retry=False)
+        if campaign_id is not None:
+            when = f" з {scheduled_at:%d.%m %H:%M}" if scheduled_at else ""
+            pace = f", {rate:g} SMS/с" if rate else ""
+            logger.info(f"📥 Кампанія {kind} #{campaign_id}: {pending} з {len(messages)} SMS у черзі{when}{pace}")
+            if pending:
+                self._wakeup.set()
+            else:
+                # Відправляти нічого — воркер цю кампанію не побачить, тож звіт одразу
+                await self._notify(campaign_id)
+        return campaign_id
+
+    # --- КЕРУВАННЯ КАМПАНІЄЮ ---
+
+    async def pause(self, campaign_id: int) -> bool:
+        """Призупинити: вже взяті в роботу записи доходять, решта чекає"""
+        changed = await self.repo.execute(
+            "UPDATE sms_campaigns SET status = 'paused' WHERE id = %s AND status = 'active'", (campaign_id,), retry=True
+        )
+        if changed:
+            await self._notify(campaign_id)
+        return bool(changed)
+
+    async def resume(self, campaign_id: int) -> bool:
+        """Продовжити з тим самим темпом від поточного моменту (без залпу пропущених слотів)"""
+        def op(cur):
+            cur.execute(
+                "UPDATE sms_campaigns SET status = 'active' WHERE id = %s AND status = 'paused' "
+                "RETURNING GREATEST(scheduled_at, now()), rate",
+                (campaign_id,)
+            )
+            row = cur.fetchone()
+            if row is None:
+                return False
+            start, rate = row
+            cur.execute(
+                "UPDATE sms_outbox o SET next_attempt_at = %s + (r.n - 1) * %s * interval '1 second' "
+                "FROM (SELECT id, row_number() OVER (ORDER BY next_attempt_at, id) AS n FROM sms_outbox "
+                "      WHERE campaign_id = %s AND status = 'pending') r "
+                "WHERE o.id = r.id",
+                (start, 1 / rate if rate else 0, campaign_id)
+            )
+            return True
+
+        resumed = await self.repo.run(op, retry=False)
+        if resumed:
+            self._wakeup.set()
+            await self._notify(campaign_id)
+        return resumed
+
+    async def cancel(self, campaign_id: int) -> bool:
+        """Скасувати: невідправлені записи позначаються cancelled"""
+        def op(cur):
+            cur.execute(
+                "UPDATE sms_campaigns SET status = 'cancelled' WHERE id = %s AND status <> 'cancelled'",
+                (campaign_id,)
+            )
+            if not cur.rowcount:
+                return False
+            # "Завислі" записи з простроченою орендою воркер уже не візьме — скасовуємо й їх
+            cur.execute(
+                "UPDATE sms_outbox SET status = 'cancelled', locked_until = NULL, updated_at = now() "
+                "WHERE campaign_id = %s AND (status = 'pending' OR (status = 'sending' AND locked_until < now()))",
+                (campaign_id,)
+            )
+            return True
+
+        cancelled = await self.repo.run(op, retry=False)
+        if cancelled:
+            await self._notify(campaign_id)
+        return cancelled
+
+    # --- ВОРКЕР ---
+
+    def start(self):
+        self._stopping = False
+        self._status_wakeup.clear()
+        self._runner = asyncio.create_task(self._run())
+        self._tracker = asyncio.create_task(self._track())
+
+    async def stop(self, timeout: float = 10):
+        """Дочекатися поточної пачки (до timeout), щоб не лишати записів у стані sending"""
+        if not self._runner:
+            return
+        self._stopping = True
+        self._status_wakeup.set()
+        self._wakeup.set()
+        try:
+            await asyncio.wait_for(asyncio.gather(self._runner, self._tracker), timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError):
+            pass
+        self._runner = self._tracker = None
+
+    async def _claim(self) -> Tuple[List[OutboxRow], Set[int]]:
+        """
+        Забрати пачку записів (attempts рахується при кожному захопленні, зокрема
+        повторному після простроченої оренди). Перед цим записи з простроченою орендою,
+        що вичерпали спроби (напр. валять воркер), стають failed, а в скасованих
+        кампаніях — cancelled. Повертає пачку та id кампаній, де щось змінилось так.
+        """
+        def op(cur):
+            cur.execute(
+                "UPDATE sms_outbox o SET "
+                "status = CASE WHEN c.status = 'cancelled' THEN 'cancelled' ELSE 'failed' END, "
+                "last_error = CASE WHEN c.status = 'cancelled' THEN o.last_error "
+                "                  ELSE 'оренда прострочена, спроби вичерпано' END, "
+                "locked_until = NULL, updated_at = now() "
+                "FROM sms_campaigns c WHERE c.id = o.campaign_id "
+                "AND o.status = 'sending' AND o.locked_until < now() "
+                "AND (c.status = 'cancelled' OR o.attempts >= %s) "
+                "RETURNING o.campaign_id",
+                (self.max_attempts,)
+            )
+            swept = {row[0] for row in cur.fetchall()}
+            cur.execute(
+                "UPDATE sms_outbox SET status = 'sending', attempts = attempts + 1, "
+                "locked_until = now() + %s * interval '1 second', updated_at = now() "
+                "WHERE id IN ("
+                "    SELECT o.id FROM sms_outbox o JOIN sms_campaigns c ON c.id = o.campaign_id"
+                "    WHERE c.status = 'active' AND ("
+                "          (o.status = 'pending' AND o.next_attempt_at <= now())"
+                "       OR (o.status = 'sending' AND o.locked_until < now()))"
+                "    ORDER BY o.next_attempt_at, o.id LIMIT %s FOR UPDATE OF o SKIP LOCKED"
+                ") RETURNING id, campaign_id, phone, body, attempts",
+                (self.lease, self.batch_size)
+            )
+            return [OutboxRow(*row) for row in cur.fetchall()], swept
+
+        return await self.repo.run(op, retry=False)
+
+    async def _next_due(self) -> float:
+        """
+        Секунд до найближчого запису за розкладом або кінця чиєїсь оренди.
+        Якщо таких немає — poll_interval: власну чергу будять enqueue()/resume(),
+        а рідкісне опитування лише підхоплює роботу інших екземплярів.
+        """
+        delay = await self.repo.fetchval(
+            "SELECT EXTRACT(EPOCH FROM min(CASE WHEN o.status = 'pending' THEN o.next_attempt_at "
+            "                                   ELSE o.locked_until END) - now())::float8 "
+            "FROM sms_outbox o JOIN sms_campaigns c ON c.id = o.campaign_id "
+            # Ті самі умови, що в _claim: інакше прострочений запис призупиненої кампанії крутив би цикл
+            "WHERE (c.status = 'active' AND o.status IN ('pending', 'sending')) "
+            "   OR (o.status = 'sending' AND (c.status = 'cancelled' OR o.attempts >= %s))",
+            (self.max_attempts,)
+        )
+        if delay is None:
+            return self.poll_interval
+        return min(max(delay, 0.05), self.poll_interval)
+
+    async def _deliver(self, row: OutboxRow):
+        async with self._slots:
+            await self.limiter.acquire()
+            result = await self.client.send_sms(row.phone, row.body)
+
+        if result["success"]:
+            message_id = result.get("message_id")
+            await self.repo.execute(
+                "UPDATE sms_outbox SET status = 'sent', provider_message_id = %s, sent_at = now(), "
+                "next_status_check_at = now() + %s * interval '1 second', "
+                "locked_until = NULL, last_error = NULL, updated_at = now() WHERE id = %s",
+                (str(message_id) if message_id is not None else None, self.status_first_check, row.id), retry=True
+            )
+        elif result.get("retryable") and row.attempts < self.max_attempts:
+            delay = self.retry_base * 2 ** (row.attempts - 1) * random.uniform(0.5, 1.0)
+            await self.repo.execute(
+                "UPDATE sms_outbox SET status = 'pending', next_attempt_at = now() + %s * interval '1 second', "
+                "locked_until = NULL, last_error = %s, updated_at = now() WHERE id = %s",
+                (delay, result.get("error"), row.id), retry=True
+            )
+            logger.warning(f"SMS #{row.id}: {result.get('error')}. Повтор {row.attempts}/{self.max_attempts - 1} через {delay:.0f} с")
+        else:
+            await self.repo.execute(
+                "UPDATE sms_outbox SET status = 'failed', locked_until = NULL, last_error = %s, updated_at = now() "
+                "WHERE id = %s",
+                (result.get("error"), row.id), retry=True
+            )
+
+    async def _run(self):
+        while not self._stopping:
+            self._wakeup.clear()
+            try:
+                rows, swept = await self._claim()
+            except Exception as e:
+                logger.error(f"SMS outbox: не вдалося забрати записи ({e})")
+                rows, swept = [], set()
+            for campaign_id in swept - {row.campaign_id for row in rows}:
+                await self._notify(campaign_id)
+
+            if rows:
+                results = await asyncio.gather(*(self._deliver(row) for row in rows), return_exceptions=True)
+                for row, result in zip(rows, results):
+                    if isinstance(result, Exception):
+                        logger.error(f"SMS #{row.id}: {result}")
+                for campaign_id in {row.campaign_id for row in rows}:
+                    await self._notify(campaign_id)
+                self._status_wakeup.set()
+                continue
+
+            try:
+                # Запланований темп тримаємо, прокидаючись до наступного слоту
+                timeout = await self._next_due()
+            except Exception:
+                timeout = self.poll_interval
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    # --- ЗВІТИ ПРО ДОСТАВКУ ---
+
+    async def _claim_status_checks(self) -> List[StatusCheck]:
+        """Забрати пачку записів на перевірку й одразу відсунути наступну (подвоєна пауза, до години)"""
+        rows = await self.repo.fetch(
+            "UPDATE sms_outbox SET status_checks = status_checks + 1, "
+            "next_status_check_at = now() + LEAST(%s * power(2, status_checks), 3600) * interval '1 second' "
+            "WHERE id IN ("
+            "    SELECT id FROM sms_outbox"
+            "    WHERE status = 'sent' AND delivery_status IS NULL AND next_status_check_at <= now()"
+            "    ORDER BY next_status_check_at LIMIT %s FOR UPDATE SKIP LOCKED"
+            ") RETURNING id, campaign_id, provider_message_id, sent_at < now() - %s * interval '1 hour'",
+            (self.status_first_check, self.status_batch, self.status_max_age), retry=False
+        )
+        return [StatusCheck(*row) for row in rows]
+
+    async def _status_of(self, check: StatusCheck) -> Tuple[Optional[str], Optional[str]]:
+        if check.message_id is None:
+            return "unknown", None
+        async with self._status_slots:
+            await self.status_limiter.acquire()
+            result = await self.client.get_message_status(check.message_id)
+        if not result["success"]:
+            logger.warning(f"SMS #{check.id}: статус не отримано ({result.get('error')})")
+            return ("unknown" if check.stale else None), None
+        return (result["delivery"] or ("unknown" if check.stale else None)), result["raw"]
+
+    async def _next_status_check(self) -> float:
+        """Секунд до найближчої перевірки статусу (poll_interval, якщо перевіряти нічого)"""
+        delay = await self.repo.fetchval(
+            "SELECT EXTRACT(EPOCH FROM min(next_status_check_at) - now())::float8 FROM sms_outbox "
+            "WHERE status = 'sent' AND delivery_status IS NULL"
+        )
+        if delay is None:
+            return self.poll_interval
+        return min(max(delay, 0.05), self.poll_interval)
+
+    async def check_statuses(self) -> int:
+        """Один прохід: статуси пачки записів, одне масове оновлення. Повертає розмір пачки"""
+        checks = await self._claim_status_checks()
+        if not checks:
+            return 0
+        results = await asyncio.gather(*(self._status_of(check) for check in checks))
+
+        def op(cur):
+            execute_values(
+                cur,
+                "UPDATE sms_outbox o SET delivery_status = v.delivery, provider_status = COALESCE(v.raw, o.provider_status), "
+                "delivered_at = CASE WHEN v.delivery = 'delivered' THEN now() END, updated_at = now() "
+                "FROM (VALUES %s) AS v(id, delivery, raw) WHERE o.id = v.id",
+                [(check.id, delivery, raw) for check, (delivery, raw) in zip(checks, results)],
+                template="(%s::bigint, %s::text, %s::text)"
+            )
+
+        await self.repo.run(op, retry=True)
+        for campaign_id in {check.campaign_id for check, (delivery, _) in zip(checks, results) if delivery}:
+            await self._notify(campaign_id)
+        return len(checks)
+
+    async def _track(self):
+        while not self._stopping:
+            self._status_wakeup.clear()
+            try:
+                checked = await self.check_statuses()
+            except Exception as e:
+                logger.error(f"SMS: помилка перевірки статусів доставки ({e})")
+                checked = 0
+            if checked == self.status_batch:
+                continue
+            try:
+                timeout = await self._next_status_check()
+            except Exception:
+                timeout = self.poll_interval
+            try:
+                await asyncio.wait_for(self._status_wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _notify(self, campaign_id: int):
+        if self.on_update is None or campaign_id is None:
+            return
+        try:
+            await self.on_update(campaign_id, await self.campaign_status(campaign_id))
+        except Exception as e:
+            logger.error(f"SMS кампанія #{campaign_id}: помилка оновлення статусу ({e})")
+
+    # --- СТАТУС ---
+
+    async def campaign_status(self, campaign_id: int) -> Dict[str, Any]:
+        rows = await self.repo.fetch(
+            "SELECT c.kind, c.chat_id, c.message_id, c.created_by, c.status, c.scheduled_at, c.rate, "
+            "       o.recipient, o.status, o.last_error, o.delivery_status "
+            "FROM sms_campaigns c LEFT JOIN sms_outbox o ON o.campaign_id = c.id "
+            "WHERE c.id = %s ORDER BY o.id",
+            (campaign_id,)
+        )
+        counts = {"pending": 0, "sending": 0, "sent": 0, "failed": 0, "cancelled": 0}
+        delivery = dict.fromkeys(DELIVERY_STATES + ("awaiting",), 0)
+        recipients = []
+        for *_, name, status, error, delivery_status in rows:
+            if name is None:
+                continue
+            counts[status] = counts.get(status, 0) + 1
+            if status == "sent":
+                delivery[delivery_status or "awaiting"] += 1
+            recipients.append({"name": name, "status": status, "error": error, "delivery": delivery_status})
+        kind, chat_id, message_id, created_by, state, scheduled_at, rate = rows[0][:7] if rows else (None,) * 7
+        return {
+            "id": campaign_id, "kind": kind, "chat_id": chat_id, "message_id": message_id,
+            "created_by": created_by, "state": state, "scheduled_at": scheduled_at, "rate": rate,
+            "counts": counts, "done": counts["pending"] + counts["sending"] == 0,
+            "delivery": delivery, "recipients": recipients,
+        }
+
+    async def open_campaigns(self) -> List[Dict[str, Any]]:
+        """Незавершені кампанії (активні й призупинені) з кількістю записів, що лишились"""
+        rows = await self.repo.fetch(
+            "SELECT c.id, c.kind, c.status, c.scheduled_at, c.rate, count(*) "
+            "FROM sms_campaigns c JOIN sms_outbox o ON o.campaign_id = c.id "
+            "WHERE c.status <> 'cancelled' AND o.status IN ('pending', 'sending') "
+            "GROUP BY c.id ORDER BY c.scheduled_at, c.id"
+        )
+        return [
+            {"id": cid, "kind": kind, "state": state, "scheduled_at": scheduled_at, "rate": rate, "left": left}
+            for cid, kind, state, scheduled_at, rate, left in rows
+        ]
+
+    async def summary(self, hours: int = 24) -> Dict[str, Any]:
+        """Стан черги: незавершені записи та результати за останні hours годин.
+        oldest_pending_s — наскільки найстаріший запис, якому вже час, відстає від розкладу"""
+        rows = await self.repo.fetch(
+            "SELECT status, count(*), GREATEST(EXTRACT(EPOCH FROM now() - min(next_attempt_at)), 0)::float8 FROM sms_outbox "
+            "WHERE status IN ('pending', 'sending') OR created_at > now() - %s * interval '1 hour' "
+            "GROUP BY status",
+            (hours,)
+        )
+        counts = {"pending": 0, "sending": 0, "sent": 0, "failed": 0, "cancelled": 0}
+        oldest = {}
+        for status, count, age in rows:
+            counts[status] = count
+            oldest[status] = round(age or 0)
+        delivery_rows = await self.repo.fetch(
+            "SELECT COALESCE(delivery_status, 'awaiting'), count(*) FROM sms_outbox "
+            "WHERE status = 'sent' AND sent_at > now() - %s * interval '1 hour' GROUP BY 1",
+            (hours,)
+        )
+        delivery = dict.fromkeys(DELIVERY_STATES + ("awaiting",), 0)
+        delivery.update(dict(delivery_rows))
+        return {
+            "hours": hours, "counts": counts, "delivery": delivery,
+            "oldest_pending_s": oldest.get("pending", 0),
+            "worker_running": self._runner is not None and not self._runner.done(),
+        }
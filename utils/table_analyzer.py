@@ -1,11 +1,8 @@
-import asyncio
-import base64
 import logging
-from typing import List, Dict, Optional
-from io import BytesIO
-from PIL import Image
+from typing import List, Dict
 
-from utils.gemini_client import GeminiClient
+from utils.gemini_client import GeminiClient, GeminiError
+from utils.table_schema import TABLE_PROMPTS, generation_config, parse_table
 
 logger = logging.getLogger(__name__)
 
@@ -13,93 +10,30 @@ class TableAnalyzer:
     def __init__(self, gemini_client: GeminiClient):
         self.gemini = gemini_client
 
+    async def _analyze(self, table_type: str, image_data: bytes) -> List[Dict]:
+        try:
+            response = await self.gemini.generate(
+                TABLE_PROMPTS[table_type], blob=image_data, mime_type="image/jpeg",
+                generation_config=generation_config(table_type), feature=table_type
+            )
+        except GeminiError as e:
+            logger.error(f"Error analyzing {table_type} table: {e}")
+            return []
+        return parse_table(table_type, response)
+
     async def analyze_medical_table(self, image_data: bytes) -> List[Dict]:
         """
         Аналіз таблиці з медоглядами
-        Повертає список словників: [{"name": "Прізвище", "medical": "М", "fluorography": "Ф", "gynecology": "Г", "vaccination": "В"}, ...]
-        """
-        prompt = """Проаналізуй цю таблицю з медичними оглядами. 
-        Розпізнай прізвища працівників та позначки про необхідні огляди.
-        
-        Для кожного працівника визнач:
-        - М (медогляд)
-        - Ф (флюрографія)
-        - Г (гінеколог) - тільки для жінок
-        - В (щеплення)
-        
-        Формат відповіді (тільки JSON, без додаткового тексту):
-        [
-            {"name": "Прізвище", "medical": "так/ні", "fluorography": "так/ні", "gynecology": "так/ні", "vaccination": "так/ні"},
-            ...
-        ]
-        
-        Якщо позначка є - став "так", якщо немає - "ні".
-        Відповідай тільки JSON масивом.
+        Повертає список словників: [{"name": "Прізвище", "medical": True, "fluorography": False, "gynecology": False, "vaccination": True}, ...]
         """
-        
-        try:
-            # Конвертуємо зображення в base64
-            image_base64 = base64.b64encode(image_data).decode('utf-8')
-            
-            response = await self.gemini.generate_with_image(prompt, image_base64, "image/jpeg")
-            
-            # Очищаємо відповідь від можливих маркерів коду
-            response = response.strip()
-            if response.startswith('```json'):
-                response = response[7:]
-            if response.startswith('```'):
-                response = response[3:]
-            if response.endswith('```'):
-                response = response[:-3]
-            
-            import json
-            result = json.loads(response.strip())
-            return result
-            
-        except Exception as e:
-            logger.error(f"Error analyzing medical table: {e}")
-            return []
+        return await self._analyze("medical", image_data)
 
     async def analyze_sunday_work_table(self, image_data: bytes) -> List[Dict]:
         """
         Аналіз таблиці з роботою в неділю
-        Повертає список словників: [{"name": "Прізвище", "need_to_work": "так/ні"}, ...]
-        """
-        prompt = """Проаналізуй цю таблицю з графіком роботи в неділю.
-        Розпізнай прізвища працівників та позначки хто працює в неділю.
-        
-        Формат відповіді (тільки JSON, без додаткового тексту):
-        [
-            {"name": "Прізвище", "need_to_work": "так"},
-            {"name": "Прізвище", "need_to_work": "ні"},
-            ...
-        ]
-        
-        Якщо працівник позначений як той, хто працює - став "так", якщо ні - "ні".
-        Відповідай тільки JSON масивом.
+        Повертає список словників: [{"name": "Прізвище", "need_to_work": True}, ...]
         """
-        
-        try:
-            image_base64 = base64.b64encode(image_data).decode('utf-8')
-            
-            response = await self.gemini.generate_with_image(prompt, image_base64, "image/jpeg")
-            
-            # Очищаємо відповідь
-            response = response.strip()
-            if response.startswith('```json'):
-                response = response[7:]
-            if response.startswith('```'):
-                response = response[3:]
-            if response.endswith('```'):
-                response = response[:-3]
-            
-            import json
-            result = json.loads(response.strip())
-            return result
-            
-        except Exception as e:
-            logger.error(f"Error analyzing sunday work table: {e}")
-            return []
+        return await self._analyze("sunday", image_data)
 
     def format_medical_message(self, employee_data: Dict) -> str:
         """
@@ -107,13 +41,13 @@ class TableAnalyzer:
         """
         needed = []
         
-        if employee_data.get('medical') == 'так':
+        if employee_data.get('medical'):
             needed.append("медогляд")
-        if employee_data.get('fluorography') == 'так':
+        if employee_data.get('fluorography'):
             needed.append("флюрографію")
-        if employee_data.get('gynecology') == 'так':
+        if employee_data.get('gynecology'):
             needed.append("гінеколога")
-        if employee_data.get('vaccination') == 'так':
+        if employee_data.get('vaccination'):
             needed.append("щеплення")
         
         if not needed:
@@ -0,0 +1,125 @@
+import logging
+from typing import Any, Dict, List, Optional
+
+from utils.json_stream import loads
+
+logger = logging.getLogger(__name__)
+
+# Позначки медогляду: поле -> скорочення для звіту
+MEDICAL_FIELDS = {
+    "medical": "М",
+    "fluorography": "Ф",
+    "gynecology": "Г",
+    "vaccination": "В",
+}
+SUNDAY_FIELDS = {
+    "need_to_work": "Н",
+}
+TABLE_FIELDS = {
+    "medical": MEDICAL_FIELDS,
+    "sunday": SUNDAY_FIELDS,
+}
+
+# Формат відповіді задає responseSchema, тож у промптах лише зміст таблиці
+TABLE_PROMPTS = {
+    "medical": """Ти експерт з розпізнавання таблиць. На фото таблиця медоглядів.
+Колонки: Прізвище, Медогляд, Флюорографія, Гінеколог (тільки для жінок), Вакцинація.
+Для кожного працівника: true, якщо в колонці позначка "потрібно", інакше false.""",
+    "sunday": """Ти експерт з розпізнавання таблиць. На фото таблиця роботи в неділю.
+Для кожного працівника: need_to_work = true, якщо він позначений як той, хто працює в неділю.""",
+}
+
+
+def table_schema(table_type: str) -> Dict[str, Any]:
+    """responseSchema Gemini: масив рядків з ім'ям і булевими позначками"""
+    fields = list(TABLE_FIELDS[table_type])
+    properties = {"name": {"type": "STRING"}}
+    properties.update({field: {"type": "BOOLEAN"} for field in fields})
+    return {
+        "type": "ARRAY",
+        "items": {
+            "type": "OBJECT",
+            "properties": properties,
+            "required": ["name", *fields],
+            "propertyOrdering": ["name", *fields],
+        },
+    }
+
+
+def generation_config(table_type: str, max_output_tokens: int = 4096) -> Dict[str, Any]:
+    return {
+        "temperature": 0.1,
+        "maxOutputTokens": max_output_tokens,
+        "responseMimeType": "application/json",
+        "responseSchema": table_schema(table_type),
+    }
+
+
+def validate_row(table_type: str, row: Any) -> Optional[Dict[str, Any]]:
+    """Рядок, що відповідає схемі, або None (некоректні рядки відкидаються)"""
+    if not isinstance(row, dict):
+        return None
+    name = row.get("name")
+    if not isinstance(name, str) or not name.strip():
+        return None
+    clean = {"name": name.strip()}
+    for field in TABLE_FIELDS[table_type]:
+        value = row.get(field, False)
+        if not isinstance(value, bool):
+            logger.warning(f"Рядок {name!r}: поле {field} не булеве ({value!r}) — пропущено")
+            return None
+        clean[field] = value
+    return clean
+
+
+def parse_table(table_type: str, text: str) -> List[Dict[str, Any]]:
+    """Розбір повної відповіді structured output з перевіркою схеми"""
+    try:
+        data = loads(text)
+    except ValueError as e:
+        logger.error(f"Відповідь не є JSON: {e}")
+        return []
+    if not isinstance(data, list):
+        logger.error("Відповідь не є JSON-масивом")
+        return []
+    return [row for row in (validate_row(table_type, item) for item in data) if row]
+
+
+class TableRows(list):
+    """
+    Розпізнані рядки таблиці. complete=False — частину таблиці втрачено
+    (обірваний потік, неповна відповідь, помилка смуги чи фото): такий
+    результат показуємо з попередженням і не кешуємо.
+    """
+
+    def __init__(self, rows=(), complete: bool = True):
+        super().__init__(rows)
+        self.complete = complete
+
+
+def name_key(name: str) -> str:
+    """Ключ для зіставлення одного працівника з різних смуг фото"""
+    name = name.casefold().replace("’", "'").replace("ʼ", "'").replace(".", " ")
+    return " ".join(name.split())
+
+
+def merge_rows(table_type: str, parts: List[Optional[List[Dict[str, Any]]]]) -> List[Dict[str, Any]]:
+    """
+    Об'єднати результати смуг: рядок з перекриття трапляється двічі —
+    лишаємо перший, а позначки об'єднуємо (позначка, побачена хоч раз, — True).
+    """
+    merged: Dict[str, Dict[str, Any]] = {}
+    for rows in parts:
+        for row in rows or []:
+            key = name_key(row["name"])
+            if key not in merged:
+                merged[key] = dict(row)
+                continue
+            for field in TABLE_FIELDS[table_type]:
+                merged[key][field] = merged[key][field] or row[field]
+    return list(merged.values())
+
+
+def medical_needs(row: Dict[str, Any]) -> List[str]:
+    """Скорочення оглядів, які працівнику потрібно пройти"""
+    return [short for field, short in MEDICAL_FIELDS.items() if row.get(field)]
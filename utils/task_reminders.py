@@ -0,0 +1,144 @@
+import asyncio
+import heapq
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from utils.repository import Repository
+
+logger = logging.getLogger(__name__)
+
+# Через скільки секунд повторити нагадування, якщо відправка не вдалася
+RETRY_DELAY = 60
+# Перша пауза перед повторним завантаженням нагадувань з БД (далі ×2, до RETRY_DELAY)
+LOAD_RETRY_BASE = 5
+
+
+class TaskReminderEngine:
+    """
+    Нагадування про завдання без опитування БД.
+    Незавершені remind_at читаються один раз при старті в купу (heapq),
+    далі рушій спить рівно до найближчого терміну. Обробники завдань
+    повідомляють рушій про зміни через schedule()/cancel().
+    """
+
+    def __init__(self, repository: Repository,
+                 on_due: Callable[[List[Tuple[int, str]]], Awaitable[None]],
+                 snooze: timedelta = timedelta(hours=1)):
+        self.repo = repository
+        self.on_due = on_due
+        self.snooze = snooze
+        self._heap: List[Tuple[float, int]] = []
+        # Актуальний термін і назва для кожного завдання; записи в купі,
+        # що не збігаються з _due_at, вважаються застарілими (ліниве видалення)
+        self._due_at: Dict[int, float] = {}
+        self._titles: Dict[int, str] = {}
+        self._wakeup = asyncio.Event()
+        self._runner: Optional[asyncio.Task] = None
+        # Завдання, змінені через schedule()/cancel() до завантаження з БД:
+        # їхній стан новіший за прочитаний, тож завантаження його не перезаписує
+        self._loaded = False
+        self._touched: Set[int] = set()
+
+    async def start(self):
+        """Запустити рушій; нагадування з БД він завантажує сам, з повторами, якщо БД недоступна"""
+        self._runner = asyncio.create_task(self._run())
+
+    async def _load(self):
+        delay = LOAD_RETRY_BASE
+        while True:
+            try:
+                pending = await self.repo.get_pending_reminders()
+                break
+            except Exception as e:
+                logger.error(f"Не вдалося завантажити нагадування: {e}. Повтор через {delay} с")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, RETRY_DELAY)
+        for task_id, title, due_ts in pending:
+            if task_id not in self._touched:
+                self._push(task_id, title, due_ts)
+        self._loaded = True
+        self._touched.clear()
+        logger.info(f"⏰ Завантажено нагадувань: {len(self._due_at)}")
+
+    async def stop(self):
+        if self._runner:
+            self._runner.cancel()
+            try:
+                await self._runner
+            except asyncio.CancelledError:
+                pass
+            self._runner = None
+
+    def schedule(self, task_id: int, title: str, remind_at: datetime):
+        if not self._loaded:
+            self._touched.add(task_id)
+        self._push(task_id, title, remind_at.timestamp())
+        self._wakeup.set()
+
+    def cancel(self, task_id: int):
+        if not self._loaded:
+            self._touched.add(task_id)
+        if self._due_at.pop(task_id, None) is not None:
+            self._titles.pop(task_id, None)
+            self._wakeup.set()
+
+    def _push(self, task_id: int, title: str, due_ts: float):
+        self._due_at[task_id] = due_ts
+        self._titles[task_id] = title
+        heapq.heappush(self._heap, (due_ts, task_id))
+
+    def _is_current(self, due_ts: float, task_id: int) -> bool:
+        return self._due_at.get(task_id) == due_ts
+
+    def _pop_due(self, now: float) -> List[Tuple[float, int]]:
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            due_ts, task_id = heapq.heappop(self._heap)
+            if self._is_current(due_ts, task_id):
+                due.append((due_ts, task_id))
+        return due
+
+    async def _run(self):
+        await self._load()
+        while True:
+            self._wakeup.clear()
+            while self._heap and not self._is_current(*self._heap[0]):
+                heapq.heappop(self._heap)
+            delay = self._heap[0][0] - time.time() if self._heap else None
+            if delay is None or delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            due = self._pop_due(time.time())
+            try:
+                await self._fire(due)
+            except Exception as e:
+                # Зняті з купи нагадування не губимо: повертаємо їх з паузою
+                retry_at = time.time() + RETRY_DELAY
+                for due_ts, task_id in due:
+                    if self._is_current(due_ts, task_id):
+                        self._push(task_id, self._titles[task_id], retry_at)
+                logger.error(f"Task reminder error: {e}. Повтор через {RETRY_DELAY} с")
+
+    async def _fire(self, due: List[Tuple[float, int]]):
+        if not due:
+            return
+        await self.on_due([(task_id, self._titles[task_id]) for _, task_id in due])
+
+        # Повторне нагадування через snooze — одним UPDATE для всіх завдань,
+        # крім тих, що встигли виконати/видалити під час розсилки
+        still_pending = [(due_ts, task_id) for due_ts, task_id in due if self._is_current(due_ts, task_id)]
+        if not still_pending:
+            return
+        next_at = datetime.now().astimezone() + self.snooze
+        # Спершу в купу: нагадування вже надіслано, тож збій запису в БД не має призводити до повтору зараз
+        for _, task_id in still_pending:
+            self._push(task_id, self._titles[task_id], next_at.timestamp())
+        try:
+            await self.repo.snooze_tasks([task_id for _, task_id in still_pending], next_at)
+        except Exception as e:
+            logger.error(f"Не вдалося зберегти повторне нагадування в БД: {e}")
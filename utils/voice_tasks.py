@@ -0,0 +1,36 @@
+import logging
+from typing import List
+
+from aiogram import Bot
+from aiogram.types import Voice
+
+from utils.gemini_client import gemini
+from utils.result_cache import ResultCache, content_key
+
+logger = logging.getLogger(__name__)
+
+# Переслане чи повторне голосове має той самий file_unique_id — не розшифровуємо вдруге
+transcript_cache = ResultCache("voice_transcript", ttl=30 * 24 * 3600, max_items=256)
+
+
+async def transcribe_voice(bot: Bot, voice: Voice, prompt: str) -> str:
+    """
+    Розшифрувати голосове за промптом. Файл завантажується через сесію бота
+    (шматками в BytesIO) і йде в Gemini без проміжного base64-рядка.
+    Помилки Gemini (GeminiError) прокидаються далі.
+    """
+    key = f"{voice.file_unique_id}:{content_key(prompt)[:16]}"
+    cached = await transcript_cache.get(key)
+    if cached is not None:
+        logger.info(f"Голосове {voice.file_unique_id} вже розшифровано — беру з кешу")
+        return cached
+
+    audio = await bot.download(voice)
+    text = await gemini.generate(prompt, blob=audio.getbuffer(), mime_type=voice.mime_type or "audio/ogg",
+                                 feature="voice")
+    await transcript_cache.set([key], text)
+    return text
+
+
+def split_tasks(text: str, separator: str) -> List[str]:
+    return [item.strip() for item in text.split(separator) if item.strip()]